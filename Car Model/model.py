@@ -1,14 +1,34 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
 from ursina import *
 
+from batching import StaticBatch
+from broadphase import SpatialHash, entity_bounds
+from particles import ParticleEmitter
+from profiler import install, profiled
+from quality import Knob, QualityController
+from terrain import ChunkedTerrain
+
 app = Ursina()
+profiler = install(app)  # Off unless task-profiler is set
 
 window.borderless = False  # So you can resize the window easily
 
 # Load a car model (for now, just a simple cube)
 player = Entity(model='cube', color=color.red, scale=(1, 0.5, 2), collider='box')
 
-# Make a simple ground (the racetrack will be built on this later)
-ground = Entity(model='plane', texture='white_cube', texture_scale=(50, 50), scale=(100, 1, 100), collider='box')
+# Ground streams in chunks around the player (the racetrack will be built
+# on this later); hills stay clear of the walls
+ground = ChunkedTerrain(scene, amplitude=4, valley=8)
+ground.update(player.x, player.z)
+
+# Quality stepped down under load to hold the frame budget; off unless
+# adaptive-quality is set
+quality = QualityController.from_config(app, [
+    Knob('terrain-radius', (3, 2), ground.set_radius),
+])
 
 camera.position = (0, 20, -30)
 camera.rotation_x = 30
@@ -16,19 +36,6 @@ camera.rotation_x = 30
 speed = 5
 turn_speed = 60
 
-def update():
-    global speed
-    if held_keys['w']:
-        player.position += player.forward * time.dt * speed
-    if held_keys['s']:
-        player.position -= player.forward * time.dt * speed
-    if held_keys['a']:
-        player.rotation_y += turn_speed * time.dt
-    if held_keys['d']:
-        player.rotation_y -= turn_speed * time.dt
-
-app.run()
-
 # Create walls around the track
 walls = []
 for z in range(-50, 51, 10):
@@ -38,11 +45,25 @@ for z in range(-50, 51, 10):
 # Add a speed boost pad
 boost_pad = Entity(model='cube', color=color.azure, scale=(3, 0.1, 3), position=(0, 0.05, 20), collider='box')
 
-# Boost logic
+# Walls and pad are static: merge them into a few draw calls (see batching.py)
+static = StaticBatch(scene)
+static.add_many(walls + [boost_pad])
+
+# Collision broadphase
+colliders = SpatialHash(cell_size=10)
+for wall in walls:
+    colliders.add(wall, entity_bounds(wall), 'wall')
+colliders.add(boost_pad, entity_bounds(boost_pad), 'boost')
+colliders.add(player, entity_bounds(player), 'player')
+
+# Boost logic; the car trails exhaust while it boosts (see particles.py)
 boosting = False
+exhaust = ParticleEmitter(scene, capacity=2048, lifetime=0.6, size=0.3)
 
+@profiled
 def update():
     global boosting
+    previous_position = player.position
     if held_keys['w']:
         player.position += player.forward * time.dt * (speed * (2 if boosting else 1))
     if held_keys['s']:
@@ -52,11 +73,28 @@ def update():
     if held_keys['d']:
         player.rotation_y -= turn_speed * time.dt
 
-    # Boost if player touches the boost_pad
-    if player.intersects(boost_pad).hit:
-        boosting = True
-    else:
-        boosting = False
+    # Boost if player touches the boost_pad; walls stop the player
+    bounds = entity_bounds(player)
+    colliders.move(player, bounds)
+    boosting = False
+    for other in colliders.query(bounds, tags=('boost', 'wall'), exclude=player):
+        if not player.intersects(other).hit:
+            continue
+        if colliders.tags[other] == 'boost':
+            boosting = True
+        else:
+            player.position = previous_position
+            colliders.move(player, entity_bounds(player))
+
+    if boosting:
+        exhaust.stream(300, time.dt, scene.getRelativePoint(player, (0, 0.3, -0.6)),
+                       velocity=scene.getRelativeVector(player, (0, 0.5, -3)), spread=0.6, color=(1, 0.55, 0.15, 1))
+    exhaust.update(time.dt)
+
+    ground.update(player.x, player.z)
 
 
 Sky()
+
+if __name__ == '__main__':
+    app.run()
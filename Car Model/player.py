@@ -1,20 +1,87 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
 from ursina import *
 import random
 
+from async_loader import AsyncModelLoader, PROGRESS_EVENT
+from asset_cache import resolve_lod
+from batching import StaticBatch
+from broadphase import SpatialHash, entity_bounds
+from bvh import BVH, SpringArm, ground_heights, scene_triangles
+from fixed_step import FixedStep
+from fleet import AIFleet
+from lod import LODManager
+from netcode import RaceConnection
+from particles import ParticleEmitter
+from profiler import install, profiled
+from quality import Knob, QualityController
+from race_sim import TICK_RATE, input_mask
+from replay import InputSession
+from terrain import ChunkedTerrain
+from texture_cache import load_texture
+import numpy as np
+
 app = Ursina()
+profiler = install(app)  # Off unless task-profiler is set
+session = InputSession.from_config()  # Seeds random when recording/replaying
+net = RaceConnection.from_config()  # Races on a server when race-server is set
 
 window.borderless = False
 Sky()
 
-# Load real 3D models
-player = Entity(model='models/car.obj', texture='white_cube', scale=0.5, collider='box', position=(0, 0.5, -40))
+# Real 3D models stream in through the BAM cache (see asset_cache.py) on
+# the threaded loader; entities start out as plain cubes. Models with a
+# built LOD bundle get their detail level picked by distance.
+models = AsyncModelLoader(app.loader, resolve=resolve_lod)
+lods = LODManager(camera, scene)
+
+def load_async(entity, path, moving=False):
+    def loaded(model):
+        if model is not None:
+            entity.model = model
+            lods.add(entity.model, dynamic=moving)
+    models.load(application.asset_folder / path, loaded)
+
+loading_text = Text(text='Loading...', position=(-0.85, 0.45))
+
+# Static geometry for ray, sphere and nearest-point queries (see
+# build_queries below); loads can finish before it is first built
+query = None
+
+def loading_progress(done, total):
+    global loading_text
+    if loading_text is not None:
+        loading_text.text = f'Loading {done}/{total}'
+    if models.finished:
+        if loading_text is not None:
+            destroy(loading_text, delay=1)
+            loading_text = None
+        # The trees have their real models now
+        if query is not None:
+            build_queries()
+
+app.accept(PROGRESS_EVENT, loading_progress)
+
+player = Entity(model='cube', texture='white_cube', scale=0.5, collider='box', position=(0, 0.5, -40))
+load_async(player, 'models/car.obj', moving=True)
 
-ground = Entity(model='plane', texture='white_cube', texture_scale=(50,50), scale=(100,1,100), collider='box')
+# Track textures go through the mipmapped, compressed texture cache at the
+# tier picked for this GPU (see texture_cache.py)
+textures = Path(__file__).resolve().parent.parent / 'my ursina game' / 'textures'
+grass_texture = load_texture(textures / 'grass textures.jpg', gsg=app.win.getGsg())
+road_texture = Texture(load_texture(textures / 'road textures.jpg', gsg=app.win.getGsg()))
+
+# Ground streams in chunks around the player; hills stay clear of the track
+ground = ChunkedTerrain(scene, amplitude=4, valley=12)
+ground.root.setTexture(grass_texture)
+ground.update(player.x, player.z)
 
 # Racing track
 track = []
 for i in range(10):
-    track.append(Entity(model='cube', color=color.dark_gray, scale=(10, 0.1, 10), position=(0, 0.05, i*10 - 50), collider='box'))
+    track.append(Entity(model='cube', color=color.dark_gray, texture=road_texture, scale=(10, 0.1, 10), position=(0, 0.05, i*10 - 50), collider='box'))
 
 # Walls
 walls = []
@@ -30,46 +97,181 @@ for z in [-20, 0, 20, 40]:
 # Trees using real 3D models
 trees = []
 for _ in range(20):
-    trees.append(Entity(model='models/tree.obj', texture='white_cube', scale=1, position=(random.choice([-8, 8]), 2.5, random.randint(-50, 50))))
+    tree = Entity(model='cube', texture='white_cube', scale=1, position=(random.choice([-8, 8]), 2.5, random.randint(-50, 50)))
+    load_async(tree, 'models/tree.obj')
+    trees.append(tree)
 
 # AI planes (also real 3D models)
 ai_planes = []
 for _ in range(3):
-    ai_plane = Entity(model='models/ai_plane.obj', texture='white_cube', scale=0.5, position=(random.uniform(-3,3), 0.5, random.randint(-30,30)), collider='box')
+    ai_plane = Entity(model='cube', texture='white_cube', scale=0.5, collider='box')
+    load_async(ai_plane, 'models/ai_plane.obj', moving=True)
     ai_planes.append(ai_plane)
 
-# Camera setup
-camera.parent = player
-camera.position = (0, 5, -15)
-camera.rotation_x = 20
-
 # Movement variables
 speed = 5
 turn_speed = 80
 boosting = False
 
-def update():
+# The AI cars are simulated together as one vectorized fleet (see fleet.py)
+# that places these entities; they cruise at 80% of the player's speed
+fleet = AIFleet(len(ai_planes), speed=speed * 0.8)
+fleet.bind(ai_planes)
+
+# Track, walls and pads never move: draw them as a few merged Geoms
+# instead of one draw call per entity. Their colliders stay where they are.
+static = StaticBatch(scene)
+static.add_many(track + walls + boost_pads)
+
+# Collision broadphase: static colliders are bucketed once, moving bodies
+# are re-bucketed as they drive around
+colliders = SpatialHash(cell_size=10)
+for tile in track:
+    colliders.add(tile, entity_bounds(tile), 'track')
+for wall in walls:
+    colliders.add(wall, entity_bounds(wall), 'wall')
+for pad in boost_pads:
+    colliders.add(pad, entity_bounds(pad), 'boost')
+for ai in ai_planes:
+    colliders.add(ai, entity_bounds(ai), 'ai')
+colliders.add(player, entity_bounds(player), 'player')
+
+# The query geometry (see bvh.py): the track, walls, pads, trees and the
+# terrain around the track, built again once the tree models have loaded
+def build_queries():
+    global query
+    triangles = scene_triangles(track + walls + boost_pads + trees, scene)
+    query = BVH(np.concatenate([triangles, ground.triangles(-20, -70, 20, 70)]))
+    camera_arm.bvh = query
+
+# Cars ride this far above whatever is under them, as they always have
+# over the track
+RIDE_HEIGHT = 0.4
+
+# Camera setup: on a spring arm behind the player, pulled in when a wall
+# or tree is between the car and the camera
+camera.parent = player
+camera.rotation_x = 20
+camera_arm = SpringArm(camera, None, scene, pivot=(0, 2, 0), offset=(0, 3, -15))
+build_queries()
+
+# Other players' cars, created as they show up in snapshots
+rivals = {}
+
+def simulate_online(dt):
+    # The server runs the race (race_server.py): our car is predicted from
+    # our own input and corrected by every snapshot, everything else is
+    # placed from the snapshots
+    global boosting
+    net.step(input_mask(held_keys))
+    car = net.core.predicted()
+    if car is not None:
+        player.x, player.z, player.rotation_y, boosting = car
+    seen = set()
+    for eid, (x, z, heading, _, is_ai) in net.core.remote().items():
+        if is_ai and eid < len(ai_planes):
+            entity = ai_planes[eid]
+        else:
+            if eid not in rivals:
+                rivals[eid] = Entity(model='cube', color=color.orange, scale=0.5, position=(x, 0.5, z))
+                sim.track(rivals[eid])
+            entity = rivals[eid]
+            seen.add(eid)
+        entity.x, entity.z, entity.rotation_y = x, z, heading
+    for eid in [eid for eid in rivals if eid not in seen]:
+        sim.untrack(rivals[eid])
+        destroy(rivals.pop(eid))
+
+def simulate(dt):
     global boosting
+    if net:
+        simulate_online(dt)
+        return
 
     # Player controls
+    previous_position = player.position
     move_speed = speed * (2 if boosting else 1)
     if held_keys['w']:
-        player.position += player.forward * time.dt * move_speed
+        player.position += player.forward * dt * move_speed
     if held_keys['s']:
-        player.position -= player.forward * time.dt * move_speed
+        player.position -= player.forward * dt * move_speed
     if held_keys['a']:
-        player.rotation_y += turn_speed * time.dt
+        player.rotation_y += turn_speed * dt
     if held_keys['d']:
-        player.rotation_y -= turn_speed * time.dt
+        player.rotation_y -= turn_speed * dt
 
-    # Boost pad collision
-    boosting = any(player.intersects(pad).hit for pad in boost_pads)
+    # Move the AI fleet: lane keeping, spacing and wraparound for every car
+    # at once, then one sync to the entities
+    fleet.step(dt)
 
-    # Move AI planes forward automatically
-    for ai in ai_planes:
-        ai.position += ai.forward * time.dt * (speed * 0.8)
-        if ai.z > 60:
-            ai.z = -50
-            ai.x = random.uniform(-3, 3)
+    # Snap every car to the ground under it, all in one batch of rays;
+    # cars over nothing keep their height
+    cars = [player] + ai_planes
+    ground_y = ground_heights(query, [tuple(car.position) for car in cars], (0, 1, 0), probe=1.0)
+    for car, y in zip(cars, ground_y.tolist()):
+        if not np.isnan(y):
+            car.y = y + RIDE_HEIGHT
+
+    for ai, respawned in zip(ai_planes, fleet.respawned):
+        if respawned:
+            sim.snap(ai)
+        colliders.move(ai, entity_bounds(ai))
+
+    # Collisions: only colliders sharing a grid cell with the player go to
+    # the narrow phase
+    bounds = entity_bounds(player)
+    colliders.move(player, bounds)
+    boosting = False
+    for other in colliders.query(bounds, tags=('boost', 'wall', 'ai'), exclude=player):
+        if not player.intersects(other).hit:
+            continue
+        if colliders.tags[other] == 'boost':
+            boosting = True
+        else:
+            # Walls and other cars block the player
+            player.position = previous_position
+            colliders.move(player, entity_bounds(player))
+
+# Physics and boosts tick at a fixed 120 Hz whatever the frame rate (the
+# server's rate when online); the cars are drawn interpolated between the
+# last two ticks
+sim = FixedStep(simulate, rate=TICK_RATE if net else 120)
+sim.track(player)
+for ai in ai_planes:
+    sim.track(ai)
+if session:
+    session.attach(sim, held_keys, ('w', 'a', 's', 'd'), [player] + ai_planes)
+
+# Quality stepped down under load to hold the frame budget; off unless
+# adaptive-quality is set
+quality = QualityController.from_config(app, [
+    Knob('lod-bias', (1.0, 0.75, 0.5), lods.set_bias),
+    Knob('terrain-radius', (3, 2), ground.set_radius),
+])
+
+# Boost effects (see particles.py): exhaust behind the car while it boosts
+# and a burst of sparks off the pad it has just hit
+exhaust = ParticleEmitter(scene, capacity=2048, lifetime=0.6, size=0.3)
+sparks = ParticleEmitter(scene, capacity=1024, lifetime=0.8, size=0.15, gravity=6)
+was_boosting = False
+
+def update_effects(dt):
+    global was_boosting
+    if boosting:
+        exhaust.stream(300, dt, scene.getRelativePoint(player, (0, 0.3, -1.2)),
+                       velocity=scene.getRelativeVector(player, (0, 1, -6)), spread=0.6, color=(1, 0.55, 0.15, 1))
+        if not was_boosting:
+            sparks.emit(150, player.getPos(scene), velocity=(0, 3, 0), spread=2.5, color=(0.3, 0.7, 1, 1))
+    was_boosting = boosting
+    exhaust.update(dt)
+    sparks.update(dt)
+
+@profiled
+def update():
+    sim.advance(time.dt)
+    camera_arm.update(time.dt)
+    ground.update(player.x, player.z)
+    update_effects(time.dt)
 
-app.run()
+if __name__ == '__main__':
+    app.run()
@@ -1,12 +1,23 @@
 from direct.showbase.ShowBase import ShowBase
 from panda3d.core import (
-    Point3, Vec3, Geom, GeomNode, GeomVertexFormat, GeomVertexData, GeomTriangles,
-    GeomVertexWriter, NodePath, AmbientLight, DirectionalLight, Material, TextureStage, Texture
+    Point3, Vec3, NodePath, AmbientLight, DirectionalLight, Material, TextureStage, Texture
 )
-from panda3d.core import LPoint3f
 from direct.task import Task
+from concurrent.futures import ThreadPoolExecutor
 from math import sin, cos, radians
 import random
+import numpy as np
+
+from async_loader import AsyncModelLoader
+from bvh import BVH, SpringArm
+from fixed_step import FixedStep
+from geometry import make_mesh
+from meshopt import optimize_model
+from profiler import install
+from quality import Knob, QualityController
+from replay import InputSession
+from terrain import ChunkedTerrain
+from vegetation import Forest
 
 
 class MyGame(ShowBase):
@@ -15,16 +26,24 @@ class MyGame(ShowBase):
 
         self.disableMouse()  # We'll handle camera manually
 
+        # Input recording/replay, if asked for; it seeds random, so it comes
+        # before anything random is placed
+        self.session = InputSession.from_config()
+
+        # Models stream in on the threaded loader behind cheap placeholders,
+        # so the first frame doesn't wait for them
+        self.models = AsyncModelLoader(self.loader)
+
         # Create the world
         self.ground = self.make_ground()
-        self.ground.reparentTo(self.render)
 
         # Create player
         self.player = self.make_cube(color=(0.2, 0.8, 1.0, 1))
         self.player.reparentTo(self.render)
-        self.player.setPos(0, 10, 1)
+        self.player.setPos(0, 10, self.ground.height_at(0, 10) + 1)
 
-        # Add some trees
+        # Add some trees; they are all drawn as instances of one shared mesh
+        self.forest = Forest(self.loader, self.render, async_loader=self.models, camera=self.camera)
         for _ in range(15):
             self.make_tree(random.randint(-40, 40), random.randint(-40, 40))
 
@@ -42,17 +61,44 @@ class MyGame(ShowBase):
         self.accept("arrow_down", self.update_key, ["backward", True])
         self.accept("arrow_down-up", self.update_key, ["backward", False])
 
-        # Movement task
+        # Movement runs at a fixed 120 Hz; the player is drawn interpolated
+        # between the last two steps
+        self.sim = FixedStep(self.step_player, rate=120)
+        self.sim.track(self.player)
+        if self.session:
+            self.session.attach(self.sim, self.key_map, ("left", "right", "forward", "backward"), [self.player])
         self.taskMgr.add(self.move, "moveTask")
 
-        # Camera follow task
+        # Camera follow task. The camera sits on a spring arm behind the
+        # player that pulls in when terrain or a tree is in the way; the
+        # geometry it checks against is rebuilt on a worker as the player
+        # moves between terrain chunks.
+        self.camera_arm = SpringArm(self.camera, None, self.render, offset=(0, -20, 9))
+        self.bvh_key = None
+        self.bvh_build = None
+        self.bvh_builder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bvh")
         self.taskMgr.add(self.follow_camera, "cameraTask")
 
+        # Per-task timing overlay and trace; off unless task-profiler is set
+        self.profiler = install(self)
+
+        # Quality stepped down under load to hold the frame budget; off
+        # unless adaptive-quality is set
+        self.quality = QualityController.from_config(self, [
+            Knob("tree-lod-bias", (1.0, 0.75, 0.5), self.forest.set_lod_bias),
+            Knob("tree-distance", (150.0, 100.0, 60.0), self.forest.set_draw_distance),
+            Knob("terrain-radius", (3, 2), self.ground.set_radius),
+        ])
+
     def update_key(self, key, value):
         self.key_map[key] = value
 
     def move(self, task):
-        dt = globalClock.getDt()
+        self.sim.advance(globalClock.getDt())
+        self.ground.update(self.player.getX(), self.player.getY())
+        return Task.cont
+
+    def step_player(self, dt):
         move_speed = 10
 
         if self.key_map["left"]:
@@ -64,54 +110,64 @@ class MyGame(ShowBase):
         if self.key_map["backward"]:
             self.player.setY(self.player, -move_speed * dt)
 
-        return Task.cont
+        # Stay on the ground
+        self.player.setZ(self.ground.height_at(self.player.getX(), self.player.getY()) + 1)
 
     def follow_camera(self, task):
-        # Smooth follow the player
+        self.update_bvh()
+
+        # Follow the player from behind and above, closer in when the view
+        # is blocked
         player_pos = self.player.getPos()
-        cam_target = LPoint3f(player_pos.x, player_pos.y - 20, player_pos.z + 10)
-        self.camera.setPos(cam_target)
+        self.camera_arm.pivot = np.array((player_pos.x, player_pos.y, player_pos.z + 1), dtype=np.float32)
+        self.camera_arm.update(globalClock.getDt())
         self.camera.lookAt(self.player)
 
         return Task.cont
 
-    def make_cube(self, color=(1, 1, 1, 1)):
-        format = GeomVertexFormat.getV3n3()
-        vdata = GeomVertexData('cube', format, Geom.UHStatic)
-
-        vertex = GeomVertexWriter(vdata, 'vertex')
-        normal = GeomVertexWriter(vdata, 'normal')
+    def update_bvh(self):
+        # Static geometry around the player: the terrain chunks next to the
+        # one it's on and every tree. A new build starts when the player
+        # changes chunk or the trees change, and replaces the old one when
+        # it's done.
+        if self.bvh_build is not None and self.bvh_build.done():
+            self.camera_arm.bvh = self.bvh_build.result()
+            self.bvh_build = None
+        x, y = self.player.getX(), self.player.getY()
+        key = (self.ground.chunk_of(x, y), len(self.forest), bool(self.forest.mesh.meshes))
+        if key != self.bvh_key and self.bvh_build is None:
+            self.bvh_key = key
+            self.bvh_build = self.bvh_builder.submit(self.build_bvh, x, y, self.forest.tree_triangles())
+
+    def build_bvh(self, x, y, trees):
+        # Runs on the worker thread
+        reach = self.ground.chunk_size
+        terrain = self.ground.triangles(x - reach, y - reach, x + reach, y + reach)
+        return BVH(np.concatenate([terrain, trees]))
 
-        points = [
+    def make_cube(self, color=(1, 1, 1, 1)):
+        points = np.array([
             (-1, -1, -1), (1, -1, -1),
             (1, 1, -1), (-1, 1, -1),
             (-1, -1, 1), (1, -1, 1),
             (1, 1, 1), (-1, 1, 1)
-        ]
+        ], dtype=np.float32)
 
-        faces = [
+        faces = np.array([
             (0, 1, 2, 3),  # Bottom
             (4, 5, 6, 7),  # Top
             (0, 1, 5, 4),  # Front
             (2, 3, 7, 6),  # Back
             (0, 3, 7, 4),  # Left
             (1, 2, 6, 5)   # Right
-        ]
+        ])
 
-        for p in points:
-            vertex.addData3(*p)
-            normal.addData3(Vec3(p).normalized())
+        normals = points / np.linalg.norm(points, axis=1, keepdims=True)
+        triangles = faces[:, [0, 1, 2, 2, 3, 0]]
 
-        triangles = GeomTriangles(Geom.UHStatic)
-        for face in faces:
-            triangles.addVertices(face[0], face[1], face[2])
-            triangles.addVertices(face[2], face[3], face[0])
-
-        cube = Geom(vdata)
-        cube.addPrimitive(triangles)
-        node = GeomNode('cube')
-        node.addGeom(cube)
-        cube_np = NodePath(node)
+        # Welded, cache-ordered and packed into int16 positions and int8
+        # normals (see meshopt.py)
+        cube_np = optimize_model(make_mesh('cube', points, triangles, normals=normals))
 
         material = Material()
         material.setDiffuse(color)
@@ -119,27 +175,16 @@ class MyGame(ShowBase):
         return cube_np
 
     def make_ground(self):
-        cm = self.loader.loadModel("models/plane")  # Simple flat plane model
-        cm.setScale(50)
-        cm.setColor(0.3, 0.8, 0.3, 1)  # Greenish color
-        cm.setPos(0, 0, 0)
-
-        return cm
+        # Rolling terrain, streamed in chunks around the player
+        ground = ChunkedTerrain(self.render, seed=7)
+        ground.update(0, 10)
+        return ground
 
     def make_tree(self, x, y):
-        # Tree trunk
-        trunk = self.loader.loadModel("models/box")
-        trunk.setScale(0.5, 0.5, 2)
-        trunk.setColor(0.55, 0.27, 0.07, 1)
-        trunk.setPos(x, y, 1)
-        trunk.reparentTo(self.render)
-
-        # Tree leaves
-        leaves = self.loader.loadModel("models/sphere")
-        leaves.setScale(2)
-        leaves.setColor(0.0, 0.6, 0.0, 1)
-        leaves.setPos(x, y, 4)
-        leaves.reparentTo(self.render)
+        return self.forest.add_tree(x, y, self.ground.height_at(x, y))
+
+    def remove_tree(self, tree):
+        self.forest.remove_tree(tree)
 
     def add_lighting(self):
         ambient = AmbientLight('ambient')
@@ -154,5 +199,6 @@ class MyGame(ShowBase):
         self.render.setLight(directionalNP)
 
 
-game = MyGame()
-game.run()
+if __name__ == "__main__":
+    game = MyGame()
+    game.run()
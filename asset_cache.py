@@ -0,0 +1,372 @@
+from panda3d.core import ConfigVariableBool, Filename, Loader, LoaderOptions, NodePath, getModelPath
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+
+# Bump whenever the conversion changes so stale cache entries are rebuilt
+CONVERTER_VERSION = 1
+# Likewise for the mesh optimization (see meshopt.py)
+OPTIMIZER_VERSION = 1
+
+optimized_meshes = ConfigVariableBool(
+    "optimized-meshes", os.environ.get("OPTIMIZED_MESHES", "1") != "0",
+    "Load the welded, cache-ordered and quantized copies of cached models when they have been built.")
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(REPO_DIR, ".asset_cache")
+MODEL_EXTENSIONS = (".obj", ".3ds", ".egg", ".gltf", ".glb", ".bam")
+# Panda3D's own models the scenes use (found on its model-path), built
+# along with the repository's when no paths are given
+ENGINE_MODELS = ("models/box", "models/sphere")
+
+BAM_MAGIC = b"pbj\x00\n\r"
+GLB_MAGIC = b"glTF"
+# A 3DS file starts with the MAIN3DS chunk: id 0x4D4D, little endian
+MAX3DS_MAGIC = b"MM"
+
+_models = {}
+_resolved = {}
+# (path, format) -> (mtime, size, key), so an unchanged source is hashed once
+_keys = {}
+_warned = set()
+
+
+class AssetBuildError(Exception):
+    pass
+
+
+def locate(path):
+    # Absolute path of a source model: a file as given, else a model on
+    # Panda3D's model-path named the way loader.loadModel takes it
+    # ("models/box" for models/box.egg.pz)
+    path = str(path)
+    if os.path.isfile(path):
+        return os.path.abspath(path)
+    for extension in ("", ".egg", ".egg.pz", ".bam"):
+        found = Filename(path + extension)
+        if not os.path.isabs(path) and found.resolveFilename(getModelPath().getValue()):
+            return found.toOsSpecific()
+    return os.path.abspath(path)
+
+
+def source_extension(path):
+    # models/box.egg.pz is an egg file
+    root, extension = os.path.splitext(path.lower())
+    if extension == ".pz":
+        extension = os.path.splitext(root)[1]
+    return extension
+
+
+def detect_format(path):
+    # Look at the content rather than the extension; diamond.obj, for one,
+    # is really a binary 3DS file
+    if not os.path.isfile(path):
+        raise AssetBuildError("%s: file not found" % path)
+    if path.lower().endswith(".pz") and source_extension(path) in (".egg", ".bam"):
+        # Panda3D-compressed; the loader inflates it by itself
+        return source_extension(path)[1:]
+    with open(path, "rb") as f:
+        head = f.read(512)
+    if not head:
+        raise AssetBuildError("%s: file is empty" % path)
+
+    if head.startswith(BAM_MAGIC):
+        return "bam"
+    if head.startswith(GLB_MAGIC):
+        return "glb"
+    if head.startswith(MAX3DS_MAGIC) and len(head) >= 6:
+        size = int.from_bytes(head[2:6], "little")
+        if size == os.path.getsize(path):
+            return "3ds"
+
+    if b"\0" in head:
+        raise AssetBuildError("%s: unrecognized binary model format" % path)
+    # Text formats are told apart by their first line that isn't blank or
+    # a comment, however long the comment header before it; bytes that
+    # aren't UTF-8 (e.g. Latin-1 names in comments) don't matter
+    with open(path, encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                break
+        else:
+            line = ""
+    if line.startswith("{"):
+        return "gltf"
+    if line.startswith("<"):
+        return "egg"
+    if line and line.split(None, 1)[0] in ("v", "vn", "vt", "f", "o", "g", "s", "mtllib", "usemtl"):
+        return "obj"
+    raise AssetBuildError("%s: unrecognized model format" % path)
+
+
+def cache_key(path, fmt):
+    stat = os.stat(path)
+    known = _keys.get((path, fmt))
+    if known is not None and known[:2] == (stat.st_mtime_ns, stat.st_size):
+        return known[2]
+    digest = hashlib.sha256()
+    digest.update(("%s:%d:" % (fmt, CONVERTER_VERSION)).encode())
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    _keys[(path, fmt)] = (stat.st_mtime_ns, stat.st_size, digest.hexdigest())
+    return digest.hexdigest()
+
+
+def cache_path(path, cache_dir=CACHE_DIR):
+    fmt = detect_format(path)
+    return os.path.join(cache_dir, cache_key(path, fmt) + ".bam")
+
+
+def warn(error):
+    message = str(error)
+    if message not in _warned:
+        _warned.add(message)
+        print("warning: %s" % message, file=sys.stderr)
+
+
+def load_source(path, fmt):
+    # Panda picks the loader by extension, so give the file the one that
+    # matches its real content when they disagree
+    options = LoaderOptions(LoaderOptions.LF_report_errors | LoaderOptions.LF_no_cache)
+    source = path
+    staged = None
+    if source_extension(path) != "." + fmt:
+        staged = tempfile.mkdtemp(prefix="asset-")
+        source = os.path.join(staged, os.path.splitext(os.path.basename(path))[0] + "." + fmt)
+        shutil.copyfile(path, source)
+    try:
+        node = Loader.getGlobalPtr().loadSync(Filename.fromOsSpecific(source), options)
+    finally:
+        if staged:
+            shutil.rmtree(staged, ignore_errors=True)
+
+    if node is None:
+        raise AssetBuildError("%s: could not be parsed as %s" % (path, fmt))
+    model = NodePath(node)
+    if model.find("**/+GeomNode").isEmpty():
+        raise AssetBuildError("%s: contains no geometry" % path)
+    return model
+
+
+def compile_asset(path, cache_dir=CACHE_DIR):
+    # Returns the cached BAM for a source model, converting it first if the
+    # cache has no entry for this content and converter version
+    fmt = detect_format(path)
+    target = os.path.join(cache_dir, cache_key(path, fmt) + ".bam")
+    if os.path.exists(target):
+        return target, False
+
+    model = load_source(path, fmt)
+    os.makedirs(cache_dir, exist_ok=True)
+    write_bam(model, target, path)
+    return target, True
+
+
+def write_bam(model, target, path):
+    # Written under a temporary name and moved into place, so a cache entry
+    # is never seen half written
+    fd, staging = tempfile.mkstemp(suffix=".bam", dir=os.path.dirname(target))
+    os.close(fd)
+    if not model.writeBamFile(Filename.fromOsSpecific(staging)):
+        os.remove(staging)
+        raise AssetBuildError("%s: could not write %s" % (path, target))
+    os.replace(staging, target)
+
+
+def compile_lods(path, cache_dir=CACHE_DIR):
+    # Next to the BAM, write an LOD bundle: the model and its simplified
+    # levels under one LODNode (see lod.py). Returns (target, triangles per
+    # level), where triangles is None if the bundle was already built.
+    from lod import build_levels, lod_model
+
+    source, _ = compile_asset(path, cache_dir)
+    target = source[:-len(".bam")] + ".lod.bam"
+    if os.path.exists(target):
+        return target, None
+
+    levels, triangles = build_levels(load_bam(source))
+    write_bam(lod_model(levels), target, path)
+    return target, triangles
+
+
+def optimized_path(target):
+    # The optimized copy of a cached BAM (model or LOD bundle) sits next to it
+    return target[:-len(".bam")] + ".opt%d.bam" % OPTIMIZER_VERSION
+
+
+def compile_optimized(target, path):
+    # Next to a cached BAM, write its copy with every mesh welded, reordered
+    # for the vertex cache and quantized (see meshopt.py). Returns (target,
+    # (before, after)) with the meshopt.mesh_report() of both, or None for
+    # them if the copy was already built.
+    from meshopt import mesh_report, optimize_model
+
+    optimized = optimized_path(target)
+    if os.path.exists(optimized):
+        return optimized, None
+    model = load_bam(target)
+    result = optimize_model(model)
+    write_bam(result, optimized, path)
+    return optimized, (mesh_report(model), mesh_report(result))
+
+
+def prefer_optimized(target):
+    if target is not None and optimized_meshes.getValue():
+        optimized = optimized_path(target)
+        if os.path.exists(optimized):
+            return optimized
+    return target
+
+
+def load_bam(target):
+    options = LoaderOptions(LoaderOptions.LF_report_errors | LoaderOptions.LF_no_cache)
+    node = Loader.getGlobalPtr().loadSync(Filename.fromOsSpecific(target), options)
+    if node is None:
+        raise AssetBuildError("%s: cached model could not be read" % target)
+    return NodePath(node)
+
+
+def load_model(path, cache_dir=CACHE_DIR):
+    # Runtime hook: load a source model through the BAM cache. Each call
+    # returns a fresh copy so callers may reparent and modify it freely.
+    # Missing or broken assets give a warning and None, like Ursina does.
+    path = locate(path)
+    if path not in _resolved:
+        try:
+            _resolved[path], _ = compile_asset(path, cache_dir)
+        except AssetBuildError as e:
+            warn(e)
+            _resolved[path] = None
+    target = prefer_optimized(_resolved[path])
+    if target is None:
+        return None
+    if target not in _models:
+        _models[target] = load_bam(target)
+    return _models[target].copyTo(NodePath())
+
+
+def resolve(path, cache_dir=CACHE_DIR, lod=False, optimized=True):
+    # Path to hand to Panda's own (possibly threaded) loader: the cached
+    # BAM when it has been built, else the source itself if Panda can read
+    # it as named; a source whose extension doesn't match its content
+    # (diamond.obj) is converted on the spot. None, with a warning, when
+    # the source is missing or broken. With lod, the LOD
+    # bundle is preferred when it has been built, and either one's
+    # optimized copy when that has (unless optimized is false, for callers
+    # that bake the vertices into something else).
+    path = locate(path)
+    try:
+        fmt = detect_format(path)
+        target = os.path.join(cache_dir, cache_key(path, fmt) + ".bam")
+        if not os.path.exists(target) and source_extension(path) != "." + fmt:
+            compile_asset(path, cache_dir)
+    except AssetBuildError as e:
+        warn(e)
+        return None
+    pick = prefer_optimized if optimized else (lambda target: target)
+    bundle = target[:-len(".bam")] + ".lod.bam"
+    if lod and os.path.exists(bundle):
+        return pick(bundle)
+    return pick(target) if os.path.exists(target) else path
+
+
+def resolve_lod(path, cache_dir=CACHE_DIR):
+    return resolve(path, cache_dir, lod=True)
+
+
+def find_models(root=REPO_DIR):
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith(".") and d != "__pycache__"]
+        for name in filenames:
+            if name.lower().endswith(MODEL_EXTENSIONS):
+                found.append(os.path.join(dirpath, name))
+    return sorted(found)
+
+
+def build(paths, cache_dir=CACHE_DIR, lods=True, optimize=True):
+    # Compile every asset, timing the source parse (cold) and the cached
+    # BAM load (warm), and build its LOD bundle and the optimized copies of
+    # both. Returns the rows and the errors.
+    from lod import count_triangles
+    from meshopt import mesh_report
+
+    rows = []
+    errors = []
+    for path in paths:
+        try:
+            fmt = detect_format(path)
+            target = os.path.join(cache_dir, cache_key(path, fmt) + ".bam")
+            start = time.perf_counter()
+            load_source(path, fmt)
+            cold = time.perf_counter() - start
+            compile_asset(path, cache_dir)
+            start = time.perf_counter()
+            load_bam(target)
+            warm = time.perf_counter() - start
+            triangles = None
+            if lods:
+                triangles = compile_lods(path, cache_dir)[1]
+                if triangles is None:
+                    # Already built; count the levels in the bundle
+                    bundle = load_bam(target[:-len(".bam")] + ".lod.bam")
+                    triangles = [count_triangles(level) for level in bundle.getChildren()]
+            report = None
+            if optimize:
+                optimized, report = compile_optimized(target, path)
+                if report is None:
+                    report = (mesh_report(load_bam(target)), mesh_report(load_bam(optimized)))
+                if lods:
+                    compile_optimized(target[:-len(".bam")] + ".lod.bam", path)
+        except AssetBuildError as e:
+            errors.append(str(e))
+            continue
+        rows.append((path, fmt, cold, warm, triangles, report))
+    return rows, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert source models to cached BAM files.")
+    parser.add_argument("paths", nargs="*", help="models to build (default: every model in the repo)")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--clean", action="store_true", help="empty the cache before building")
+    parser.add_argument("--no-lods", dest="lods", action="store_false", help="skip the LOD bundles")
+    parser.add_argument("--no-optimize", dest="optimize", action="store_false",
+                        help="skip the optimized copies")
+    args = parser.parse_args(argv)
+
+    if args.clean and os.path.isdir(args.cache_dir):
+        shutil.rmtree(args.cache_dir)
+    paths = [locate(p) for p in args.paths] or find_models() + [
+        path for path in map(locate, ENGINE_MODELS) if os.path.isfile(path)]
+
+    rows, errors = build(paths, args.cache_dir, args.lods, args.optimize)
+    if rows:
+        # Vertex memory and transform cost (vertices the post-transform
+        # cache misses per triangle) of the model before and after its
+        # optimization
+        print(f"{'asset':<40} {'format':>6} {'cold ms':>9} {'warm ms':>9} {'vertex KB':>15} "
+              f"{'transforms/tri':>15}  lod triangles")
+        for path, fmt, cold, warm, triangles, report in rows:
+            name = os.path.relpath(path, REPO_DIR)
+            levels = " / ".join(str(t) for t in triangles) if triangles else "-"
+            memory = cost = "-"
+            if report is not None:
+                (_, size, tris, transformed), (_, optimized_size, _, optimized_transformed) = report
+                memory = f"{size / 1024:.1f} -> {optimized_size / 1024:.1f}"
+                cost = f"{transformed / max(tris, 1):.2f} -> {optimized_transformed / max(tris, 1):.2f}"
+            print(f"{name:<40} {fmt:>6} {cold * 1000:>9.2f} {warm * 1000:>9.2f} {memory:>15} {cost:>15}  {levels}")
+    for error in errors:
+        print("error: %s" % error, file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
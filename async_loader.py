@@ -0,0 +1,100 @@
+from direct.showbase.MessengerGlobal import messenger
+from direct.task.TaskManagerGlobal import taskMgr
+from panda3d.core import NodePath
+from geometry import make_mesh
+from collections import deque
+import numpy as np
+
+
+PROGRESS_EVENT = "async-load-progress"
+
+BOX_POINTS = np.array([
+    (-0.5, -0.5, -0.5), (0.5, -0.5, -0.5), (0.5, 0.5, -0.5), (-0.5, 0.5, -0.5),
+    (-0.5, -0.5, 0.5), (0.5, -0.5, 0.5), (0.5, 0.5, 0.5), (-0.5, 0.5, 0.5)
+], dtype=np.float32)
+BOX_FACES = np.array([
+    (0, 2, 1), (0, 3, 2), (4, 5, 6), (4, 6, 7), (0, 1, 5), (0, 5, 4),
+    (2, 3, 7), (2, 7, 6), (1, 2, 6), (1, 6, 5), (3, 0, 4), (3, 4, 7)
+])
+
+
+def placeholder_box():
+    # Unit box stand-in; the Geom is shared by every placeholder
+    box = make_mesh("placeholder", BOX_POINTS, BOX_FACES, key="placeholder-box")
+    box.setColor(0.6, 0.6, 0.6, 1)
+    return box
+
+
+class AsyncModelLoader:
+    # Queues model loads on Panda3D's threaded loader, keeping at most
+    # max_in_flight requests outstanding. Progress is reported through
+    # PROGRESS_EVENT with (done, total) and through the progress property.
+
+    def __init__(self, loader, max_in_flight=4, resolve=None):
+        self.loader = loader
+        self.max_in_flight = max_in_flight
+        # Optional path -> path mapping run before a load, e.g. to find a
+        # cached BAM; returning None marks the asset as unavailable
+        self.resolve = resolve
+        self.queue = deque()
+        self.in_flight = 0
+        self.total = 0
+        self.done = 0
+
+    @property
+    def progress(self):
+        return self.done / self.total if self.total else 1.0
+
+    @property
+    def finished(self):
+        # Nothing queued or in flight; done == total alone can be hit
+        # while later loads are still waiting for a slot
+        return not self.queue and self.in_flight == 0
+
+    def load(self, path, callback):
+        # callback receives the loaded NodePath, or None if it failed
+        self.total += 1
+        self.queue.append((path, callback))
+        self.pump()
+
+    def load_into(self, path, parent, placeholder=None, callback=None):
+        # Returns a holder node under parent showing the placeholder right
+        # away; the real model replaces it inside the holder once loaded
+        holder = parent.attachNewNode("loading:%s" % path)
+        if placeholder is None:
+            placeholder = placeholder_box()
+        placeholder.reparentTo(holder)
+
+        def swap(model):
+            if model is not None and not holder.isEmpty():
+                placeholder.removeNode()
+                model.reparentTo(holder)
+            if callback is not None:
+                callback(model)
+
+        self.load(path, swap)
+        return holder
+
+    def pump(self):
+        while self.queue and self.in_flight < self.max_in_flight:
+            path, callback = self.queue.popleft()
+            if self.resolve is not None:
+                path = self.resolve(path)
+            self.in_flight += 1
+            if path is None:
+                # Reported on the next frame like any other load, so loads
+                # requested together are all counted before any finishes
+                taskMgr.add(lambda task, cb=callback: self.loaded(cb, None), "async-load-missing")
+                continue
+            self.loader.loadModel(path, okMissing=True,
+                                  callback=lambda model, cb=callback: self.loaded(cb, model))
+
+    def loaded(self, callback, model):
+        self.in_flight -= 1
+        self.finish(callback, model)
+        self.pump()
+
+    def finish(self, callback, model):
+        self.done += 1
+        callback(model)
+        messenger.send(PROGRESS_EVENT, [self.done, self.total])
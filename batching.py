@@ -0,0 +1,99 @@
+from panda3d.core import ConfigVariableBool, NodePath
+from direct.task.TaskManagerGlobal import taskMgr
+import os
+
+
+static_batching = ConfigVariableBool(
+    "static-batching", os.environ.get("STATIC_BATCHING", "1") != "0",
+    "Merge the geometry of static scene pieces into a few batched Geoms.")
+
+
+def draw_calls(root):
+    # Geoms that reach the cull pass under root: every Geom of a visible
+    # GeomNode is its own draw call (before frustum culling)
+    return sum(path.node().getNumGeoms() for path in root.findAllMatches("**/+GeomNode")
+               if not path.isHidden())
+
+
+class StaticBatch:
+    # Copies the geometry of static nodes into one batch node and flattens
+    # it, so pieces sharing a texture and material end up in a single Geom
+    # instead of one node and draw call each. The original nodes stay in
+    # the scene graph with only their geometry hidden, so colliders, tags
+    # and broadphase entries keep working on them as before.
+    #
+    # A member whose transform changes after batching is dropped from the
+    # batch and drawn on its own again; the batch is rebuilt without it on
+    # the same frame, before anything is rendered.
+
+    def __init__(self, parent, name="static-batch", enabled=None):
+        self.name = name
+        self.enabled = static_batching.getValue() if enabled is None else enabled
+        self.root = parent.attachNewNode(name)
+        self.members = {}
+        self.dirty = False
+        self.rebuilds = 0
+        # After game logic, before the frame is culled and drawn (igLoop, 50)
+        self.task = taskMgr.add(self.update, "batch-" + name, sort=45)
+
+    def add(self, node, geometry=None):
+        # node is what game code moves (e.g. an Ursina entity); geometry is
+        # the subtree that gets drawn, node itself by default. For entities
+        # pass entity.model so the collider isn't hidden along with it.
+        if not self.enabled:
+            return
+        self.members[node] = [geometry if geometry is not None else node, None]
+        self.dirty = True
+
+    def add_many(self, nodes):
+        for node in nodes:
+            self.add(node, getattr(node, "model", None))
+
+    def remove(self, node):
+        # Hand the node back to the regular scene graph
+        member = self.members.pop(node, None)
+        if member is not None:
+            member[0].show()
+            self.dirty = True
+
+    def __contains__(self, node):
+        return node in self.members
+
+    def build(self):
+        self.root.getChildren().detach()
+        if self.members:
+            collect = NodePath("collect")
+            for node, member in self.members.items():
+                geometry = member[0]
+                geometry.show()
+                copy = geometry.copyTo(collect)
+                # Bake in everything inherited from above, so the copy looks
+                # the same with the batch root as its parent
+                copy.setTransform(geometry.getTransform(self.root))
+                copy.setState(geometry.getNetState())
+                geometry.hide()
+                member[1] = node.getNetTransform()
+            # Applies the transforms and color scales to the vertices and
+            # merges everything that ends up with the same render state
+            collect.flattenStrong()
+            collect.getChildren().reparentTo(self.root)
+        self.dirty = False
+        self.rebuilds += 1
+
+    def update(self, task):
+        moved = [node for node, (geometry, placed) in self.members.items()
+                 if placed is not None and node.getNetTransform() != placed]
+        for node in moved:
+            self.remove(node)
+        if self.dirty:
+            self.build()
+        return task.cont
+
+    def draw_calls(self):
+        return draw_calls(self.root)
+
+    def destroy(self):
+        taskMgr.remove(self.task)
+        for node in list(self.members):
+            self.remove(node)
+        self.root.removeNode()
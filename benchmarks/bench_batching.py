@@ -0,0 +1,88 @@
+# Draw calls and median frame time of the Ursina scenes with static
+# batching off and on. The window is tiny so the time is mostly the
+# per-node and per-draw-call CPU cost rather than fill rate. Each run
+# builds its scene in a fresh process (Ursina is a singleton) and drives
+# it with the scene's keys held. Run from the repository root:
+#   python -m benchmarks.bench_batching
+#   python -m benchmarks.bench_batching racer --frames 600
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from scenes import REPO_DIR, SCENES
+
+BATCHED_SCENES = ["car-model", "racer"]
+
+
+def measure(name, frames, warmup):
+    from panda3d.core import ClockObject, loadPrcFileData
+    loadPrcFileData("bench_batching", "audio-library-name null\nsync-video #f\nwin-size 64 64")
+    from batching import draw_calls
+
+    scene = SCENES[name]
+    base, module = scene.load("offscreen")
+    clock = ClockObject.getGlobalClock()
+    clock.setMode(ClockObject.MNonRealTime)
+    clock.setFrameRate(60)
+    scene.hold_keys(base, module)
+
+    for _ in range(warmup):
+        base.taskMgr.step()
+    samples = []
+    for _ in range(frames):
+        start = time.perf_counter()
+        base.taskMgr.step()
+        samples.append(time.perf_counter() - start)
+    # Median, so a stray slow frame (e.g. a terrain chunk build) doesn't
+    # swamp the difference
+    ms = sorted(samples)[len(samples) // 2] * 1000
+
+    static = getattr(module, "static", None)
+    return {
+        "draw_calls": draw_calls(base.render),
+        "batch_draw_calls": static.draw_calls() if static is not None and static.enabled else None,
+        "batched": len(static.members) if static is not None else 0,
+        "rebuilds": static.rebuilds if static is not None else 0,
+        "frame_ms": ms,
+    }
+
+
+def run(name, batching, args):
+    command = [sys.executable, "-m", "benchmarks.bench_batching", "--child", name,
+               "--frames", str(args.frames), "--warmup", str(args.warmup)]
+    env = dict(os.environ, STATIC_BATCHING="1" if batching else "0")
+    proc = subprocess.run(command, cwd=REPO_DIR, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        lines = proc.stderr.strip().splitlines()
+        return {"error": lines[-1] if lines else "exit %d" % proc.returncode}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare draw calls and frame time with static batching.")
+    parser.add_argument("scenes", nargs="*", help="scenes to run (default: %s)" % ", ".join(BATCHED_SCENES))
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=30)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(measure(args.child, args.frames, args.warmup)))
+        return 0
+
+    print(f"{'scene':<10} {'batched':>7} {'draws off':>9} {'draws on':>8} {'ms off':>7} {'ms on':>6}")
+    for name in args.scenes or BATCHED_SCENES:
+        off, on = run(name, False, args), run(name, True, args)
+        if "error" in off or "error" in on:
+            print(f"{name:<10} error: {off.get('error') or on.get('error')}")
+            continue
+        print(f"{name:<10} {on['batched']:>7} {off['draw_calls']:>9} {on['draw_calls']:>8} "
+              f"{off['frame_ms']:>7.2f} {on['frame_ms']:>6.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+# Per-frame collision cost of the old linear scan (narrow phase against every
+# pad/wall/car) against the SpatialHash broadphase, with the track growing
+# in length. Run from the repository root:
+#   python -m benchmarks.bench_broadphase
+from broadphase import SpatialHash
+import random
+import time
+
+COLLIDER_COUNTS = [10, 100, 1000, 10000]
+FRAMES = 200
+
+
+def overlaps(a, b):
+    # Stand-in for Entity.intersects; the real call is far more expensive,
+    # so the narrow-phase call count matters as much as the time
+    return a[0] <= b[2] and a[2] >= b[0] and a[1] <= b[3] and a[3] >= b[1]
+
+
+def box(x, z, half_x, half_z):
+    return (x - half_x, z - half_z, x + half_x, z + half_z)
+
+
+def make_track(count, rng):
+    # Walls on both sides, pads down the middle and AI cars in between,
+    # spread along a track whose length grows with the collider count
+    length = count * 5
+    statics = []
+    for i in range(count):
+        z = rng.uniform(0, length)
+        if i % 3 == 2:
+            statics.append(("boost", box(0, z, 1.5, 1.5)))
+        else:
+            statics.append(("wall", box(rng.choice([-5, 5]), z, 0.5, 5)))
+    cars = [[rng.uniform(-3, 3), rng.uniform(0, length)] for _ in range(max(1, count // 10))]
+    return statics, cars, length
+
+
+def run_linear(statics, cars, length):
+    player = [0.0, 0.0]
+    calls = 0
+    start = time.perf_counter()
+    for frame in range(FRAMES):
+        player[1] = frame * length / FRAMES
+        for car in cars:
+            car[1] = (car[1] + 0.5) % length
+        bounds = box(player[0], player[1], 0.5, 1)
+        for _, other in statics:
+            calls += 1
+            overlaps(bounds, other)
+        for car in cars:
+            calls += 1
+            overlaps(bounds, box(car[0], car[1], 0.5, 1))
+    return (time.perf_counter() - start) / FRAMES * 1e6, calls / FRAMES
+
+
+def run_hash(statics, cars, length):
+    grid = SpatialHash(cell_size=10)
+    for i, (tag, bounds) in enumerate(statics):
+        grid.add(("static", i), bounds, tag)
+    for i, car in enumerate(cars):
+        grid.add(("car", i), box(car[0], car[1], 0.5, 1), "ai")
+    grid.add("player", box(0, 0, 0.5, 1), "player")
+
+    player = [0.0, 0.0]
+    calls = 0
+    moving = 0.0
+    querying = 0.0
+    for frame in range(FRAMES):
+        start = time.perf_counter()
+        player[1] = frame * length / FRAMES
+        for i, car in enumerate(cars):
+            car[1] = (car[1] + 0.5) % length
+            grid.move(("car", i), box(car[0], car[1], 0.5, 1))
+        mid = time.perf_counter()
+        bounds = box(player[0], player[1], 0.5, 1)
+        grid.move("player", bounds)
+        for other in grid.query(bounds, tags=("boost", "wall", "ai"), exclude="player"):
+            calls += 1
+            overlaps(bounds, grid.bounds[other])
+        end = time.perf_counter()
+        moving += mid - start
+        querying += end - mid
+    return querying / FRAMES * 1e6, moving / FRAMES * 1e6, calls / FRAMES
+
+
+def main():
+    # "rebucket" is the cost of moving the AI cars, which the linear scan
+    # also pays (without the bucketing); "query" is the collision check itself
+    print(f"{'colliders':>10} {'linear us':>10} {'calls':>7} {'query us':>9} {'rebucket us':>12} {'calls':>7}")
+    for count in COLLIDER_COUNTS:
+        statics, cars, length = make_track(count, random.Random(count))
+        linear, linear_calls = run_linear(statics, [list(c) for c in cars], length)
+        query, rebucket, hash_calls = run_hash(statics, [list(c) for c in cars], length)
+        print(f"{count:>10} {linear:>10.1f} {linear_calls:>7.0f} {query:>9.1f} {rebucket:>12.1f} {hash_calls:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# Frame time of IllusionGame's cube animation set per node from Python
+# against the shader mode, where Python only updates one uniform. Run from
+# the repository root:
+#   python -m benchmarks.bench_cube_animation
+from panda3d.core import loadPrcFileData
+# A tiny buffer keeps software rasterization out of the measurement so the
+# numbers reflect the per-frame animation and draw submission.
+loadPrcFileData("", "window-type offscreen\nwin-size 64 64\naudio-library-name null\nsync-video #f")
+
+from direct.showbase.ShowBase import ShowBase
+from panda3d.core import AmbientLight, PointLight
+from cube_field import PythonCubes, ShaderCubes, field_layout
+import time
+
+CUBE_COUNTS = [1, 1000, 50000]
+FRAMES = 30
+
+
+def frame_time(base, cubes):
+    # Returns (frame ms, of which ms in the animation update)
+    spent = [0.0]
+
+    def animate(task):
+        start = time.perf_counter()
+        cubes.update(task.time)
+        spent[0] += time.perf_counter() - start
+        return task.cont
+
+    base.taskMgr.add(animate, "animate_cube")
+    # Warm up so shader compilation and buffer uploads aren't counted
+    for _ in range(5):
+        base.taskMgr.step()
+    spent[0] = 0.0
+    start = time.perf_counter()
+    for _ in range(FRAMES):
+        base.taskMgr.step()
+    elapsed = time.perf_counter() - start
+    base.taskMgr.remove("animate_cube")
+    return elapsed / FRAMES * 1000, spent[0] / FRAMES * 1000
+
+
+def main():
+    base = ShowBase()
+    base.disableMouse()
+    cube = base.loader.loadModel("models/box")
+
+    ambient = base.render.attachNewNode(AmbientLight("ambient"))
+    ambient.node().setColor((0.3, 0.3, 0.3, 1))
+    base.render.setLight(ambient)
+    light = base.render.attachNewNode(PointLight("light"))
+    light.setPos(5, -5, 5)
+    base.render.setLight(light)
+
+    print(f"{'cubes':>8} {'python ms':>10} {'(update)':>9} {'shader ms':>10} {'(update)':>9} {'speedup':>8}")
+    for count in CUBE_COUNTS:
+        layout = field_layout(count)
+        # Keep the whole field in view
+        reach = max(float(abs(layout[0][:, :2]).max()), 4.0)
+        base.camera.setPos(0, -reach * 2.5, reach * 1.5)
+        base.camera.lookAt(0, 0, 0)
+
+        cubes = PythonCubes(cube, base.render, *layout)
+        per_node, per_node_update = frame_time(base, cubes)
+        cubes.destroy()
+
+        cubes = ShaderCubes(cube, base.render, *layout)
+        shader, shader_update = frame_time(base, cubes)
+        cubes.destroy()
+
+        print(f"{count:>8} {per_node:>10.2f} {per_node_update:>9.2f} {shader:>10.2f} {shader_update:>9.3f} "
+              f"{per_node / shader:>7.1f}x")
+
+    base.destroy()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# Per-tick cost of moving N AI cars: the racer's old per-entity loop
+# against the vectorized fleet (fleet.py), pushing its transforms either to
+# one entity per car or to hardware instances. Run from the repository root:
+#   python -m benchmarks.bench_fleet
+from panda3d.core import loadPrcFileData
+loadPrcFileData("", "win-size 64 64\naudio-library-name null\nsync-video #f")
+
+from ursina import Ursina, Entity, destroy
+from fleet import AIFleet
+import random
+import time
+
+COUNTS = [10, 100, 1000, 10000]
+TICKS = 120
+DT = 1 / 120
+
+
+def per_entity(cars):
+    # The loop the racer used to run every tick
+    def tick():
+        for ai in cars:
+            ai.position += ai.forward * DT * 4
+            if ai.z > 60:
+                ai.z = -50
+                ai.x = random.uniform(-3, 3)
+    return tick
+
+
+def tick_ms(tick, ticks):
+    tick()
+    start = time.perf_counter()
+    for _ in range(ticks):
+        tick()
+    return (time.perf_counter() - start) / ticks * 1000
+
+
+def main():
+    app = Ursina(window_type="offscreen")
+    print(f"{'cars':>6} {'loop ms':>8} {'fleet+nodes':>12} {'fleet+instances':>16} {'speedup':>8}")
+    for count in COUNTS:
+        # Fewer ticks for the slow cases keeps the run short
+        ticks = max(10, TICKS * 100 // max(count, 100))
+        cars = [Entity(model='cube', scale=0.5, position=(random.uniform(-3, 3), 0.5, random.uniform(-30, 30)))
+                for _ in range(count)]
+        loop_ms = tick_ms(per_entity(cars), ticks)
+
+        fleet = AIFleet(count, seed=count)
+        fleet.bind(cars)
+        nodes_ms = tick_ms(lambda: fleet.step(DT), ticks)
+        for car in cars:
+            destroy(car)
+
+        fleet = AIFleet(count, seed=count)
+        fleet.instance(app.loader.loadModel("models/box"), app.render, scale=0.5)
+        instances_ms = tick_ms(lambda: fleet.step(DT), ticks)
+        app.step()
+        fleet.destroy()
+
+        print(f"{count:>6} {loop_ms:>8.3f} {nodes_ms:>12.3f} {instances_ms:>16.3f} {loop_ms / instances_ms:>7.0f}x")
+        app.step()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# Frame time of the per-node trees from MyGame.make_tree against the
+# instanced Forest. Run from the repository root:
+#   python -m benchmarks.bench_forest
+from panda3d.core import loadPrcFileData
+# A tiny buffer keeps software rasterization out of the measurement so the
+# numbers reflect scene traversal and draw submission.
+loadPrcFileData("", "window-type offscreen\nwin-size 64 64\naudio-library-name null\nsync-video #f")
+
+from direct.showbase.ShowBase import ShowBase
+from panda3d.core import AmbientLight, DirectionalLight
+from vegetation import Forest
+import random
+import time
+
+TREE_COUNTS = [100, 1000, 10000]
+FRAMES = 60
+
+
+def canopy_model(loader):
+    # models/sphere isn't shipped with every Panda3D build; fall back to a box
+    # canopy so vertex processing doesn't drown out the per-node overhead
+    if loader.loadModel("models/sphere", okMissing=True):
+        return "models/sphere"
+    return "models/box"
+
+
+def make_node_tree(base, canopy, x, y):
+    trunk = base.loader.loadModel("models/box")
+    trunk.setScale(0.5, 0.5, 2)
+    trunk.setColor(0.55, 0.27, 0.07, 1)
+    trunk.setPos(x, y, 1)
+    trunk.reparentTo(base.render)
+
+    leaves = base.loader.loadModel(canopy)
+    leaves.setScale(2)
+    leaves.setColor(0.0, 0.6, 0.0, 1)
+    leaves.setPos(x, y, 4)
+    leaves.reparentTo(base.render)
+
+
+def frame_time(base):
+    # Warm up so shader compilation and buffer uploads aren't counted
+    for _ in range(5):
+        base.taskMgr.step()
+    start = time.perf_counter()
+    for _ in range(FRAMES):
+        base.taskMgr.step()
+    return (time.perf_counter() - start) / FRAMES * 1000
+
+
+def clear_scene(base, keep):
+    for child in base.render.getChildren():
+        if child not in keep:
+            child.removeNode()
+
+
+def main():
+    base = ShowBase()
+    base.disableMouse()
+    base.camera.setPos(0, -150, 120)
+    base.camera.lookAt(0, 0, 0)
+
+    ambient = base.render.attachNewNode(AmbientLight("ambient"))
+    ambient.node().setColor((0.5, 0.5, 0.5, 1))
+    base.render.setLight(ambient)
+    directional = base.render.attachNewNode(DirectionalLight("directional"))
+    directional.setHpr(0, -60, 0)
+    base.render.setLight(directional)
+    keep = [base.camera, ambient, directional]
+
+    canopy = canopy_model(base.loader)
+    print(f"{'trees':>8} {'per-node ms':>12} {'instanced ms':>13} {'speedup':>8}")
+    for count in TREE_COUNTS:
+        rng = random.Random(count)
+        positions = [(rng.uniform(-100, 100), rng.uniform(-100, 100)) for _ in range(count)]
+
+        for x, y in positions:
+            make_node_tree(base, canopy, x, y)
+        per_node = frame_time(base)
+        clear_scene(base, keep)
+
+        forest = Forest(base.loader, base.render, canopy_model=canopy)
+        for x, y in positions:
+            forest.add_tree(x, y)
+        instanced = frame_time(base)
+        forest.destroy()
+
+        print(f"{count:>8} {per_node:>12.2f} {instanced:>13.2f} {per_node / instanced:>7.1f}x")
+
+    base.destroy()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# Build time of a procedural grid mesh with per-vertex GeomVertexWriter calls
+# against the array-based builder in geometry.py. Run from the repository root:
+#   python -m benchmarks.bench_geometry
+from panda3d.core import (
+    Geom, GeomTriangles, GeomVertexData, GeomVertexFormat, GeomVertexWriter
+)
+from geometry import build_geom, cached_geom, clear_geom_cache
+import numpy as np
+import time
+
+GRID_SIZES = [100, 316, 1000]  # 10^4, 10^5 and 10^6 vertices
+
+
+def make_grid(n):
+    xs, ys = np.meshgrid(np.arange(n, dtype=np.float32), np.arange(n, dtype=np.float32))
+    zs = np.sin(xs * 0.1) * np.cos(ys * 0.1)
+    positions = np.stack([xs.ravel(), ys.ravel(), zs.ravel()], axis=1)
+    normals = np.zeros_like(positions)
+    normals[:, 2] = 1
+    uvs = positions[:, :2] / n
+
+    corner = (np.arange(n - 1)[None, :] + np.arange(n - 1)[:, None] * n).ravel()
+    quads = np.stack([corner, corner + 1, corner + n + 1, corner + n], axis=1)
+    indices = quads[:, [0, 1, 2, 2, 3, 0]].ravel()
+    return positions, normals, uvs, indices
+
+
+def build_with_writer(positions, normals, uvs, indices):
+    vdata = GeomVertexData("grid", GeomVertexFormat.getV3n3t2(), Geom.UHStatic)
+    vdata.setNumRows(len(positions))
+    vertex = GeomVertexWriter(vdata, "vertex")
+    normal = GeomVertexWriter(vdata, "normal")
+    texcoord = GeomVertexWriter(vdata, "texcoord")
+    for p, n, t in zip(positions.tolist(), normals.tolist(), uvs.tolist()):
+        vertex.addData3(*p)
+        normal.addData3(*n)
+        texcoord.addData2(*t)
+
+    triangles = GeomTriangles(Geom.UHStatic)
+    flat = indices.tolist()
+    for i in range(0, len(flat), 3):
+        triangles.addVertices(flat[i], flat[i + 1], flat[i + 2])
+
+    geom = Geom(vdata)
+    geom.addPrimitive(triangles)
+    return geom
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    print(f"{'vertices':>10} {'writer ms':>10} {'arrays ms':>10} {'cached ms':>10} {'speedup':>8}")
+    for n in GRID_SIZES:
+        positions, normals, uvs, indices = arrays = make_grid(n)
+        writer = timed(build_with_writer, *arrays)
+        bulk = timed(build_geom, positions, indices, normals=normals, uvs=uvs)
+        clear_geom_cache()
+        cached_geom(positions, indices, normals=normals, uvs=uvs)
+        cached = timed(cached_geom, positions, indices, normals=normals, uvs=uvs)
+        print(f"{n * n:>10} {writer:>10.1f} {bulk:>10.1f} {cached:>10.2f} {writer / bulk:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
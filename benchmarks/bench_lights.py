@@ -0,0 +1,180 @@
+# Frame time with many moving point lights, every light set on render
+# against the light manager handing each object its nearest few. Shading
+# is per pixel in GLSL over an array sized for the lights an object can
+# have: all of them on render, max_lights with the manager. Run from the
+# repository root:
+#   python -m benchmarks.bench_lights
+from panda3d.core import loadPrcFileData
+# gl-finish makes every frame wait for the (software) rasterizer, so the
+# per-pixel cost of each light is part of the frame time.
+loadPrcFileData("", "window-type offscreen\nwin-size 320 240\naudio-library-name null\nsync-video #f\ngl-finish #t")
+
+from direct.showbase.ShowBase import ShowBase
+from panda3d.core import AmbientLight, CardMaker, PointLight, Shader
+from lights import LightManager
+from math import sin, cos
+import random
+import time
+
+LIGHT_COUNTS = [8, 64, 256]
+GRID = 20
+SPACING = 5.0
+LIGHT_RADIUS = 8.0
+FRAMES = 30
+
+LIT_VERT = """
+#version 150
+
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform mat4 p3d_ModelViewMatrix;
+uniform mat3 p3d_NormalMatrix;
+
+in vec4 p3d_Vertex;
+in vec3 p3d_Normal;
+
+out vec3 v_position;
+out vec3 v_normal;
+
+void main() {
+    gl_Position = p3d_ModelViewProjectionMatrix * p3d_Vertex;
+    v_position = vec3(p3d_ModelViewMatrix * p3d_Vertex);
+    v_normal = p3d_NormalMatrix * p3d_Normal;
+}
+"""
+
+LIT_FRAG = """
+#version 150
+
+uniform struct {
+    vec4 ambient;
+} p3d_LightModel;
+uniform struct {
+    vec4 color;
+    vec4 position;
+    vec3 attenuation;
+} p3d_LightSource[%d];
+// A uniform bound keeps the driver from unrolling some array sizes and
+// not others
+uniform int light_count;
+
+in vec3 v_position;
+in vec3 v_normal;
+
+out vec4 p3d_FragColor;
+
+void main() {
+    vec3 normal = normalize(v_normal);
+    vec3 light = p3d_LightModel.ambient.rgb;
+    for (int i = 0; i < light_count; ++i) {
+        vec3 to_light = p3d_LightSource[i].position.xyz - v_position * p3d_LightSource[i].position.w;
+        float dist = length(to_light);
+        vec3 att = p3d_LightSource[i].attenuation;
+        float falloff = 1.0 / max(att.x + att.y * dist + att.z * dist * dist, 1.0);
+        light += p3d_LightSource[i].color.rgb * falloff * max(dot(normal, to_light / max(dist, 1e-4)), 0.0);
+    }
+    p3d_FragColor = vec4(light, 1.0);
+}
+"""
+
+
+def set_lit_shader(node, lights):
+    node.setShader(Shader.make(Shader.SL_GLSL, LIT_VERT, LIT_FRAG % lights))
+    node.setShaderInput("light_count", lights)
+
+
+def make_objects(base):
+    # Floor tiles under the lights, like track tiles under lamps; they fill
+    # the view, so every pixel pays for the lights its tile has
+    card = CardMaker("tile")
+    card.setFrame(-SPACING / 2, SPACING / 2, -SPACING / 2, SPACING / 2)
+    objects = []
+    for i in range(GRID * GRID):
+        tile = base.render.attachNewNode(card.generate())
+        tile.setP(-90)
+        tile.setPos((i % GRID - GRID / 2) * SPACING, (i // GRID - GRID / 2) * SPACING, 0)
+        objects.append(tile)
+    return objects
+
+
+def make_lights(base, count, rng):
+    lights = []
+    extent = GRID * SPACING / 2
+    for i in range(count):
+        light = PointLight("lamp%d" % i)
+        light.setColor((rng.random(), rng.random(), rng.random(), 1))
+        light.setAttenuation((1, 0, 4 / LIGHT_RADIUS ** 2))
+        node = base.render.attachNewNode(light)
+        # Each light circles its own spot, so every one moves every frame
+        lights.append((node, rng.uniform(-extent, extent), rng.uniform(-extent, extent), rng.uniform(0.5, 2)))
+    return lights
+
+
+def frame_time(base, lights, manager=None):
+    def move_lights(task):
+        for node, x, y, speed in lights:
+            node.setPos(x + 3 * sin(task.time * speed), y + 3 * cos(task.time * speed), 2)
+        return task.cont
+
+    base.taskMgr.add(move_lights, "move-lights", sort=0)
+    spent = [0.0]
+    if manager is not None:
+        # Time the manager's own task by running it by hand
+        base.taskMgr.remove(manager.task)
+
+        def update(task):
+            start = time.perf_counter()
+            manager.update(task)
+            spent[0] += time.perf_counter() - start
+            return task.cont
+        base.taskMgr.add(update, "light-manager", sort=45)
+    # Warm up so shader compilation isn't counted
+    for _ in range(10):
+        base.taskMgr.step()
+    spent[0] = 0.0
+    start = time.perf_counter()
+    for _ in range(FRAMES):
+        base.taskMgr.step()
+    elapsed = time.perf_counter() - start
+    base.taskMgr.remove("move-lights")
+    base.taskMgr.remove("light-manager")
+    return elapsed / FRAMES * 1000, spent[0] / FRAMES * 1000
+
+
+def main():
+    base = ShowBase()
+    base.disableMouse()
+    base.camera.setPos(0, -40, 30)
+    base.camera.lookAt(0, 0, 0)
+    ambient = base.render.attachNewNode(AmbientLight("ambient"))
+    ambient.node().setColor((0.2, 0.2, 0.2, 1))
+    base.render.setLight(ambient)
+    objects = make_objects(base)
+
+    print(f"{'lights':>7} {'on render ms':>13} {'manager ms':>11} {'(update)':>9} {'speedup':>8}")
+    for count in LIGHT_COUNTS:
+        lights = make_lights(base, count, random.Random(count))
+        set_lit_shader(base.render, count)
+        for node, *_ in lights:
+            base.render.setLight(node)
+        on_render, _ = frame_time(base, lights)
+        for node, *_ in lights:
+            base.render.clearLight(node)
+
+        manager = LightManager(base.render)
+        set_lit_shader(base.render, manager.max_lights)
+        for box in objects:
+            manager.add_object(box)
+        for node, *_ in lights:
+            manager.add_light(node, LIGHT_RADIUS)
+        managed, update = frame_time(base, lights, manager)
+        manager.destroy()
+        for node, *_ in lights:
+            node.removeNode()
+
+        print(f"{count:>7} {on_render:>13.2f} {managed:>11.2f} {update:>9.2f} {on_render / managed:>7.1f}x")
+
+    base.destroy()
+
+
+if __name__ == "__main__":
+    main()
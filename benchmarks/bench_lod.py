@@ -0,0 +1,67 @@
+# Triangles drawn and frame time for a growing number of instanced objects,
+# at full detail against distance-based LOD. Objects are spread at a fixed
+# density, so with LOD the drawn triangle count should stay about flat.
+# Run from the repository root:
+#   python -m benchmarks.bench_lod
+from panda3d.core import loadPrcFileData
+loadPrcFileData("", "window-type offscreen\nwin-size 64 64\naudio-library-name null\nsync-video #f")
+
+from direct.showbase.ShowBase import ShowBase
+from panda3d.core import AmbientLight
+from lod import LODInstances, build_levels
+import math
+import random
+import time
+
+COUNTS = [100, 1000, 10000]
+# Objects per square unit
+DENSITY = 0.01
+FRAMES = 60
+
+
+def frame_time(base):
+    for _ in range(5):
+        base.taskMgr.step()
+    start = time.perf_counter()
+    for _ in range(FRAMES):
+        base.taskMgr.step()
+    return (time.perf_counter() - start) / FRAMES * 1000
+
+
+def main():
+    base = ShowBase()
+    base.disableMouse()
+    base.camera.setPos(0, 0, 10)
+    ambient = base.render.attachNewNode(AmbientLight("ambient"))
+    base.render.setLight(ambient)
+
+    model = base.loader.loadModel("models/smiley")
+    start = time.perf_counter()
+    levels, triangles = build_levels(model)
+    print("levels: %s triangles, built in %.0f ms" % (" / ".join(map(str, triangles)),
+                                                       (time.perf_counter() - start) * 1000))
+
+    print(f"{'objects':>8} {'full tris':>10} {'full ms':>8} {'lod tris':>9} {'lod ms':>7}")
+    for count in COUNTS:
+        rng = random.Random(count)
+        half = math.sqrt(count / DENSITY) / 2
+        records = [(rng.uniform(-half, half), rng.uniform(-half, half), 0, 1, 1, 1, 1, 0)
+                   for _ in range(count)]
+
+        results = []
+        for camera in (None, base.camera):
+            group = LODInstances(base.render, "bench", camera=camera)
+            group.set_levels(levels)
+            group.add_many(records)
+            ms = frame_time(base)
+            results.append((group.triangles(), ms))
+            group.destroy()
+
+        (full_tris, full_ms), (lod_tris, lod_ms) = results
+        print(f"{count:>8} {full_tris:>10} {full_ms:>8.2f} {lod_tris:>9} {lod_ms:>7.2f}")
+
+    base.destroy()
+
+
+if __name__ == "__main__":
+    main()
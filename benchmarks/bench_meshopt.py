@@ -0,0 +1,99 @@
+# Vertex memory, transform cost and draw time of meshes as imported against
+# their optimized copies (see meshopt.py): welded, reordered for the vertex
+# cache and fetches, and quantized. The sphere comes the way OBJ imports
+# do, three unshared vertices per triangle in scrambled order. Run from the
+# repository root:
+#   python -m benchmarks.bench_meshopt
+from panda3d.core import loadPrcFileData
+# gl-finish makes every frame wait for the (software) rasterizer, so vertex
+# processing is part of the frame time; the small window keeps pixel work
+# from hiding it.
+loadPrcFileData("", "window-type offscreen\nwin-size 64 64\naudio-library-name null\nsync-video #f\ngl-finish #t")
+
+from direct.showbase.ShowBase import ShowBase
+from panda3d.core import DirectionalLight, Material, NodePath
+from asset_cache import REPO_DIR, compile_asset, load_bam
+from geometry import make_mesh
+from meshopt import mesh_report, optimize_model
+from terrain import ChunkedTerrain
+import numpy as np
+import os
+import time
+
+COPIES = 40
+FRAMES = 20
+
+
+def obj_sphere(rings=60, segments=120, seed=0):
+    theta, phi = np.meshgrid(np.linspace(0, np.pi, rings + 1), np.linspace(0, 2 * np.pi, segments + 1),
+                             indexing="ij")
+    points = np.stack([np.sin(theta) * np.cos(phi), np.sin(theta) * np.sin(phi), np.cos(theta)], -1)
+    points = points.reshape(-1, 3).astype(np.float32)
+    uvs = np.stack([phi / (2 * np.pi), theta / np.pi], -1).reshape(-1, 2).astype(np.float32)
+    row = np.arange(rings)[:, None] * (segments + 1)
+    column = np.arange(segments)[None, :]
+    corner = (row + column).reshape(-1)
+    quads = np.stack([corner, corner + segments + 1, corner + segments + 2,
+                      corner, corner + segments + 2, corner + 1], axis=1).reshape(-1, 3)
+    quads = quads[np.random.default_rng(seed).permutation(len(quads))]
+    corners = quads.reshape(-1)
+    return make_mesh("sphere", points[corners], np.arange(len(corners)).reshape(-1, 3),
+                     normals=points[corners], uvs=uvs[corners], cache=False)
+
+
+def terrain_chunk():
+    ground = ChunkedTerrain(NodePath("terrain"), resolution=64)
+    ground.attach(ground.generate((0, 0)))
+    return ground.root
+
+
+def frame_time(base, model):
+    # Many copies of the model on screen
+    root = base.render.attachNewNode("copies")
+    for i in range(COPIES):
+        copy = model.copyTo(root)
+        copy.setPos((i % 8 - 3.5) * 3, 10 + i // 8 * 3, 0)
+    for _ in range(3):
+        base.graphicsEngine.renderFrame()
+    start = time.perf_counter()
+    for _ in range(FRAMES):
+        base.graphicsEngine.renderFrame()
+    elapsed = time.perf_counter() - start
+    root.removeNode()
+    return elapsed / FRAMES * 1000
+
+
+def main():
+    base = ShowBase()
+    base.disableMouse()
+    base.camera.setPos(0, -20, 10)
+    base.camera.lookAt(0, 15, 0)
+    light = base.render.attachNewNode(DirectionalLight("sun"))
+    light.setHpr(30, -50, 0)
+    base.render.setLight(light)
+    material = Material()
+    material.setDiffuse((1, 1, 1, 1))
+    base.render.setMaterial(material)
+
+    # The diamond as the asset cache converted it, before optimization
+    diamond = load_bam(compile_asset(os.path.join(REPO_DIR, "diamond.obj"))[0])
+    meshes = [("obj sphere", obj_sphere()), ("terrain chunk", terrain_chunk()), ("diamond", diamond)]
+    print(f"{'mesh':<14} {'triangles':>9} {'vertices':>17} {'vertex KB':>17} {'transforms/tri':>15} "
+          f"{'build ms':>9} {'frame ms':>15}")
+    for name, model in meshes:
+        start = time.perf_counter()
+        optimized = optimize_model(model)
+        build = time.perf_counter() - start
+        vertices, size, triangles, transformed = mesh_report(model)
+        new_vertices, new_size, _, new_transformed = mesh_report(optimized)
+        before, after = frame_time(base, model), frame_time(base, optimized)
+        print(f"{name:<14} {triangles:>9} {vertices:>8} -> {new_vertices:<6} "
+              f"{size / 1024:>7.1f} -> {new_size / 1024:<7.1f} "
+              f"{transformed / triangles:>5.2f} -> {new_transformed / triangles:<5.2f} {build * 1000:>9.0f} "
+              f"{before:>6.1f} -> {after:<6.1f}")
+
+    base.destroy()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# Per-frame cost of the particle system (particles.py) at 10k, 100k and 1M
+# live particles: emitting, simulating (expiry and integration), writing
+# the vertex buffer, and the frame that draws it. The emitter runs in its
+# steady state, as many particles born each frame as die. For comparison,
+# the small count is also run as one scene node per particle moved from a
+# Python loop, the way the games place entities. Run from the repository
+# root:
+#   python -m benchmarks.bench_particles
+from panda3d.core import loadPrcFileData
+# A tiny buffer keeps software rasterization out of the measurement;
+# gl-finish makes the frame wait for the points to be transformed
+loadPrcFileData("", "window-type offscreen\nwin-size 64 64\naudio-library-name null\nsync-video #f\ngl-finish #t")
+
+from direct.showbase.ShowBase import ShowBase
+from particles import ParticleEmitter
+import numpy as np
+import time
+
+COUNTS = [10_000, 100_000, 1_000_000]
+NODE_COUNT = 10_000
+LIFETIME = 1.0
+DT = 1 / 60
+FRAMES = 30
+
+
+def emitter_frame(base, emitter, rate):
+    # Returns (emit, simulate, upload, draw) in ms for one frame
+    marks = [time.perf_counter()]
+    emitter.stream(rate, DT, (0, 0, 0), velocity=(0, 0, 4), spread=2.0, color=(1, 0.55, 0.15, 1))
+    marks.append(time.perf_counter())
+    emitter.simulate(DT)
+    marks.append(time.perf_counter())
+    emitter.upload()
+    marks.append(time.perf_counter())
+    base.graphicsEngine.renderFrame()
+    marks.append(time.perf_counter())
+    return np.diff(marks) * 1000
+
+
+def measure_emitter(base, count):
+    emitter = ParticleEmitter(base.render, capacity=count, lifetime=LIFETIME, seed=0)
+    rate = count / LIFETIME
+    # One lifetime to fill up
+    for _ in range(round(LIFETIME / DT) + 5):
+        emitter_frame(base, emitter, rate)
+    live = len(emitter)
+    times = np.median([emitter_frame(base, emitter, rate) for _ in range(FRAMES)], axis=0)
+    emitter.destroy()
+    return live, times
+
+
+def measure_nodes(base, count):
+    # One node per particle, moved one at a time; returns (simulate, draw)
+    rng = np.random.default_rng(0)
+    root = base.render.attachNewNode("particles")
+    model = base.loader.loadModel("models/misc/sphere")
+    nodes = []
+    for _ in range(count):
+        node = root.attachNewNode("particle")
+        model.instanceTo(node)
+        node.setScale(0.05)
+        nodes.append(node)
+    position = rng.uniform(-1, 1, (count, 3)).tolist()
+    velocity = rng.uniform(-2, 2, (count, 3)).tolist()
+    simulate, draw = [], []
+    for _ in range(FRAMES):
+        start = time.perf_counter()
+        for node, p, v in zip(nodes, position, velocity):
+            v[2] -= 2.0 * DT
+            p[0] += v[0] * DT
+            p[1] += v[1] * DT
+            p[2] += v[2] * DT
+            node.setPos(p[0], p[1], p[2])
+        middle = time.perf_counter()
+        base.graphicsEngine.renderFrame()
+        simulate.append(middle - start)
+        draw.append(time.perf_counter() - middle)
+    root.removeNode()
+    return np.median(simulate) * 1000, np.median(draw) * 1000
+
+
+def main():
+    base = ShowBase()
+    base.disableMouse()
+    base.camera.setPos(0, -30, 2)
+    base.camera.lookAt(0, 0, 2)
+
+    print(f"{'system':<16} {'particles':>10} {'emit ms':>8} {'simulate ms':>12} {'upload ms':>10} "
+          f"{'draw ms':>8} {'frame ms':>9}")
+    simulate, draw = measure_nodes(base, NODE_COUNT)
+    print(f"{'node per item':<16} {NODE_COUNT:>10} {'-':>8} {simulate:>12.2f} {'-':>10} {draw:>8.2f} "
+          f"{simulate + draw:>9.2f}")
+    for count in COUNTS:
+        live, (emit, simulate, upload, draw) = measure_emitter(base, count)
+        print(f"{'ring buffer':<16} {live:>10} {emit:>8.2f} {simulate:>12.2f} {upload:>10.2f} {draw:>8.2f} "
+              f"{emit + simulate + upload + draw:>9.2f}")
+
+    base.destroy()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# Frame time against the budget with and without the adaptive quality
+# controller (quality.py) through a load that rises and falls: floor tiles
+# shaded per pixel by moving point lights (the scene of bench_lights.py),
+# a quarter of them shown while calm and all of them while busy. The knobs
+# are render resolution and the lights per object. The default budget
+# suits a GPU; give software GL a larger one. Run from the repository root:
+#   python -m benchmarks.bench_quality
+#   python -m benchmarks.bench_quality --budget 40 --log quality.jsonl
+# bench_lights sets up an offscreen window with gl-finish, so the per-pixel
+# cost of the lights is part of the frame time
+from benchmarks.bench_lights import LIGHT_RADIUS, make_lights, make_objects, set_lit_shader
+from panda3d.core import loadPrcFileData
+# Large enough for the scene to be bound by its pixels
+loadPrcFileData("", "win-size 800 600")
+
+from direct.showbase.ShowBase import ShowBase
+from panda3d.core import AmbientLight
+from lights import LightManager
+from quality import RESOLUTION_SCALES, Knob, QualityController, ResolutionScale, percentile
+from math import sin, cos
+import argparse
+import random
+import time
+
+LIGHTS = 32
+# (name, fraction of the tiles shown, frames)
+PHASES = [("calm", 0.25, 180), ("busy", 1.0, 480), ("calm again", 0.25, 480)]
+MAX_LIGHTS = (8, 4, 2, 1)
+
+
+def run(base, objects, budget, adaptive, log_path=None):
+    manager = LightManager(base.render, max_lights=MAX_LIGHTS[0])
+    for tile in objects:
+        manager.add_object(tile)
+    # The shader's light array fits the most lights an object can get; the
+    # loop only runs over light_count of them
+    set_lit_shader(base.render, MAX_LIGHTS[0])
+
+    def set_max_lights(count):
+        manager.set_max_lights(count)
+        base.render.setShaderInput("light_count", count)
+
+    controller = None
+    if adaptive:
+        resolution = ResolutionScale(base)
+        controller = QualityController(base, [Knob("resolution", RESOLUTION_SCALES, resolution.set),
+                                              Knob("lights", MAX_LIGHTS, set_max_lights)],
+                                       budget_ms=budget, log_path=log_path)
+
+    rng = random.Random(0)
+    lights = make_lights(base, LIGHTS, rng)
+    for node, *_ in lights:
+        manager.add_light(node, LIGHT_RADIUS)
+    results = []
+    for name, shown, frames in PHASES:
+        for i, tile in enumerate(objects):
+            if i % round(1 / shown) == 0:
+                tile.show()
+            else:
+                tile.hide()
+        frame_ms = []
+        clock = time.perf_counter()
+        for _ in range(frames):
+            now = time.perf_counter()
+            for node, x, y, speed in lights:
+                node.setPos(x + 3 * sin(now * speed), y + 3 * cos(now * speed), 2)
+            base.taskMgr.step()
+            frame_ms.append((time.perf_counter() - now) * 1000)
+        elapsed = time.perf_counter() - clock
+        settings = controller.settings() if controller else {}
+        results.append((name, shown, frame_ms, elapsed, settings))
+
+    changes = len(controller.log) if controller else 0
+    reverts = sum(entry["direction"] == "revert" for entry in controller.log) if controller else 0
+    if controller:
+        controller.destroy()
+        resolution.destroy()
+    manager.destroy()
+    for node, *_ in lights:
+        node.removeNode()
+    return results, changes, reverts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the adaptive quality controller.")
+    parser.add_argument("--budget", type=float, default=1000.0 / 60, help="frame budget in ms")
+    parser.add_argument("--log", help="append the controller's adjustments to this JSON lines file")
+    args = parser.parse_args()
+
+    base = ShowBase()
+    base.disableMouse()
+    base.camera.setPos(0, -40, 30)
+    base.camera.lookAt(0, 0, 0)
+    ambient = base.render.attachNewNode(AmbientLight("ambient"))
+    ambient.node().setColor((0.2, 0.2, 0.2, 1))
+    base.render.setLight(ambient)
+    objects = make_objects(base)
+
+    print(f"budget {args.budget:.1f} ms")
+    print(f"{'controller':<11} {'phase':<11} {'tiles':>6} {'p50 ms':>7} {'p95 ms':>7} {'over budget':>12} "
+          f"{'fps':>6}  settings at the end")
+    for adaptive in (False, True):
+        results, changes, reverts = run(base, objects, args.budget, adaptive, args.log)
+        for name, shown, frame_ms, elapsed, settings in results:
+            over = sum(ms > args.budget for ms in frame_ms) / len(frame_ms)
+            print(f"{'on' if adaptive else 'off':<11} {name:<11} {shown:>6.0%} {percentile(frame_ms, 50):>7.1f} "
+                  f"{percentile(frame_ms, 95):>7.1f} {over:>12.0%} {len(frame_ms) / elapsed:>6.1f}  "
+                  + ", ".join(f"{knob} {value}" for knob, value in settings.items()))
+        if adaptive:
+            print(f"{changes} adjustments, {reverts} undone")
+
+    base.destroy()
+
+
+if __name__ == "__main__":
+    main()
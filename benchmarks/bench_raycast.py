@@ -0,0 +1,133 @@
+# Rays per second through the BVH query engine against Panda3D's
+# CollisionTraverser (collision rays into the visible geometry) on the same
+# racer-like scene: track tiles, walls, boost pads, trees and the terrain
+# around them. Sphere casts and nearest-point queries through the BVH are
+# timed too. Run from the repository root:
+#   python -m benchmarks.bench_raycast
+from panda3d.core import loadPrcFileData
+loadPrcFileData("", "window-type none\naudio-library-name null")
+
+from direct.showbase.ShowBase import ShowBase
+from panda3d.core import (
+    CollisionHandlerQueue, CollisionNode, CollisionRay, CollisionTraverser, GeomNode, NodePath
+)
+from bvh import BVH, scene_triangles
+from terrain import ChunkedTerrain
+import numpy as np
+import time
+
+RAY_COUNTS = [1, 100, 1000, 10000]
+MAX_DISTANCE = 100.0
+# Repeat small batches until at least this much time has passed
+MIN_TIME = 0.5
+
+
+def make_scene(base):
+    # The racer's layout in Panda's Z-up frame: x across the track, y along it
+    scene = base.render.attachNewNode("scene")
+    box = base.loader.loadModel("models/box")
+
+    def block(center, size):
+        # models/box spans (0, 0, 0) to (1, 1, 1)
+        node = box.copyTo(scene)
+        node.setScale(*size)
+        node.setPos(*(c - s / 2 for c, s in zip(center, size)))
+
+    for i in range(10):
+        block((0, i * 10 - 50, 0.05), (10, 10, 0.1))
+    for i in range(-5, 6):
+        block((5, i * 10, 2.5), (1, 10, 5))
+        block((-5, i * 10, 2.5), (1, 10, 5))
+    for y in (-20, 0, 20, 40):
+        block((0, y, 0.05), (3, 3, 0.1))
+    rng = np.random.default_rng(1)
+    for _ in range(20):
+        block((rng.choice([-8, 8]), rng.integers(-50, 51), 2.5), (1, 1, 1))
+
+    ground = ChunkedTerrain(scene, amplitude=4, valley=12)
+    for key in ground.wanted(ground.chunk_of(0, 0), 2):
+        ground.attach(ground.generate(key))
+    return scene
+
+
+def make_rays(count, rng):
+    # From above the track in every direction, biased downward like ground
+    # probes and camera arms
+    origins = np.column_stack([rng.uniform(-20, 20, count), rng.uniform(-60, 60, count),
+                               rng.uniform(0.5, 10, count)]).astype(np.float32)
+    directions = rng.normal(size=(count, 3)).astype(np.float32)
+    directions[:, 2] -= 1
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    return origins, directions
+
+
+def rate(run, count):
+    # Queries per second
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        result = run()
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_TIME:
+            return count * runs / elapsed, result
+
+
+def traverser_rays(base, scene, origins, directions):
+    traverser = CollisionTraverser()
+    queue = CollisionHandlerQueue()
+    rays = NodePath("rays")
+    for origin, direction in zip(origins.tolist(), directions.tolist()):
+        node = CollisionNode("ray")
+        node.addSolid(CollisionRay(*origin, *direction))
+        node.setFromCollideMask(GeomNode.getDefaultCollideMask())
+        node.setIntoCollideMask(0)
+        traverser.addCollider(rays.attachNewNode(node), queue)
+    rays.reparentTo(base.render)
+
+    def run():
+        traverser.traverse(scene)
+        # The closest hit of each ray, like BVH.raycast()
+        distance = {}
+        for entry in queue.getEntries():
+            ray = entry.getFromNodePath()
+            origin = entry.getFrom().getOrigin()
+            d = (entry.getSurfacePoint(base.render) - origin).length()
+            if d <= MAX_DISTANCE and d < distance.get(ray, np.inf):
+                distance[ray] = d
+        return np.array([distance.get(ray, np.inf) for ray in rays.getChildren()])
+
+    result = rate(run, len(origins))
+    rays.removeNode()
+    return result
+
+
+def main():
+    base = ShowBase()
+    scene = make_scene(base)
+
+    start = time.perf_counter()
+    bvh = BVH(scene_triangles([scene], base.render))
+    build = time.perf_counter() - start
+    print(f"{len(bvh)} triangles, BVH built in {build * 1000:.0f} ms, depth {bvh.depth}")
+
+    print(f"{'rays':>6} {'traverser rays/s':>17} {'bvh rays/s':>11} {'speedup':>8} {'agree':>6} "
+          f"{'spheres/s':>10} {'nearest/s':>10}")
+    rng = np.random.default_rng(0)
+    for count in RAY_COUNTS:
+        origins, directions = make_rays(count, rng)
+        panda, panda_hits = traverser_rays(base, scene, origins, directions)
+        ours, (hits, _) = rate(lambda: bvh.raycast(origins, directions, MAX_DISTANCE), count)
+        # Both hit at the same distance, or both miss
+        with np.errstate(invalid="ignore"):
+            agree = (np.abs(hits - panda_hits) < 1e-3) | (np.isinf(hits) & np.isinf(panda_hits))
+        spheres, _ = rate(lambda: bvh.spherecast(origins, directions, 0.3, MAX_DISTANCE), count)
+        nearest, _ = rate(lambda: bvh.nearest(origins, MAX_DISTANCE), count)
+        print(f"{count:>6} {panda:>17,.0f} {ours:>11,.0f} {ours / panda:>7.1f}x {agree.mean():>6.1%} "
+              f"{spheres:>10,.0f} {nearest:>10,.0f}")
+
+    base.destroy()
+
+
+if __name__ == "__main__":
+    main()
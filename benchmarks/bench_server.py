@@ -0,0 +1,124 @@
+# Loopback load test of race_server.py: the server runs in its own process
+# while dozens of simulated clients join, drive scripted inputs with client
+# prediction, and optionally lose packets. Reports bandwidth per client and
+# the server's tick time. Run from the repository root:
+#   python -m benchmarks.bench_server
+#   python -m benchmarks.bench_server --clients 64 --seconds 20 --loss 0.05
+from netcode import ClientCore
+from race_sim import FORWARD, LEFT, RIGHT, TICK_RATE
+from race_server import serve
+import argparse
+import asyncio
+import multiprocessing
+import random
+import statistics
+import time
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "mean": statistics.fmean(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p99": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))],
+        "max": ordered[-1],
+    }
+
+
+def run_server(seconds, snapshot_every, ports, results):
+    async def main():
+        server = await serve("127.0.0.1", 0, TICK_RATE, snapshot_every, duration=seconds, seed=1,
+                             ready=lambda address: ports.put(address[1]))
+        results.put({"tick_ms": server.tick_ms, "tick_cpu_ms": server.tick_cpu_ms})
+    asyncio.run(main())
+
+
+class SimulatedClient(asyncio.DatagramProtocol):
+
+    def __init__(self, loss, rng):
+        self.core = ClientCore()
+        self.loss = loss
+        self.rng = rng
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        if self.rng.random() >= self.loss:
+            self.core.receive(data)
+
+    def send(self, packet):
+        if packet is not None and self.rng.random() >= self.loss:
+            self.transport.sendto(packet)
+
+    async def drive(self, seconds):
+        # Holds forward and steers in slow, random sweeps
+        loop = asyncio.get_running_loop()
+        while self.core.car_id is None:
+            self.transport.sendto(self.core.hello())
+            await asyncio.sleep(0.2)
+        dt = 1.0 / self.core.rate
+        start = next_tick = loop.time()
+        steer, until = 0, 0.0
+        while loop.time() - start < seconds:
+            if loop.time() > until:
+                steer = self.rng.choice((0, 0, LEFT, RIGHT))
+                until = loop.time() + self.rng.uniform(0.2, 1.5)
+            self.send(self.core.step(FORWARD | steer))
+            next_tick += dt
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+        self.transport.sendto(self.core.bye())
+
+
+async def run_clients(port, count, seconds, loss):
+    loop = asyncio.get_running_loop()
+    clients = []
+    for i in range(count):
+        _, client = await loop.create_datagram_endpoint(
+            lambda: SimulatedClient(loss, random.Random(i)), remote_addr=("127.0.0.1", port))
+        clients.append(client)
+    start = time.perf_counter()
+    await asyncio.gather(*(client.drive(seconds) for client in clients))
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        client.transport.close()
+    return clients, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the race server over loopback.")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--snapshot-every", type=int, default=2, help="server ticks between snapshots")
+    parser.add_argument("--loss", type=float, default=0.0, help="fraction of packets each client drops")
+    args = parser.parse_args(argv)
+
+    ports, results = multiprocessing.Queue(), multiprocessing.Queue()
+    server = multiprocessing.Process(target=run_server,
+                                     args=(args.seconds + 3, args.snapshot_every, ports, results))
+    server.start()
+    port = ports.get(timeout=10)
+    clients, elapsed = asyncio.run(run_clients(port, args.clients, args.seconds, args.loss))
+    stats = results.get()
+    server.join()
+
+    down = [client.core.bytes_in / elapsed for client in clients]
+    up = [client.core.bytes_out / elapsed for client in clients]
+    corrections = [c for client in clients for c in client.core.corrections]
+    ticks, cpu = summarize(stats["tick_ms"]), summarize(stats["tick_cpu_ms"])
+    print(f"{args.clients} clients, {args.seconds:.0f} s, {TICK_RATE} Hz ticks, "
+          f"snapshot every {args.snapshot_every} ticks, {args.loss:.0%} loss")
+    print(f"down per client: {statistics.fmean(down) / 1024:.2f} KiB/s (max {max(down) / 1024:.2f})")
+    print(f"up per client:   {statistics.fmean(up) / 1024:.2f} KiB/s")
+    # Wall time includes waiting for a core the clients are using too
+    for label, ms in (("server tick cpu", cpu), ("server tick wall", ticks)):
+        print(f"{label + ':':<17} mean {ms['mean']:.3f} ms, p50 {ms['p50']:.3f}, "
+              f"p99 {ms['p99']:.3f}, max {ms['max']:.3f}")
+    if corrections:
+        print(f"reconciliation:  mean correction {statistics.fmean(corrections):.4f}, "
+              f"max {max(corrections):.4f} units over {len(corrections)} snapshots")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# Startup time of each scene through launch.py, split into its phases: the
+# first launch with an empty startup cache and repeated launches once it is
+# warm. Every launch is a fresh interpreter. Run from the repository root:
+#   python -m benchmarks.bench_startup
+#   python -m benchmarks.bench_startup racer --launches 9
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from scenes import REPO_DIR, SCENES
+
+PHASES = ["imports", "window/GSG", "assets", "scene build", "first frame"]
+
+
+def launch(name, cache_dir, window_type):
+    fd, output = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    command = [sys.executable, "launch.py", name, "--profile-startup", "--window-type", window_type,
+               "--profile-output", output]
+    env = dict(os.environ, STARTUP_CACHE_DIR=cache_dir)
+    try:
+        proc = subprocess.run(command, cwd=REPO_DIR, env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "exit %d" % proc.returncode}
+        with open(output) as f:
+            return json.load(f)
+    finally:
+        os.remove(output)
+
+
+def median_profile(profiles):
+    return {
+        "total": statistics.median(p["total"] for p in profiles),
+        "phases": {phase: statistics.median(p["phases"].get(phase, 0.0) for p in profiles) for phase in PHASES},
+    }
+
+
+def measure(name, launches, window_type):
+    # Each first launch gets its own empty cache directory; the repeated
+    # ones share the last of them
+    first, warm = [], []
+    cache_dirs = []
+    try:
+        for _ in range(launches):
+            cache_dirs.append(tempfile.mkdtemp(prefix="startup-"))
+            first.append(launch(name, cache_dirs[-1], window_type))
+        for _ in range(launches):
+            warm.append(launch(name, cache_dirs[-1], window_type))
+    finally:
+        for cache_dir in cache_dirs:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    for runs in (first, warm):
+        errors = [run["error"] for run in runs if "error" in run]
+        if errors:
+            return {"error": errors[0]}
+    return {"first": median_profile(first), "repeat": median_profile(warm)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark scene startup through the launcher.")
+    parser.add_argument("scenes", nargs="*", help="scenes to run (default: all of %s)" % ", ".join(SCENES))
+    parser.add_argument("--launches", type=int, default=5, help="launches per row; the median is shown")
+    parser.add_argument("--window-type", default="offscreen", choices=["offscreen", "none"])
+    args = parser.parse_args()
+
+    print(f"{'scene':<10} {'launch':<11} {'total ms':>8} " + " ".join(f"{phase:>11}" for phase in PHASES))
+    for name in args.scenes or list(SCENES):
+        result = measure(name, args.launches, args.window_type)
+        if "error" in result:
+            print(f"{name:<10} error: {result['error']}")
+            continue
+        for row in ("first", "repeat"):
+            profile = result[row]
+            print(f"{name:<10} {row:<11} {profile['total'] * 1000:>8.0f} "
+                  + " ".join(f"{profile['phases'][phase] * 1000:>11.0f}" for phase in PHASES))
+        change = result["repeat"]["total"] / result["first"]["total"] - 1
+        print(f"{name:<10} repeat against first launch: {change:+.0%}")
+
+
+if __name__ == "__main__":
+    main()
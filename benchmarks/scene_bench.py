@@ -0,0 +1,205 @@
+# Headless frame-time benchmark for every scene in scenes.py. Each scene is
+# built in its own process, driven for a fixed number of frames at a fixed
+# dt, and timed per frame and per task. Run from the repository root:
+#   python -m benchmarks.scene_bench --output results.json
+#   python -m benchmarks.scene_bench --save-baseline benchmarks/baseline.json
+#   python -m benchmarks.scene_bench --baseline benchmarks/baseline.json
+#   python -m benchmarks.scene_bench --trace traces/
+#   python -m benchmarks.scene_bench --replay inputs/
+# With --replay, a scene that has an input log (inputs/<scene>.inrp, made by
+# running it with INPUT_RECORD=inputs/<scene>.inrp) replays it instead of
+# holding its keys, and is timed until the replay ends.
+# Offscreen windows work under software GL (e.g. Mesa llvmpipe); use
+# --window-type none where no GL is available at all.
+from collections import defaultdict
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from replay import REPLAY_DONE_EVENT
+from scenes import REPO_DIR, SCENES
+
+
+def summarize(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    return {
+        "mean": sum(ordered) / len(ordered),
+        "p50": percentile(50),
+        "p95": percentile(95),
+        "p99": percentile(99),
+        "max": ordered[-1],
+    }
+
+
+def measure(name, frames, fps, window_type, warmup):
+    from panda3d.core import ClockObject, loadPrcFileData
+    loadPrcFileData("scene_bench", "audio-library-name null\nsync-video #f")
+
+    scene = SCENES[name]
+    base, module = scene.load(window_type)
+    clock = ClockObject.getGlobalClock()
+    clock.setMode(ClockObject.MNonRealTime)
+    clock.setFrameRate(fps)
+    replay_done = []
+    if os.environ.get("INPUT_REPLAY"):
+        base.accept(REPLAY_DONE_EVENT, replay_done.append)
+    else:
+        scene.hold_keys(base, module)
+
+    for _ in range(warmup):
+        base.taskMgr.step()
+
+    frame_ms = []
+    task_ms = defaultdict(list)
+    for _ in range(frames):
+        if replay_done:
+            break
+        start = time.perf_counter()
+        base.taskMgr.step()
+        frame_ms.append((time.perf_counter() - start) * 1000)
+        for task in base.taskMgr.mgr.getActiveTasks():
+            task_ms[task.getName()].append(task.getDt() * 1000)
+
+    renderer = None
+    if base.win is not None and base.win.getGsg() is not None:
+        renderer = base.win.getGsg().getDriverRenderer()
+
+    return {
+        "frames": len(frame_ms),
+        "replay_matched": replay_done[0] if replay_done else None,
+        "dt": 1.0 / fps,
+        "window_type": window_type,
+        "renderer": renderer,
+        "frame_ms": summarize(frame_ms),
+        "per_frame_ms": frame_ms,
+        "tasks": {task: {"summary": summarize(ms), "per_frame_ms": ms} for task, ms in sorted(task_ms.items())},
+    }
+
+
+def run_scene(name, args):
+    # Every scene owns its ShowBase, so each one gets a fresh interpreter
+    fd, output = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    command = [sys.executable, "-m", "benchmarks.scene_bench", "--child", name,
+               "--frames", str(args.frames), "--fps", str(args.fps),
+               "--warmup", str(args.warmup), "--window-type", args.window_type,
+               "--output", output]
+    env = dict(os.environ)
+    if args.trace:
+        # Turns on profiler.py in the child, which writes the trace on exit
+        env["TASK_PROFILER"] = "1"
+        env["TASK_PROFILER_TRACE"] = os.path.join(os.path.abspath(args.trace), name + ".json")
+    if args.replay:
+        log = os.path.join(os.path.abspath(args.replay), name + ".inrp")
+        if os.path.exists(log):
+            env["INPUT_REPLAY"] = log
+    try:
+        proc = subprocess.run(command, cwd=REPO_DIR, env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "exit %d" % proc.returncode}
+        with open(output) as f:
+            return json.load(f)
+    finally:
+        os.remove(output)
+
+
+def compare(results, baseline, tolerance):
+    # A scene regresses when its p50 or p95 frame time grows by more than
+    # the tolerance over the baseline
+    regressions = []
+    print(f"{'scene':<12} {'metric':>6} {'baseline':>9} {'current':>9} {'change':>8}")
+    for name, result in results["scenes"].items():
+        old = baseline.get("scenes", {}).get(name)
+        if not old or "frame_ms" not in old or "frame_ms" not in result:
+            continue
+        for metric in ("p50", "p95"):
+            before = old["frame_ms"][metric]
+            after = result["frame_ms"][metric]
+            change = after / before - 1 if before else 0.0
+            flag = ""
+            if change > tolerance:
+                flag = "  REGRESSION"
+                regressions.append((name, metric))
+            print(f"{name:<12} {metric:>6} {before:>9.2f} {after:>9.2f} {change:>+7.1%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark scene frame times headlessly.")
+    parser.add_argument("scenes", nargs="*", help="scenes to run (default: all of %s)" % ", ".join(SCENES))
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--fps", type=float, default=60.0, help="fixed simulation rate; dt = 1 / fps")
+    parser.add_argument("--warmup", type=int, default=30)
+    parser.add_argument("--window-type", default="offscreen", choices=["offscreen", "none"])
+    parser.add_argument("--output", help="write the results JSON here")
+    parser.add_argument("--baseline", help="compare against this results JSON")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed slowdown before failing")
+    parser.add_argument("--save-baseline", help="write the results JSON as a new baseline")
+    parser.add_argument("--trace", help="write a Chrome trace per scene into this directory")
+    parser.add_argument("--replay", help="replay <scene>.inrp input logs from this directory")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        result = measure(args.child, args.frames, args.fps, args.window_type, args.warmup)
+        with open(args.output, "w") as f:
+            json.dump(result, f)
+        return 0
+
+    if args.trace:
+        os.makedirs(args.trace, exist_ok=True)
+
+    names = args.scenes or list(SCENES)
+    unknown = [name for name in names if name not in SCENES]
+    if unknown:
+        parser.error("unknown scene(s): %s" % ", ".join(unknown))
+
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "frames": args.frames,
+            "fps": args.fps,
+            "window_type": args.window_type,
+        },
+        "scenes": {},
+    }
+    failed = False
+    print(f"{'scene':<12} {'mean ms':>8} {'p50':>7} {'p95':>7} {'p99':>7} {'max':>7}")
+    for name in names:
+        result = run_scene(name, args)
+        results["scenes"][name] = result
+        if "error" in result:
+            failed = True
+            print(f"{name:<12} error: {result['error']}")
+            continue
+        ms = result["frame_ms"]
+        print(f"{name:<12} {ms['mean']:>8.2f} {ms['p50']:>7.2f} {ms['p95']:>7.2f} {ms['p99']:>7.2f} {ms['max']:>7.2f}")
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print()
+        if compare(results, baseline, args.tolerance):
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
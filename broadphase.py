@@ -0,0 +1,122 @@
+from collections import defaultdict
+from math import cos, floor, hypot, radians, sin
+
+
+class SpatialHash:
+    # Uniform grid over the ground plane. Every body is bucketed into the
+    # cells its (min_x, min_z, max_x, max_z) bounds touch; a query only
+    # looks at bodies sharing a cell with it, so the cost depends on local
+    # density rather than on how many bodies exist in total.
+
+    def __init__(self, cell_size=10.0):
+        self.cell_size = cell_size
+        self.cells = defaultdict(set)
+        self.bounds = {}
+        self.cell_span = {}
+        self.tags = {}
+
+    def __len__(self):
+        return len(self.bounds)
+
+    def __contains__(self, body):
+        return body in self.bounds
+
+    def span(self, bounds):
+        size = self.cell_size
+        return (floor(bounds[0] / size), floor(bounds[1] / size),
+                floor(bounds[2] / size), floor(bounds[3] / size))
+
+    def add(self, body, bounds, tag=None):
+        if body in self.bounds:
+            self.remove(body)
+        span = self.span(bounds)
+        self.bounds[body] = bounds
+        self.cell_span[body] = span
+        self.tags[body] = tag
+        for key in self.keys(span):
+            self.cells[key].add(body)
+
+    def move(self, body, bounds):
+        # Only touch the grid when the body actually crosses a cell border
+        self.bounds[body] = bounds
+        span = self.span(bounds)
+        old = self.cell_span[body]
+        if span == old:
+            return
+        self.cell_span[body] = span
+        old_keys = set(self.keys(old))
+        new_keys = set(self.keys(span))
+        for key in old_keys - new_keys:
+            cell = self.cells[key]
+            cell.discard(body)
+            if not cell:
+                del self.cells[key]
+        for key in new_keys - old_keys:
+            self.cells[key].add(body)
+
+    def remove(self, body):
+        for key in self.keys(self.cell_span.pop(body)):
+            cell = self.cells[key]
+            cell.discard(body)
+            if not cell:
+                del self.cells[key]
+        del self.bounds[body]
+        del self.tags[body]
+
+    def query(self, bounds, tags=None, exclude=None):
+        # Bodies whose bounds overlap the given bounds, optionally limited to
+        # some tags. These are candidates for the narrow phase.
+        found = []
+        seen = set()
+        if exclude is not None:
+            seen.add(exclude)
+        min_x, min_z, max_x, max_z = bounds
+        cells = self.cells
+        for key in self.keys(self.span(bounds)):
+            cell = cells.get(key)
+            if not cell:
+                continue
+            for body in cell:
+                if body in seen:
+                    continue
+                seen.add(body)
+                if tags is not None and self.tags[body] not in tags:
+                    continue
+                other = self.bounds[body]
+                if other[0] <= max_x and other[2] >= min_x and other[1] <= max_z and other[3] >= min_z:
+                    found.append(body)
+        return found
+
+    @staticmethod
+    def keys(span):
+        min_i, min_j, max_i, max_j = span
+        return [(i, j) for i in range(min_i, max_i + 1) for j in range(min_j, max_j + 1)]
+
+
+def entity_bounds(entity, margin=0.0):
+    # Ground-plane bounds of an Ursina entity's box collider (or of its unit
+    # model when it has none). Entities turned a multiple of 90 degrees get
+    # an exact bound; any other heading gets a bound that holds for every
+    # heading, so it stays valid while they turn.
+    collider = getattr(entity, "collider", None)
+    center = getattr(collider, "center", (0, 0, 0))
+    size = getattr(collider, "size", (1, 1, 1))
+    scale = entity.world_scale
+    pos = entity.world_position
+    heading = entity.world_rotation_y
+    # The collider's offset turns with the entity (Ursina headings turn
+    # clockwise seen from above)
+    offset_x = center[0] * scale[0]
+    offset_z = center[2] * scale[2]
+    s, c = sin(radians(heading)), cos(radians(heading))
+    cx = pos[0] + offset_x * c + offset_z * s
+    cz = pos[2] - offset_x * s + offset_z * c
+    half_x = abs(size[0] * scale[0]) / 2
+    half_z = abs(size[2] * scale[2]) / 2
+    if heading % 180 == 90:
+        half_x, half_z = half_z, half_x
+    elif heading % 90:
+        half_x = half_z = hypot(half_x, half_z)
+    half_x += margin
+    half_z += margin
+    return (cx - half_x, cz - half_z, cx + half_x, cz + half_z)
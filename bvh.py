@@ -0,0 +1,473 @@
+from panda3d.core import Geom, GeomVertexReader, InternalName
+import numpy as np
+
+
+# Triangles per leaf; smaller leaves mean deeper trees but fewer wasted
+# triangle tests
+LEAF_SIZE = 4
+# Candidate (query, triangle) pairs tested per numpy block at the leaves
+PAIR_BLOCK = 1 << 18
+EPSILON = 1e-7
+
+_INDEX_TYPES = {Geom.NT_uint8: np.uint8, Geom.NT_uint16: np.uint16, Geom.NT_uint32: np.uint32}
+
+
+def geom_positions(vdata):
+    # (rows, 3) float32 vertex positions, read straight from the array when
+    # they are plain float32 and row by row otherwise
+    fmt = vdata.getFormat()
+    name = InternalName.getVertex()
+    column = fmt.getColumn(name)
+    rows = vdata.getNumRows()
+    if column.getNumericType() == Geom.NT_float32 and column.getNumComponents() >= 3:
+        index = fmt.getArrayWith(name)
+        stride = fmt.getArray(index).getStride()
+        data = np.frombuffer(vdata.getArray(index).getHandle().getData(), dtype=np.uint8)
+        return np.ndarray((rows, 3), dtype=np.float32, buffer=data,
+                          offset=column.getStart(), strides=(stride, 4)).copy()
+    reader = GeomVertexReader(vdata, name)
+    return np.array([tuple(reader.getData3()) for _ in range(rows)], dtype=np.float32).reshape(-1, 3)
+
+
+def primitive_indices(prim):
+    if not prim.isIndexed():
+        return np.arange(prim.getFirstVertex(), prim.getFirstVertex() + prim.getNumVertices())
+    return np.frombuffer(memoryview(prim.getVertices()).cast("B"),
+                         dtype=_INDEX_TYPES[prim.getIndexType()]).astype(np.int64)
+
+
+def scene_triangles(nodes, relative_to):
+    # (N, 3, 3) float32 triangles of every GeomNode under the given nodes,
+    # hidden ones included, in the coordinate space of relative_to
+    triangles = []
+    for node in nodes:
+        for path in node.findAllMatches("**/+GeomNode"):
+            mat = path.getMat(relative_to)
+            matrix = np.array([tuple(mat.getRow(i)) for i in range(4)], dtype=np.float32)
+            geom_node = path.node()
+            for i in range(geom_node.getNumGeoms()):
+                geom = geom_node.getGeom(i).decompose()
+                positions = geom_positions(geom.getVertexData())
+                positions = positions @ matrix[:3, :3] + matrix[3, :3]
+                for prim in geom.getPrimitives():
+                    if prim.getNumVertices() and prim.getPrimitiveType() == Geom.PT_polygons:
+                        triangles.append(positions[primitive_indices(prim).reshape(-1, 3)])
+    if not triangles:
+        return np.zeros((0, 3, 3), dtype=np.float32)
+    return np.concatenate(triangles)
+
+
+def instance_triangles(model, records):
+    # Triangles of every copy of model placed by InstancedMesh-style records
+    # (x, y, z, scale, r, g, b, heading around +Z)
+    if not len(records):
+        return np.zeros((0, 3, 3), dtype=np.float32)
+    local = scene_triangles([model], model)
+    records = np.asarray(records, dtype=np.float32).reshape(len(records), -1)
+    angle = np.radians(records[:, 7])
+    c, s = np.cos(angle)[:, None, None], np.sin(angle)[:, None, None]
+    x, y = local[None, :, :, 0], local[None, :, :, 1]
+    scale = records[:, 3, None, None]
+    placed = np.empty((len(records),) + local.shape, dtype=np.float32)
+    placed[..., 0] = (c * x - s * y) * scale + records[:, 0, None, None]
+    placed[..., 1] = (s * x + c * y) * scale + records[:, 1, None, None]
+    placed[..., 2] = local[None, :, :, 2] * scale + records[:, 2, None, None]
+    return placed.reshape(-1, 3, 3)
+
+
+def _dot(a, b):
+    return np.einsum("ij,ij->i", a, b)
+
+
+def _normalized(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, 3)
+    length = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(length > 0, length, 1)
+
+
+def _rows(values, count):
+    values = np.asarray(values, dtype=np.float32)
+    return np.broadcast_to(values, (count,)) if values.ndim == 0 else values.reshape(count)
+
+
+class BVH:
+    # Bounding-volume hierarchy over static triangles, built once at load
+    # time. Queries come in batches and are answered with NumPy: instead of
+    # walking the tree per query, every live (query, node) pair advances one
+    # level per step, pairs that miss a box or can't beat the best hit so
+    # far are dropped, and the pairs reaching leaves test their triangles
+    # all at once. The cost of a batch is a few dozen array operations per
+    # tree level rather than Python work per query.
+    #
+    # Coordinates are whatever the triangles were given in, e.g. render
+    # space from scene_triangles(). Directions don't need to be normalized;
+    # distances are in world units along them.
+
+    def __init__(self, triangles, leaf_size=LEAF_SIZE):
+        triangles = np.asarray(triangles, dtype=np.float32).reshape(-1, 3, 3)
+        count = len(triangles)
+        capacity = max(1, 2 * count)
+        lo = np.zeros((capacity, 3), dtype=np.float32)
+        hi = np.zeros((capacity, 3), dtype=np.float32)
+        # Leaves: first triangle and how many; inner nodes: left child
+        # (the right one follows it) and a count of 0
+        first = np.zeros(capacity, dtype=np.int64)
+        counts = np.zeros(capacity, dtype=np.int64)
+
+        tri_lo, tri_hi = triangles.min(axis=1), triangles.max(axis=1)
+        centroids = triangles.mean(axis=1)
+        order = np.arange(count)
+        nodes = 1
+        depth = 0
+        stack = [(0, 0, count, 0)] if count else []
+        while stack:
+            node, start, end, level = stack.pop()
+            depth = max(depth, level)
+            members = order[start:end]
+            lo[node] = tri_lo[members].min(axis=0)
+            hi[node] = tri_hi[members].max(axis=0)
+            if end - start <= leaf_size:
+                first[node], counts[node] = start, end - start
+                continue
+            # Median split along the longest axis of the centroids
+            points = centroids[members]
+            axis = int(np.argmax(points.max(axis=0) - points.min(axis=0)))
+            half = (end - start) // 2
+            order[start:end] = members[np.argpartition(points[:, axis], half)]
+            first[node] = nodes
+            stack.append((nodes, start, start + half, level + 1))
+            stack.append((nodes + 1, start + half, end, level + 1))
+            nodes += 2
+
+        self.lo, self.hi = lo[:nodes], hi[:nodes]
+        self.first, self.counts = first[:nodes], counts[:nodes]
+        self.depth = depth
+        ordered = triangles[order]
+        self.triangles = ordered
+        self.v0 = ordered[:, 0]
+        self.e1 = ordered[:, 1] - ordered[:, 0]
+        self.e2 = ordered[:, 2] - ordered[:, 0]
+        self.normals = _normalized(np.cross(self.e1, self.e2)) if count else np.zeros((0, 3), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.triangles)
+
+    def bounds(self):
+        return (self.lo[0], self.hi[0]) if len(self) else None
+
+    def traverse(self, keep, visit, queries):
+        # The wavefront walk shared by every query: keep(queries, nodes)
+        # says which pairs stay alive, visit(queries, triangles) tests the
+        # pairs at leaves and lowers each query's cut-off
+        if not len(self) or not len(queries):
+            return
+        nodes = np.zeros(len(queries), dtype=np.int64)
+        while len(queries):
+            alive = keep(queries, nodes)
+            queries, nodes = queries[alive], nodes[alive]
+            leaf = self.counts[nodes] > 0
+            if leaf.any():
+                self.visit_leaves(visit, queries[leaf], nodes[leaf])
+            inner = ~leaf
+            queries, nodes = queries[inner], nodes[inner]
+            left = self.first[nodes]
+            queries = np.concatenate([queries, queries])
+            nodes = np.concatenate([left, left + 1])
+
+    def visit_leaves(self, visit, queries, nodes):
+        # Expand every (query, leaf) pair into its (query, triangle) pairs
+        counts = self.counts[nodes]
+        total = int(counts.sum())
+        pair = np.repeat(np.arange(len(nodes)), counts)
+        within = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        triangles = self.first[nodes][pair] + within
+        queries = queries[pair]
+        for start in range(0, total, PAIR_BLOCK):
+            block = slice(start, start + PAIR_BLOCK)
+            visit(queries[block], triangles[block])
+
+    @staticmethod
+    def slabs(origins, inverse, lo, hi):
+        # Entry and exit distance of rays through boxes; NaNs (a ray lying
+        # in a flat box's plane) are ignored by fmin/fmax
+        with np.errstate(invalid="ignore"):
+            t0 = (lo - origins) * inverse
+            t1 = (hi - origins) * inverse
+        near = np.fmax.reduce(np.fmin(t0, t1), axis=1)
+        far = np.fmin.reduce(np.fmax(t0, t1), axis=1)
+        return near, far
+
+    def raycast(self, origins, directions, max_distance=np.inf):
+        # Closest hit of each ray. Returns (distance, triangle): inf and -1
+        # where a ray hits nothing within max_distance
+        origins = np.asarray(origins, dtype=np.float32).reshape(-1, 3)
+        directions = _normalized(directions)
+        count = len(origins)
+        best = _rows(max_distance, count).astype(np.float32)
+        hit = np.full(count, -1, dtype=np.int64)
+        with np.errstate(divide="ignore"):
+            inverse = 1.0 / directions
+
+        def rays_hit(queries, nodes):
+            near, far = self.slabs(origins[queries], inverse[queries], self.lo[nodes], self.hi[nodes])
+            return (near <= far) & (far >= 0) & (near <= best[queries])
+
+        def visit(queries, triangles):
+            t = self.intersect(origins[queries], directions[queries], triangles)
+            closer = t < best[queries]
+            self.record(best, hit, queries[closer], t[closer], triangles[closer])
+
+        self.traverse(rays_hit, visit, np.arange(count))
+        return np.where(hit >= 0, best, np.inf), hit
+
+    def intersect(self, origins, directions, triangles):
+        # Moller-Trumbore, double sided; inf where there is no hit
+        v0, e1, e2 = self.v0[triangles], self.e1[triangles], self.e2[triangles]
+        p = np.cross(directions, e2)
+        det = _dot(e1, p)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inverse = 1.0 / det
+            s = origins - v0
+            u = _dot(s, p) * inverse
+            q = np.cross(s, e1)
+            v = _dot(directions, q) * inverse
+            t = _dot(e2, q) * inverse
+            valid = (np.abs(det) > EPSILON) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0)
+        return np.where(valid, t, np.inf)
+
+    @staticmethod
+    def record(best, hit, queries, values, triangles):
+        # Lower best per query and remember which triangle did it
+        if not len(queries):
+            return
+        np.minimum.at(best, queries, values)
+        won = values == best[queries]
+        hit[queries[won]] = triangles[won]
+
+    def spherecast(self, origins, directions, radius, max_distance=np.inf):
+        # First contact of a sphere swept along each ray. Returns (distance
+        # of the centre, triangle) like raycast(); a sphere that already
+        # overlaps a triangle hits it at 0
+        origins = np.asarray(origins, dtype=np.float32).reshape(-1, 3)
+        directions = _normalized(directions)
+        count = len(origins)
+        radius = _rows(radius, count)
+        best = _rows(max_distance, count).astype(np.float32)
+        hit = np.full(count, -1, dtype=np.int64)
+        with np.errstate(divide="ignore"):
+            inverse = 1.0 / directions
+
+        def rays_hit(queries, nodes):
+            r = radius[queries][:, None]
+            near, far = self.slabs(origins[queries], inverse[queries], self.lo[nodes] - r, self.hi[nodes] + r)
+            return (near <= far) & (far >= 0) & (near <= best[queries])
+
+        def visit(queries, triangles):
+            t = self.sweep(origins[queries], directions[queries], radius[queries], triangles)
+            closer = t < best[queries]
+            self.record(best, hit, queries[closer], t[closer], triangles[closer])
+
+        self.traverse(rays_hit, visit, np.arange(count))
+        return np.where(hit >= 0, best, np.inf), hit
+
+    def sweep(self, origins, directions, radius, triangles):
+        # Swept sphere against triangles: the earliest of touching the face,
+        # one of the three edges or one of the three corners
+        v0 = self.v0[triangles]
+        corners = (v0, v0 + self.e1[triangles], v0 + self.e2[triangles])
+        normal = self.normals[triangles]
+        r = radius.astype(np.float32)
+
+        # The face, from whichever side the sphere comes
+        dn = _dot(directions, normal)
+        normal = np.where((dn > 0)[:, None], -normal, normal)
+        dn = -np.abs(dn)
+        height = _dot(origins - v0, normal)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.where(height > r, (height - r) / -dn, 0.0)
+        reaches = (height > -r) & ((height <= r) | (dn < -EPSILON))
+        t = np.where(reaches & np.isfinite(t), t, np.inf)
+        contact = origins + directions * np.where(np.isfinite(t), t, 0)[:, None]
+        contact -= normal * _dot(contact - v0, normal)[:, None]
+        best = np.where(self.inside(contact, triangles), t, np.inf)
+
+        for a, b in ((0, 1), (1, 2), (2, 0)):
+            best = np.minimum(best, self.sweep_edge(origins, directions, r, corners[a], corners[b]))
+        for corner in corners:
+            best = np.minimum(best, self.sweep_point(origins, directions, r, corner))
+        return best
+
+    def inside(self, points, triangles):
+        # Whether points in a triangle's plane are inside it (barycentric)
+        e1, e2 = self.e1[triangles], self.e2[triangles]
+        w = points - self.v0[triangles]
+        d11, d12, d22 = _dot(e1, e1), _dot(e1, e2), _dot(e2, e2)
+        dw1, dw2 = _dot(w, e1), _dot(w, e2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            denominator = d11 * d22 - d12 * d12
+            u = (d22 * dw1 - d12 * dw2) / denominator
+            v = (d11 * dw2 - d12 * dw1) / denominator
+        return (u >= -1e-5) & (v >= -1e-5) & (u + v <= 1 + 1e-5)
+
+    @staticmethod
+    def sweep_point(origins, directions, r, point):
+        m = origins - point
+        b = _dot(m, directions)
+        c = _dot(m, m) - r * r
+        disc = b * b - c
+        with np.errstate(invalid="ignore"):
+            t = -b - np.sqrt(disc)
+        t = np.where(c <= 0, 0.0, t)
+        return np.where((disc >= 0) & (t >= 0), t, np.inf)
+
+    @staticmethod
+    def sweep_edge(origins, directions, r, a, b):
+        # The cylinder around the edge, limited to the segment; its ends are
+        # covered by the corner spheres
+        edge = b - a
+        length = np.sqrt(_dot(edge, edge))
+        axis = edge / np.where(length > 0, length, 1)[:, None]
+        m = origins - a
+        d_perp = directions - axis * _dot(directions, axis)[:, None]
+        m_perp = m - axis * _dot(m, axis)[:, None]
+        qa = _dot(d_perp, d_perp)
+        qb = 2 * _dot(m_perp, d_perp)
+        qc = _dot(m_perp, m_perp) - r * r
+        disc = qb * qb - 4 * qa * qc
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = (-qb - np.sqrt(disc)) / (2 * qa)
+        t = np.where(qc <= 0, 0.0, t)
+        along = _dot(m + directions * np.where(np.isfinite(t), t, 0)[:, None], axis)
+        valid = (disc >= 0) & (t >= 0) & (qa > EPSILON) & (along >= 0) & (along <= length)
+        return np.where(valid, t, np.inf)
+
+    def nearest(self, points, max_distance=np.inf):
+        # Closest point on the geometry to each point. Returns (distance,
+        # closest point, triangle); inf, NaN and -1 where nothing is within
+        # max_distance
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 3)
+        count = len(points)
+        best = _rows(max_distance, count).astype(np.float32) ** 2
+        hit = np.full(count, -1, dtype=np.int64)
+        closest = np.full((count, 3), np.nan, dtype=np.float32)
+
+        def visit(queries, triangles):
+            found = self.closest_points(points[queries], triangles)
+            distance = np.sum((found - points[queries]) ** 2, axis=1)
+            closer = distance < best[queries]
+            queries, distance, triangles, found = queries[closer], distance[closer], triangles[closer], found[closer]
+            self.record(best, hit, queries, distance, triangles)
+            won = distance == best[queries]
+            closest[queries[won]] = found[won]
+
+        if len(self):
+            # A greedy walk down the nearer child first gives every query a
+            # bound, so the full walk can prune from the first level on
+            queries = np.arange(count)
+            nodes = np.zeros(count, dtype=np.int64)
+            while len(queries):
+                leaf = self.counts[nodes] > 0
+                if leaf.any():
+                    self.visit_leaves(visit, queries[leaf], nodes[leaf])
+                queries, nodes = queries[~leaf], nodes[~leaf]
+                left = self.first[nodes]
+                near_left = (self.box_distance(points[queries], left)
+                             <= self.box_distance(points[queries], left + 1))
+                nodes = np.where(near_left, left, left + 1)
+
+        def boxes_near(queries, nodes):
+            return self.box_distance(points[queries], nodes) <= best[queries]
+
+        self.traverse(boxes_near, visit, np.arange(count))
+        return np.where(hit >= 0, np.sqrt(best), np.inf), closest, hit
+
+    def box_distance(self, points, nodes):
+        # Squared distance from points to node boxes, 0 inside
+        gap = np.maximum(np.maximum(self.lo[nodes] - points, points - self.hi[nodes]), 0)
+        return np.sum(gap * gap, axis=1)
+
+    def closest_points(self, points, triangles):
+        # Closest point on each triangle (Ericson, Real-Time Collision
+        # Detection 5.1.5), one Voronoi region at a time
+        a = self.v0[triangles]
+        ab, ac = self.e1[triangles], self.e2[triangles]
+        b, c = a + ab, a + ac
+        ap, bp, cp = points - a, points - b, points - c
+        d1, d2 = _dot(ab, ap), _dot(ac, ap)
+        d3, d4 = _dot(ab, bp), _dot(ac, bp)
+        d5, d6 = _dot(ab, cp), _dot(ac, cp)
+        va = d3 * d6 - d5 * d4
+        vb = d5 * d2 - d1 * d6
+        vc = d1 * d4 - d3 * d2
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # Inside the face
+            denominator = va + vb + vc
+            v = vb / denominator
+            w = vc / denominator
+            result = a + ab * v[:, None] + ac * w[:, None]
+            # Edges
+            bc_t = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+            on_bc = (va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0)
+            result = np.where(on_bc[:, None], b + (c - b) * bc_t[:, None], result)
+            ac_t = d2 / (d2 - d6)
+            on_ac = (vb <= 0) & (d2 >= 0) & (d6 <= 0)
+            result = np.where(on_ac[:, None], a + ac * ac_t[:, None], result)
+            ab_t = d1 / (d1 - d3)
+            on_ab = (vc <= 0) & (d1 >= 0) & (d3 <= 0)
+            result = np.where(on_ab[:, None], a + ab * ab_t[:, None], result)
+        # Corners
+        result = np.where(((d6 >= 0) & (d5 <= d6))[:, None], c, result)
+        result = np.where(((d3 >= 0) & (d4 <= d3))[:, None], b, result)
+        result = np.where(((d1 <= 0) & (d2 <= 0))[:, None], a, result)
+        # Degenerate triangles fall back to their first corner
+        return np.where(np.isfinite(result), result, a)
+
+
+def ground_heights(bvh, points, up, probe=50.0):
+    # Height along up of the first surface straight below each point,
+    # probing from up to probe units above it; NaN where there is none
+    points = np.asarray(points, dtype=np.float32).reshape(-1, 3)
+    up = np.asarray(up, dtype=np.float32)
+    distance, _ = bvh.raycast(points + up * probe, np.broadcast_to(-up, points.shape), 2 * probe)
+    return np.where(np.isfinite(distance), points @ up + probe - distance, np.nan)
+
+
+class SpringArm:
+    # Holds a node (usually the camera) at the end of an arm from a pivot,
+    # pulled in along the arm when static geometry is in the way. The arm is
+    # swept with a sphere, so the near plane doesn't cut into walls at
+    # grazing angles either. It snaps in at once and eases back out.
+    #
+    # pivot and offset are in the space of node's parent; bvh is in the
+    # space of world. Both can be changed between updates.
+
+    def __init__(self, node, bvh, world, pivot=(0, 0, 0), offset=(0, -10, 0), radius=0.3, margin=0.1,
+                 return_speed=8.0):
+        self.node = node
+        self.bvh = bvh
+        self.world = world
+        self.pivot = np.asarray(pivot, dtype=np.float32)
+        self.offset = np.asarray(offset, dtype=np.float32)
+        self.radius = radius
+        self.margin = margin
+        self.return_speed = return_speed
+        self.fraction = 1.0
+
+    def update(self, dt):
+        parent = self.node.getParent()
+        start = self.world.getRelativePoint(parent, tuple(self.pivot.tolist()))
+        end = self.world.getRelativePoint(parent, tuple((self.pivot + self.offset).tolist()))
+        arm = end - start
+        length = arm.length()
+        allowed = 1.0
+        if length > 0 and self.bvh is not None:
+            distance, _ = self.bvh.spherecast(tuple(start), tuple(arm), self.radius, length)
+            if np.isfinite(distance[0]):
+                allowed = max(float(distance[0]) - self.margin, 0.0) / length
+        if allowed < self.fraction:
+            self.fraction = allowed
+        elif length > 0:
+            self.fraction = min(allowed, self.fraction + self.return_speed * dt / length)
+        self.node.setPos(*(self.pivot + self.offset * self.fraction).tolist())
+        return self.fraction
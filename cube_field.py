@@ -0,0 +1,216 @@
+from panda3d.core import (
+    BoundingBox, ConfigVariableInt, ConfigVariableString, Geom, GeomVertexArrayFormat,
+    GeomVertexFormat, InternalName, Point3, Shader
+)
+from math import sin, cos
+import numpy as np
+import os
+
+
+cube_animation = ConfigVariableString(
+    "cube-animation", os.environ.get("CUBE_ANIMATION", "shader"),
+    "How IllusionGame animates its cubes: 'shader' computes rotation, scale and color "
+    "on the GPU from one time uniform, 'python' sets them on every node each frame.")
+cube_count = ConfigVariableInt(
+    "cube-count", int(os.environ.get("CUBE_COUNT", "1")),
+    "Animated cubes in IllusionGame; more than one lays out a rippling field of them.")
+
+# The animation IllusionGame has always had, at phase 0: HPR turning at
+# these degrees per second, scale pulsing by a quarter around the base
+# scale, red and green cycling
+SPIN = (30.0, 20.0, 10.0)
+PULSE = 0.25
+
+# Per-instance vertex columns, advanced once per instance (divisor 1):
+#   instance: x, y, z, base scale
+#   phase:    seconds added to the shared time
+INSTANCE_ARRAY = GeomVertexArrayFormat()
+INSTANCE_ARRAY.addColumn(InternalName.make("instance"), 4, Geom.NT_float32, Geom.C_other)
+INSTANCE_ARRAY.addColumn(InternalName.make("phase"), 1, Geom.NT_float32, Geom.C_other)
+INSTANCE_ARRAY.setDivisor(1)
+
+CUBE_VERT = """
+#version 150
+
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform mat4 p3d_ModelViewMatrix;
+uniform float anim_time;
+uniform vec3 spin;
+uniform float pulse;
+
+in vec4 p3d_Vertex;
+in vec4 instance;
+in float phase;
+
+out vec3 v_position;
+out vec4 v_color;
+
+// Panda's HPR rotation: heading around Z, then pitch around X, then roll
+// around Y, i.e. the same matrix setHpr() builds
+mat3 hpr_matrix(vec3 hpr) {
+    vec3 c = cos(hpr);
+    vec3 s = sin(hpr);
+    mat3 h = mat3(c.x, s.x, 0.0, -s.x, c.x, 0.0, 0.0, 0.0, 1.0);
+    mat3 p = mat3(1.0, 0.0, 0.0, 0.0, c.y, s.y, 0.0, -s.y, c.y);
+    mat3 r = mat3(c.z, 0.0, -s.z, 0.0, 1.0, 0.0, s.z, 0.0, c.z);
+    return h * p * r;
+}
+
+void main() {
+    float t = anim_time + phase;
+    float scale = instance.w * (1.0 + pulse * sin(t));
+    vec3 local = hpr_matrix(radians(spin * t)) * p3d_Vertex.xyz;
+    vec4 vertex = vec4(local * scale + instance.xyz, 1.0);
+
+    gl_Position = p3d_ModelViewProjectionMatrix * vertex;
+    v_position = vec3(p3d_ModelViewMatrix * vertex);
+    v_color = vec4(0.5 + 0.5 * sin(t), 0.5 + 0.5 * cos(t), 0.8, 1.0);
+}
+"""
+
+CUBE_FRAG = """
+#version 150
+
+uniform struct {
+    vec4 ambient;
+} p3d_LightModel;
+uniform struct {
+    vec4 color;
+    vec4 position;
+} p3d_LightSource[4];
+
+in vec3 v_position;
+in vec4 v_color;
+
+out vec4 p3d_FragColor;
+
+void main() {
+    // Flat face normals from the screen-space derivatives, so meshes
+    // without normals (like the procedural cube) are lit per face too
+    vec3 normal = normalize(cross(dFdx(v_position), dFdy(v_position)));
+    vec3 light = p3d_LightModel.ambient.rgb;
+    for (int i = 0; i < 4; ++i) {
+        vec4 pos = p3d_LightSource[i].position;
+        vec3 to_light = pos.xyz - v_position * pos.w;
+        if (dot(to_light, to_light) > 0.0) {
+            light += p3d_LightSource[i].color.rgb * max(dot(normal, normalize(to_light)), 0.0);
+        }
+    }
+    p3d_FragColor = vec4(v_color.rgb * light, v_color.a);
+}
+"""
+
+_shader = None
+
+
+def get_cube_shader():
+    global _shader
+    if _shader is None:
+        _shader = Shader.make(Shader.SL_GLSL, CUBE_VERT, CUBE_FRAG)
+    return _shader
+
+
+def field_layout(count, spacing=2.5, scale=0.5, height=1.0, ripple=0.3):
+    # (offsets, scales, phases) of count cubes. One cube is IllusionGame's
+    # original: scale 2 at (0, 0, 1). More are laid out in a square grid
+    # around the origin, their phase growing with the distance from the
+    # centre so the animation ripples outward.
+    if count < 1:
+        raise ValueError("cube count must be at least 1, got %d" % count)
+    if count == 1:
+        return np.array([(0.0, 0.0, height)]), np.array([2.0]), np.zeros(1)
+    side = int(np.ceil(np.sqrt(count)))
+    row, column = np.divmod(np.arange(count), side)
+    x = (column - (side - 1) / 2) * spacing
+    y = (row - (side - 1) / 2) * spacing
+    offsets = np.column_stack([x, y, np.full(count, height)])
+    return offsets, np.full(count, scale), np.hypot(x, y) * ripple / spacing
+
+
+class ShaderCubes:
+    # Any number of animated copies of a model in one instanced draw call
+    # per Geom. Where each copy sits and its phase are per-instance vertex
+    # attributes uploaded once; rotation, scale and color are computed in
+    # the shader, so each frame only the anim_time uniform changes.
+
+    def __init__(self, model, parent, offsets, scales, phases, name="cubes"):
+        self.count = len(offsets)
+        self.root = parent.attachNewNode(name)
+        model.copyTo(self.root)
+        self.root.flattenStrong()
+        self.root.setShader(get_cube_shader())
+        self.root.setShaderInput("anim_time", 0.0)
+        self.root.setShaderInput("spin", SPIN)
+        self.root.setShaderInput("pulse", PULSE)
+
+        records = np.zeros((self.count, 5), dtype=np.float32)
+        records[:, 0:3] = offsets
+        records[:, 3] = scales
+        records[:, 4] = phases
+        for path in self.root.findAllMatches("**/+GeomNode"):
+            node = path.node()
+            for i in range(node.getNumGeoms()):
+                add_instance_array(node.modifyGeom(i).modifyVertexData(), records)
+        lo, hi = model.getTightBounds()
+        self.root.setInstanceCount(self.count)
+        self.root.node().setFinal(True)
+
+        # The shader moves the vertices, so give Panda bounds that hold every
+        # copy at any angle and its largest scale
+        reach = max(Point3(*lo).length(), Point3(*hi).length()) * float(scales.max()) * (1 + PULSE)
+        mins = np.asarray(offsets).min(axis=0) - reach
+        maxs = np.asarray(offsets).max(axis=0) + reach
+        self.root.node().setBounds(BoundingBox(Point3(*mins), Point3(*maxs)))
+
+    def update(self, t):
+        self.root.setShaderInput("anim_time", t)
+
+    def destroy(self):
+        self.root.removeNode()
+
+
+def add_instance_array(vdata, records):
+    # Appends the per-instance columns to a Geom's vertex data as a second
+    # array with its own row count
+    fmt = GeomVertexFormat(vdata.getFormat())
+    index = fmt.addArray(INSTANCE_ARRAY)
+    vdata.setFormat(GeomVertexFormat.registerFormat(fmt))
+    array = vdata.modifyArray(index)
+    array.uncleanSetNumRows(len(records))
+    memoryview(array).cast("B")[:] = memoryview(np.ascontiguousarray(records)).cast("B")
+
+
+class PythonCubes:
+    # The same animation with one node per cube, set from Python every
+    # frame; the reference the shader has to match
+
+    def __init__(self, model, parent, offsets, scales, phases, name="cubes"):
+        self.root = parent.attachNewNode(name)
+        self.cubes = []
+        for offset, scale, phase in zip(offsets.tolist(), scales.tolist(), phases.tolist()):
+            cube = model.copyTo(self.root)
+            cube.setPos(*offset)
+            cube.setScale(scale)
+            self.cubes.append((cube, scale, phase))
+
+    def update(self, t):
+        h, p, r = SPIN
+        for cube, base, phase in self.cubes:
+            time = t + phase
+            cube.setHpr(time * h, time * p, time * r)
+            cube.setScale(base * (1 + PULSE * sin(time)))
+            cube.setColor(0.5 + 0.5 * sin(time), 0.5 + 0.5 * cos(time), 0.8, 1)
+
+    def destroy(self):
+        self.root.removeNode()
+
+
+def make_cubes(model, parent, mode=None, count=None):
+    # The cubes IllusionGame animates, as configured by cube-animation and
+    # cube-count unless given here
+    mode = cube_animation.getValue() if mode is None else mode
+    count = cube_count.getValue() if count is None else count
+    kinds = {"shader": ShaderCubes, "python": PythonCubes}
+    if mode not in kinds:
+        raise ValueError("cube-animation must be one of %s, got %r" % (", ".join(kinds), mode))
+    return kinds[mode](model, parent, *field_layout(count))
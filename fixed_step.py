@@ -0,0 +1,83 @@
+from panda3d.core import Quat
+
+
+class FixedStep:
+    # Runs step(dt) at a fixed rate, decoupled from the frame rate: a frame
+    # runs as many steps as the elapsed time covers, possibly none. Tracked
+    # nodes are drawn interpolated between the last two simulated states, and
+    # step() always sees the simulated state, never the interpolated one.
+
+    def __init__(self, step, rate=120, max_steps=8, max_frame_time=0.25):
+        self.step = step
+        self.dt = 1.0 / rate
+        # Spiral-of-death guard: when a frame would need more than max_steps
+        # steps, the remaining time is dropped and the game slows down
+        # instead of falling further behind every frame
+        self.max_steps = max_steps
+        self.max_frame_time = max_frame_time
+        self.accumulator = 0.0
+        self.alpha = 0.0
+        self.steps = 0
+        self.dropped = 0.0
+        self.nodes = {}
+        self.snapped = set()
+
+    def track(self, node):
+        # node is a NodePath (Ursina entities are NodePaths too)
+        state = node.getTransform()
+        self.nodes[node] = [state, state]
+
+    def untrack(self, node):
+        self.nodes.pop(node, None)
+        self.snapped.discard(node)
+
+    def snap(self, node):
+        # Call from step() after teleporting a node so the jump isn't
+        # interpolated across the whole distance
+        self.snapped.add(node)
+
+    def advance(self, frame_dt):
+        frame_dt = min(frame_dt, self.max_frame_time)
+        self.accumulator += frame_dt
+        steps = 0
+        if self.accumulator >= self.dt:
+            self.restore()
+            while self.accumulator >= self.dt:
+                if steps == self.max_steps:
+                    self.dropped += self.accumulator
+                    self.accumulator = 0.0
+                    break
+                self.step(self.dt)
+                self.capture()
+                self.accumulator -= self.dt
+                steps += 1
+        self.steps += steps
+        self.alpha = self.accumulator / self.dt
+        self.interpolate()
+        return steps
+
+    def restore(self):
+        # The exact TransformState is put back, so how many frames a run is
+        # split into can't change the simulation by even a rounding error
+        for node, (previous, current) in self.nodes.items():
+            node.setTransform(current)
+
+    def capture(self):
+        for node, states in self.nodes.items():
+            current = node.getTransform()
+            states[0] = current if node in self.snapped else states[1]
+            states[1] = current
+        self.snapped.clear()
+
+    def interpolate(self):
+        alpha = self.alpha
+        for node, (previous, current) in self.nodes.items():
+            pos = previous.getPos() + (current.getPos() - previous.getPos()) * alpha
+            # Normalized lerp along the shorter arc is close enough to a
+            # slerp for the small rotations of one step
+            a, b = previous.getQuat(), current.getQuat()
+            if a.dot(b) < 0:
+                b = -b
+            quat = Quat(a * (1 - alpha) + b * alpha)
+            quat.normalize()
+            node.setPosQuat(pos, quat)
@@ -0,0 +1,158 @@
+from panda3d.core import LVector3, Mat4, NodePath
+from instancing import INSTANCE_FLOATS, InstancedMesh
+import numpy as np
+import random
+
+
+class AIFleet:
+    # AI opponents as a structure of arrays: lateral position, distance
+    # along the track, heading, speed and target lane are NumPy arrays, so
+    # one step() moves the whole fleet with a handful of vectorized
+    # operations however many cars there are. Coordinates are in the ground
+    # plane: x across the track, y along it (Ursina's z), like terrain.py.
+    #
+    # The first len(nodes) agents drive bound scene nodes, pushed in one
+    # sync loop; the rest are drawn as hardware instances.
+
+    def __init__(self, count, lanes=(-3.0, 0.0, 3.0), start=-50.0, end=60.0, speed=4.0,
+                 height=0.5, seed=None, groups=None):
+        # Seeded from random by default, so a replay session's seed covers
+        # the fleet too
+        self.rng = np.random.default_rng(random.getrandbits(64) if seed is None else seed)
+        self.lanes = np.asarray(lanes, dtype=np.float32)
+        self.start = start
+        self.end = end
+        self.cruise = speed
+        self.height = height
+
+        # Steering and spacing
+        self.steer_rate = 2.0  # lateral speed per unit of lane error
+        self.max_lateral = 2.0
+        self.accel = 3.0
+        self.brake = 8.0
+        self.car_width = 1.0
+        self.min_gap = 1.5
+        self.headway = 0.6  # seconds to the car ahead at the current speed
+        self.lane_change_rate = 0.5  # per second, while blocked
+
+        self.lane = self.rng.integers(len(self.lanes), size=count)
+        self.x = self.lanes[self.lane].copy()
+        self.y = self.rng.uniform(start + 20, end - 30, size=count).astype(np.float32)
+        self.speed = np.full(count, speed, dtype=np.float32)
+        # Everyone cruises a little differently, or nobody would ever catch up
+        self.top_speed = (speed * self.rng.uniform(0.85, 1.15, size=count)).astype(np.float32)
+        self.heading = np.zeros(count, dtype=np.float32)
+        self.respawned = np.zeros(count, dtype=bool)
+        # Cars in different groups (e.g. independent races simulated side
+        # by side) never see each other
+        self.groups = np.zeros(count, dtype=np.int64) if groups is None else np.asarray(groups)
+
+        self.nodes = []
+        self.instances = None
+        self.right = np.array(LVector3.right(), dtype=np.float32)
+        self.forward = np.array(LVector3.forward(), dtype=np.float32)
+        self.up = np.array(LVector3.up(), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.x)
+
+    def bind(self, nodes):
+        # Agent i drives nodes[i] from now on
+        self.nodes = list(nodes)
+        self.sync()
+
+    def instance(self, model, parent, scale=1.0, color=(1, 1, 1)):
+        # Draw every agent without a bound node as an instance of model.
+        # InstancedMesh works in a Z-up frame, so it gets a parent whose
+        # axes are this coordinate system's right, forward and up.
+        frame = Mat4(*self.right, 0, *self.forward, 0, *self.up, 0, 0, 0, 0, 1)
+        self.frame = parent.attachNewNode("fleet")
+        self.frame.setMat(frame)
+        placed = NodePath("agent")
+        model.copyTo(placed)
+        inverse = Mat4()
+        inverse.invertFrom(frame)
+        placed.setMat(inverse)
+        self.instances = InstancedMesh(placed, self.frame, "fleet-instances",
+                                       capacity=max(len(self) - len(self.nodes), 1))
+        self.instance_scale = scale
+        self.instance_color = color
+        self.sync()
+
+    def step(self, dt):
+        count = len(self)
+        if not count:
+            return
+
+        # Spacing: order the fleet by group, lane, then distance along the
+        # track, so every car's leader is simply the next entry
+        order = np.lexsort((self.y, self.lane, self.groups))
+        lane, y, groups = self.lane[order], self.y[order], self.groups[order]
+        same_lane = np.zeros(count, dtype=bool)
+        same_lane[:-1] = (lane[1:] == lane[:-1]) & (groups[1:] == groups[:-1])
+        gap = np.full(count, np.inf, dtype=np.float32)
+        gap[:-1] = np.where(same_lane[:-1], y[1:] - y[:-1], np.inf)
+        # Only cars actually in their lane block it
+        settled = np.abs(self.x - self.lanes[self.lane]) < self.car_width
+        gap[:-1] = np.where(settled[order][1:], gap[:-1], np.inf)
+
+        gaps = np.empty(count, dtype=np.float32)
+        gaps[order] = gap
+
+        # Follow the leader: keep min_gap plus headway seconds behind it
+        desired = np.minimum(self.top_speed, np.maximum(gaps - self.min_gap, 0) / self.headway)
+        self.speed += np.clip(desired - self.speed, -self.brake * dt, self.accel * dt)
+
+        # Blocked cars try another lane now and then
+        blocked = (desired < self.top_speed * 0.9) & (self.rng.random(count) < self.lane_change_rate * dt)
+        if blocked.any():
+            shift = self.rng.choice((-1, 1), size=int(blocked.sum()))
+            self.lane[blocked] = np.clip(self.lane[blocked] + shift, 0, len(self.lanes) - 1)
+
+        # Steer toward the lane centre
+        error = self.lanes[self.lane] - self.x
+        lateral = np.clip(error * self.steer_rate, -self.max_lateral, self.max_lateral)
+        self.x += lateral * dt
+        self.y += self.speed * dt
+        # Panda's heading turns forward toward -right; a stopped car still
+        # points roughly down the track
+        self.heading = np.degrees(np.arctan2(-lateral, np.maximum(self.speed, 1.0))).astype(np.float32)
+
+        # Wrap around: past the end, respawn at the start in a random lane
+        self.respawned = self.y > self.end
+        if self.respawned.any():
+            n = int(self.respawned.sum())
+            self.y[self.respawned] = self.start
+            self.lane[self.respawned] = self.rng.integers(len(self.lanes), size=n)
+            self.x[self.respawned] = self.lanes[self.lane[self.respawned]]
+            self.speed[self.respawned] = self.cruise
+
+        self.sync()
+
+    def positions(self):
+        # (N, 3) world positions of every agent
+        return (self.x[:, None] * self.right + self.y[:, None] * self.forward
+                + np.float32(self.height) * self.up)
+
+    def sync(self):
+        bound = len(self.nodes)
+        if bound:
+            positions = self.positions()[:bound].tolist()
+            for node, pos, heading in zip(self.nodes, positions, self.heading[:bound].tolist()):
+                node.setPosHpr(*pos, heading, 0, 0)
+        if self.instances is not None:
+            rest = slice(bound, len(self))
+            records = np.empty((len(self) - bound, INSTANCE_FLOATS), dtype=np.float32)
+            records[:, 0] = self.x[rest]
+            records[:, 1] = self.y[rest]
+            records[:, 2] = self.height
+            records[:, 3] = self.instance_scale
+            records[:, 4:7] = self.instance_color
+            records[:, 7] = self.heading[rest]
+            self.instances.set_all(records)
+
+    def destroy(self):
+        if self.instances is not None:
+            self.instances.destroy()
+            self.frame.removeNode()
+            self.instances = None
@@ -0,0 +1,119 @@
+from panda3d.core import (
+    Geom, GeomNode, GeomTriangles, GeomVertexArrayFormat, GeomVertexData, GeomVertexFormat,
+    InternalName, NodePath
+)
+import hashlib
+import numpy as np
+
+
+# Geoms built from identical arrays are shared instead of rebuilt
+_geom_cache = {}
+_format_cache = {}
+
+
+def vertex_format(has_normals, has_uvs, has_colors):
+    # One interleaved float32 array, columns in the order they are packed
+    key = (has_normals, has_uvs, has_colors)
+    if key not in _format_cache:
+        array = GeomVertexArrayFormat()
+        array.addColumn(InternalName.getVertex(), 3, Geom.NT_float32, Geom.C_point)
+        if has_normals:
+            array.addColumn(InternalName.getNormal(), 3, Geom.NT_float32, Geom.C_normal)
+        if has_uvs:
+            array.addColumn(InternalName.getTexcoord(), 2, Geom.NT_float32, Geom.C_texcoord)
+        if has_colors:
+            array.addColumn(InternalName.getColor(), 4, Geom.NT_float32, Geom.C_color)
+        _format_cache[key] = GeomVertexFormat.registerFormat(GeomVertexFormat(array))
+    return _format_cache[key]
+
+
+def _as_columns(values, width, rows):
+    values = np.asarray(values, dtype=np.float32).reshape(-1, width)
+    if len(values) != rows:
+        raise ValueError("expected %d rows of %d values, got %d" % (rows, width, len(values)))
+    return values
+
+
+def fill_vertex_data(vdata, positions, normals=None, uvs=None, colors=None):
+    # Interleave every attribute into one float32 block and copy it into the
+    # vertex array in a single write
+    positions = np.asarray(positions, dtype=np.float32).reshape(-1, 3)
+    rows = len(positions)
+    columns = [positions]
+    if normals is not None:
+        columns.append(_as_columns(normals, 3, rows))
+    if uvs is not None:
+        columns.append(_as_columns(uvs, 2, rows))
+    if colors is not None:
+        columns.append(_as_columns(colors, 4, rows))
+    interleaved = np.ascontiguousarray(np.hstack(columns) if len(columns) > 1 else positions)
+
+    vdata.uncleanSetNumRows(rows)
+    memoryview(vdata.modifyArray(0)).cast("B")[:] = memoryview(interleaved).cast("B")
+    return vdata
+
+
+def fill_triangles(prim, indices, rows):
+    indices = np.asarray(indices).reshape(-1)
+    if len(indices) % 3:
+        raise ValueError("triangle index count must be a multiple of 3")
+    if rows <= 0xffff:
+        prim.setIndexType(Geom.NT_uint16)
+        indices = indices.astype(np.uint16)
+    else:
+        prim.setIndexType(Geom.NT_uint32)
+        indices = indices.astype(np.uint32)
+
+    handle = prim.modifyVertices()
+    handle.uncleanSetNumRows(len(indices))
+    memoryview(handle).cast("B")[:] = memoryview(np.ascontiguousarray(indices)).cast("B")
+    return prim
+
+
+def build_geom(positions, indices, normals=None, uvs=None, colors=None,
+               name="mesh", usage=Geom.UHStatic):
+    fmt = vertex_format(normals is not None, uvs is not None, colors is not None)
+    vdata = fill_vertex_data(GeomVertexData(name, fmt, usage), positions, normals, uvs, colors)
+
+    triangles = fill_triangles(GeomTriangles(usage), indices, vdata.getNumRows())
+    geom = Geom(vdata)
+    geom.addPrimitive(triangles)
+    return geom
+
+
+def geom_key(positions, indices, normals=None, uvs=None, colors=None):
+    digest = hashlib.blake2b(digest_size=16)
+    for values in (positions, indices, normals, uvs, colors):
+        if values is None:
+            digest.update(b"-")
+            continue
+        values = np.ascontiguousarray(values)
+        digest.update(str((values.dtype.str, values.shape)).encode())
+        digest.update(memoryview(values).cast("B"))
+    return digest.hexdigest()
+
+
+def cached_geom(positions, indices, normals=None, uvs=None, colors=None, name="mesh", key=None):
+    # Callers that can name their primitive cheaply (e.g. ("grid", n)) may
+    # pass a key to skip hashing the arrays
+    if key is None:
+        key = geom_key(positions, indices, normals, uvs, colors)
+    geom = _geom_cache.get(key)
+    if geom is None:
+        geom = build_geom(positions, indices, normals, uvs, colors, name=name)
+        _geom_cache[key] = geom
+    return geom
+
+
+def clear_geom_cache():
+    _geom_cache.clear()
+
+
+def make_mesh(name, positions, indices, normals=None, uvs=None, colors=None, cache=True, key=None):
+    if cache:
+        geom = cached_geom(positions, indices, normals, uvs, colors, name=name, key=key)
+    else:
+        geom = build_geom(positions, indices, normals, uvs, colors, name=name)
+    node = GeomNode(name)
+    node.addGeom(geom)
+    return NodePath(node)
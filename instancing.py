@@ -0,0 +1,252 @@
+from panda3d.core import Shader, Texture, GeomEnums, BoundingBox, Point3
+from direct.task.TaskManagerGlobal import taskMgr
+from direct.task import Task
+import numpy as np
+
+
+# Each instance is packed as two RGBA32F texels in a buffer texture:
+#   texel 0: x, y, z, uniform scale
+#   texel 1: r, g, b tint, heading (degrees, around +Z)
+INSTANCE_FLOATS = 8
+TEXELS_PER_INSTANCE = INSTANCE_FLOATS // 4
+
+INSTANCE_VERT = """
+#version 150
+
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform mat4 p3d_ModelViewMatrix;
+uniform mat3 p3d_NormalMatrix;
+uniform samplerBuffer instance_data;
+
+in vec4 p3d_Vertex;
+in vec3 p3d_Normal;
+in vec4 p3d_Color;
+in vec2 p3d_MultiTexCoord0;
+
+out vec3 v_position;
+out vec3 v_normal;
+out vec4 v_color;
+out vec2 v_texcoord;
+
+void main() {
+    vec4 placement = texelFetch(instance_data, gl_InstanceID * 2);
+    vec4 tint = texelFetch(instance_data, gl_InstanceID * 2 + 1);
+
+    float s = sin(radians(tint.w));
+    float c = cos(radians(tint.w));
+    mat2 rot = mat2(c, s, -s, c);
+
+    vec4 vertex = p3d_Vertex;
+    vertex.xy = rot * vertex.xy;
+    vertex.xyz = vertex.xyz * placement.w + placement.xyz;
+
+    gl_Position = p3d_ModelViewProjectionMatrix * vertex;
+    v_position = vec3(p3d_ModelViewMatrix * vertex);
+    v_normal = p3d_NormalMatrix * vec3(rot * p3d_Normal.xy, p3d_Normal.z);
+    v_color = vec4(p3d_Color.rgb * tint.rgb, p3d_Color.a);
+    v_texcoord = p3d_MultiTexCoord0;
+}
+"""
+
+INSTANCE_FRAG = """
+#version 150
+
+uniform sampler2D p3d_Texture0;
+uniform struct {
+    vec4 ambient;
+} p3d_LightModel;
+uniform struct {
+    vec4 color;
+    vec4 position;
+} p3d_LightSource[4];
+
+in vec3 v_position;
+in vec3 v_normal;
+in vec4 v_color;
+in vec2 v_texcoord;
+
+out vec4 p3d_FragColor;
+
+void main() {
+    vec3 normal = normalize(v_normal);
+    vec3 light = p3d_LightModel.ambient.rgb;
+    for (int i = 0; i < 4; ++i) {
+        vec4 pos = p3d_LightSource[i].position;
+        vec3 to_light = pos.xyz - v_position * pos.w;
+        if (dot(to_light, to_light) > 0.0) {
+            light += p3d_LightSource[i].color.rgb * max(dot(normal, normalize(to_light)), 0.0);
+        }
+    }
+    vec4 color = v_color * texture(p3d_Texture0, v_texcoord);
+    p3d_FragColor = vec4(color.rgb * light, color.a);
+}
+"""
+
+_shader = None
+
+
+def get_instance_shader():
+    global _shader
+    if _shader is None:
+        _shader = Shader.make(Shader.SL_GLSL, INSTANCE_VERT, INSTANCE_FRAG)
+    return _shader
+
+
+class InstancedMesh:
+    # Draws any number of copies of one model with a single draw call per
+    # Geom. Instances live in a packed float32 array that is uploaded to a
+    # buffer texture at most once per frame, whenever it has changed.
+
+    def __init__(self, model, parent, name="instances", capacity=64):
+        self.root = parent.attachNewNode(name)
+        self.root.setShader(get_instance_shader())
+        self.root.node().setFinal(True)
+
+        self.model_bounds = None
+        self.data = np.zeros((capacity, INSTANCE_FLOATS), dtype=np.float32)
+        self.count = 0
+        self.next_handle = 0
+        self.slot_of = {}
+        self.handle_at = []
+
+        self.buffer = Texture(name)
+        self.buffer.setupBufferTexture(capacity * TEXELS_PER_INSTANCE, Texture.T_float,
+                                       Texture.F_rgba32, GeomEnums.UH_dynamic)
+        self.root.setShaderInput("instance_data", self.buffer)
+        self.root.hide()
+
+        self.dirty = False
+        self.flush_task = None
+        if model is not None:
+            self.set_model(model)
+
+    def set_model(self, model):
+        # Swap the instanced geometry (e.g. once it has finished loading);
+        # the instances themselves are kept
+        self.root.getChildren().detach()
+        model.copyTo(self.root)
+        self.root.flattenStrong()
+        self.model_bounds = self.root.getTightBounds()
+        self.update_bounds()
+
+    def __len__(self):
+        return self.count
+
+    def add(self, pos, scale=1.0, color=(1, 1, 1), heading=0.0):
+        if self.count == len(self.data):
+            self.grow(len(self.data) * 2)
+        slot = self.count
+        self.data[slot] = (pos[0], pos[1], pos[2], scale, color[0], color[1], color[2], heading)
+        handle = self.next_handle
+        self.next_handle += 1
+        self.slot_of[handle] = slot
+        self.handle_at.append(handle)
+        self.count += 1
+        self.mark_dirty()
+        return handle
+
+    def add_many(self, records):
+        # records is an (N, INSTANCE_FLOATS) array; returns the new handles
+        records = np.asarray(records, dtype=np.float32).reshape(-1, INSTANCE_FLOATS)
+        needed = self.count + len(records)
+        if needed > len(self.data):
+            self.grow(max(needed, len(self.data) * 2))
+        self.data[self.count:needed] = records
+        handles = list(range(self.next_handle, self.next_handle + len(records)))
+        self.slot_of.update(zip(handles, range(self.count, needed)))
+        self.handle_at.extend(handles)
+        self.next_handle += len(records)
+        self.count = needed
+        self.mark_dirty()
+        return handles
+
+    def remove(self, handle):
+        # Swap the last instance into the freed slot so the array stays packed
+        slot = self.slot_of.pop(handle)
+        last = self.count - 1
+        if slot != last:
+            moved = self.handle_at[last]
+            self.data[slot] = self.data[last]
+            self.handle_at[slot] = moved
+            self.slot_of[moved] = slot
+        self.handle_at.pop()
+        self.count = last
+        self.mark_dirty()
+
+    def update(self, handle, pos=None, scale=None, color=None, heading=None):
+        row = self.data[self.slot_of[handle]]
+        if pos is not None:
+            row[0:3] = pos
+        if scale is not None:
+            row[3] = scale
+        if color is not None:
+            row[4:7] = color[:3]
+        if heading is not None:
+            row[7] = heading
+        self.mark_dirty()
+
+    def set_all(self, records):
+        # Replace every instance at once, e.g. from a vectorized simulation
+        records = np.asarray(records, dtype=np.float32).reshape(-1, INSTANCE_FLOATS)
+        if len(records) > len(self.data):
+            self.grow(len(records))
+        self.data[:len(records)] = records
+        if len(records) != self.count:
+            self.count = len(records)
+            self.handle_at = list(range(self.count))
+            self.slot_of = dict(zip(self.handle_at, self.handle_at))
+            self.next_handle = self.count
+        self.mark_dirty()
+
+    def clear(self):
+        self.set_all(np.zeros((0, INSTANCE_FLOATS), dtype=np.float32))
+
+    def grow(self, capacity):
+        data = np.zeros((capacity, INSTANCE_FLOATS), dtype=np.float32)
+        data[:self.count] = self.data[:self.count]
+        self.data = data
+        self.buffer.setupBufferTexture(capacity * TEXELS_PER_INSTANCE, Texture.T_float,
+                                       Texture.F_rgba32, GeomEnums.UH_dynamic)
+
+    def mark_dirty(self):
+        self.dirty = True
+        if self.flush_task is None:
+            self.flush_task = taskMgr.add(self.flush_dirty, "flush-" + self.root.getName(), sort=45)
+
+    def flush_dirty(self, task):
+        self.flush()
+        self.flush_task = None
+        return Task.done
+
+    def flush(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+        memoryview(self.buffer.modifyRamImage())[:] = memoryview(self.data).cast("B")
+        # An instance count of 0 means "not instanced" to Panda, which would
+        # draw the bare model once, so hide the node instead.
+        if self.count == 0:
+            self.root.hide()
+        else:
+            self.root.show()
+            self.root.setInstanceCount(self.count)
+        self.update_bounds()
+
+    def update_bounds(self):
+        # The instances are placed by the shader, so Panda can't compute the
+        # bounds itself; cover every instance or the node gets culled.
+        if self.count == 0 or self.model_bounds is None:
+            self.root.node().setBounds(BoundingBox())
+            return
+        live = self.data[:self.count]
+        lo, hi = self.model_bounds
+        reach = max(abs(v) for v in (*lo, *hi)) * float(live[:, 3].max())
+        mins = live[:, 0:3].min(axis=0) - reach
+        maxs = live[:, 0:3].max(axis=0) + reach
+        self.root.node().setBounds(BoundingBox(Point3(*mins), Point3(*maxs)))
+
+    def destroy(self):
+        if self.flush_task is not None:
+            taskMgr.remove(self.flush_task)
+            self.flush_task = None
+        self.root.removeNode()
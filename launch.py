@@ -0,0 +1,201 @@
+# Single entry point for the scenes in scenes.py. Run from the repository
+# root:
+#   python launch.py racer
+#   python launch.py racer --profile-startup --window-type offscreen
+#   python launch.py --list
+# Only the launched scene's modules are imported, and textures go through
+# Panda3D's on-disk model cache, so repeated launches start warm.
+# --profile-startup splits startup into imports, window/GSG creation, asset
+# loading, scene building and the first frame, then exits.
+import time
+LAUNCH_START = time.perf_counter()
+
+from collections import defaultdict
+import argparse
+import builtins
+import functools
+import importlib
+import json
+import os
+import sys
+
+# Module functions that load assets, wrapped when their module is first
+# imported; Panda3D's Loader methods are wrapped up front
+ASSET_FUNCTIONS = [
+    ("asset_cache", "load_model"),
+    ("texture_cache", "load_texture"),
+    ("ursina.mesh_importer", "load_model"),
+]
+LOADER_METHODS = ("loadModel", "loadTexture", "loadShader")
+# Import roots listed in the profile
+TOP_IMPORTS = 6
+
+
+class StartupProfile:
+    # Splits wall time since the launcher started into phases. Time goes
+    # to the innermost phase running, so a texture loaded while a scene
+    # script is imported counts as asset loading and the import only gets
+    # the rest.
+
+    def __init__(self, start):
+        self.mark = start
+        self.stack = ["launcher"]
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+        # Import time per top-level package, outermost imports only
+        self.imports = defaultdict(float)
+        self.import_depth = 0
+        self.patched = []
+        self.pending = list(ASSET_FUNCTIONS)
+
+    def enter(self, phase):
+        now = time.perf_counter()
+        self.totals[self.stack[-1]] += now - self.mark
+        self.mark = now
+        self.stack.append(phase)
+        self.counts[phase] += 1
+
+    def leave(self):
+        now = time.perf_counter()
+        self.totals[self.stack.pop()] += now - self.mark
+        self.mark = now
+
+    def timed(self, function, phase):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            self.enter(phase)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.leave()
+        return wrapper
+
+    def patch(self, owner, name, phase):
+        original = getattr(owner, name)
+        setattr(owner, name, self.timed(original, phase))
+        self.patched.append((owner, name, original))
+
+    def install(self):
+        self.patch(builtins, "__import__", "imports")
+        self.patch(importlib, "import_module", "imports")
+        timed_import = builtins.__import__
+
+        def import_hook(name, globals=None, locals=None, fromlist=(), level=0):
+            # Charge outermost imports to their package, then wrap any asset
+            # functions that have just become importable
+            outermost = self.import_depth == 0
+            before = self.totals["imports"]
+            self.import_depth += 1
+            try:
+                return timed_import(name, globals, locals, fromlist, level)
+            finally:
+                self.import_depth -= 1
+                if outermost:
+                    if level:
+                        name = (globals or {}).get("__package__") or name
+                    self.imports[name.partition(".")[0]] += self.totals["imports"] - before
+                if self.pending:
+                    self.patch_asset_functions()
+
+        builtins.__import__ = import_hook
+
+        from direct.showbase.Loader import Loader
+        from direct.showbase.ShowBase import ShowBase
+        for name in LOADER_METHODS:
+            self.patch(Loader, name, "assets")
+        # The pipe and the main window, whose GSG is made as it opens
+        self.patch(ShowBase, "makeDefaultPipe", "window/GSG")
+        self.patch(ShowBase, "openMainWindow", "window/GSG")
+
+    def patch_asset_functions(self):
+        for module_name, name in list(self.pending):
+            module = sys.modules.get(module_name)
+            if module is not None and hasattr(module, name):
+                self.patch(module, name, "assets")
+                self.pending.remove((module_name, name))
+
+    def uninstall(self):
+        # In reverse, so builtins.__import__ ends up as the original rather
+        # than import_hook's timed one
+        for owner, name, original in reversed(self.patched):
+            setattr(owner, name, original)
+        self.patched.clear()
+        self.pending.clear()
+
+    def results(self):
+        self.totals[self.stack[-1]] += time.perf_counter() - self.mark
+        self.mark = time.perf_counter()
+        return {
+            "total": sum(self.totals.values()),
+            "phases": dict(self.totals),
+            "counts": {"assets": self.counts["assets"]},
+            "imports": dict(sorted(self.imports.items(), key=lambda item: -item[1])),
+        }
+
+    def report(self, name):
+        results = self.results()
+        print("%s startup: %.0f ms" % (name, results["total"] * 1000))
+        for phase in ("imports", "window/GSG", "assets", "scene build", "first frame", "launcher"):
+            line = "  %-12s %7.0f ms" % (phase, results["phases"].get(phase, 0.0) * 1000)
+            if phase == "imports":
+                top = list(results["imports"].items())[:TOP_IMPORTS]
+                line += "  " + ", ".join("%s %.0f" % (module, seconds * 1000) for module, seconds in top)
+            elif phase == "assets":
+                line += "  %d loads" % results["counts"]["assets"]
+            print(line)
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Launch a scene.")
+    parser.add_argument("scene", nargs="?", help="scene to launch")
+    parser.add_argument("--list", action="store_true", help="list the scenes and exit")
+    parser.add_argument("--window-type", default="onscreen", help="onscreen, offscreen or none")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="print where startup time goes and exit after the first frame")
+    parser.add_argument("--profile-output", help="also write the startup profile here as JSON")
+    args = parser.parse_args()
+
+    profile = None
+    if args.profile_startup:
+        profile = StartupProfile(LAUNCH_START)
+        profile.install()
+
+    from panda3d.core import loadPrcFileData
+    from asset_cache import CACHE_DIR
+    from scenes import SCENES
+    if args.list or args.scene is None:
+        print("\n".join(SCENES))
+        return
+    if args.scene not in SCENES:
+        parser.error("unknown scene %r; one of %s" % (args.scene, ", ".join(SCENES)))
+    scene = SCENES[args.scene]
+
+    startup_dir = os.environ.get("STARTUP_CACHE_DIR", os.path.join(CACHE_DIR, "startup"))
+    # Decoded textures are cached on disk next to the converted models, so
+    # no launch after the first decodes a JPEG or PNG again
+    loadPrcFileData("launch", "model-cache-dir %s\nmodel-cache-textures #t" % os.path.join(startup_dir, "panda3d"))
+    if profile is not None:
+        # The first frame waits for the GPU, so it includes the draw
+        loadPrcFileData("launch", "gl-finish #t")
+        profile.enter("scene build")
+    base, module = scene.load(args.window_type)
+    if profile is not None:
+        profile.leave()
+        profile.enter("first frame")
+    base.taskMgr.step()
+    if profile is not None:
+        profile.leave()
+        profile.uninstall()
+        results = profile.report(args.scene)
+        if args.profile_output:
+            with open(args.profile_output, "w") as f:
+                json.dump(results, f, indent=2)
+        base.destroy()
+        return
+
+    base.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+from panda3d.core import BoundingSphere
+from direct.task.TaskManagerGlobal import taskMgr
+from broadphase import SpatialHash
+from itertools import count
+import numpy as np
+
+# Object-light pairs ranked per numpy block while refreshing assignments
+RANK_BLOCK = 1 << 16
+# Moved lights per frame above which dirty objects are found in one batch
+TOUCH_QUERIES = 16
+
+
+class LightManager:
+    # Gives every registered object only its few most relevant point lights
+    # instead of setting every light on render, where each one would shade
+    # everything. Lights and objects each live in a spatial hash over the
+    # ground plane (x, y): a light reaches the objects overlapping its
+    # radius, and an object's lights are the ones nearest relative to their
+    # radius, at most max_lights of them.
+    #
+    # Assignments are refreshed incrementally once per frame: a light that
+    # moved, was added or removed only re-ranks the objects within its old
+    # and new reach, and an object that moved only re-ranks itself. Global
+    # lights (ambient, directional) still belong on render.
+
+    def __init__(self, render, max_lights=4, cell_size=20.0, name="lights"):
+        self.render = render
+        self.max_lights = max_lights
+        self.light_index = SpatialHash(cell_size)
+        self.object_index = SpatialHash(cell_size)
+        self.ids = count()
+        # light id -> [light NodePath, radius, position, ids of the objects
+        # it is set on]
+        self.lights = {}
+        # object id -> [object NodePath, net transform, (center, radius), light ids]
+        self.objects = {}
+        self.dirty = set()
+        self.reassigned = 0
+        # After game logic has moved things, before the frame is culled and
+        # drawn (igLoop, 50)
+        self.task = taskMgr.add(self.update, "light-manager-" + name, sort=45)
+
+    def __len__(self):
+        return len(self.lights)
+
+    def set_max_lights(self, max_lights):
+        # Every object is re-ranked on the next update
+        self.max_lights = max_lights
+        self.dirty.update(self.objects)
+
+    def add_light(self, light, radius):
+        # light is the NodePath of a point light (or a spotlight), radius
+        # how far it reaches; anything further away never gets it
+        light_id = next(self.ids)
+        position = light.getPos(self.render)
+        self.lights[light_id] = [light, radius, position, set()]
+        self.light_index.add(light_id, self.reach(position, radius))
+        self.touch(self.reach(position, radius))
+        return light_id
+
+    def remove_light(self, light_id):
+        # Cleared from every object it is set on, which can be outside its
+        # reach if the radius shrank since the last update
+        light, _, _, lit = self.lights.pop(light_id)
+        self.light_index.remove(light_id)
+        for object_id in lit:
+            record = self.objects[object_id]
+            record[0].clearLight(light)
+            record[3].remove(light_id)
+            self.dirty.add(object_id)
+
+    def set_radius(self, light_id, radius):
+        record = self.lights[light_id]
+        self.touch(self.reach(record[2], max(radius, record[1])))
+        record[1] = radius
+        self.light_index.move(light_id, self.reach(record[2], radius))
+
+    def add_object(self, node):
+        # node gets its lights set on itself, so everything below it shares
+        # them; register whole models rather than each of their parts
+        object_id = next(self.ids)
+        sphere = self.sphere(node)
+        self.objects[object_id] = [node, node.getNetTransform(), sphere, []]
+        self.object_index.add(object_id, self.reach(*sphere))
+        self.dirty.add(object_id)
+        return object_id
+
+    def remove_object(self, object_id):
+        node, _, _, assigned = self.objects.pop(object_id)
+        self.object_index.remove(object_id)
+        self.dirty.discard(object_id)
+        for light_id in assigned:
+            node.clearLight(self.lights[light_id][0])
+            self.lights[light_id][3].discard(object_id)
+
+    def lights_of(self, object_id):
+        return [self.lights[light_id][0] for light_id in self.objects[object_id][3]]
+
+    @staticmethod
+    def reach(center, radius):
+        return (center[0] - radius, center[1] - radius, center[0] + radius, center[1] + radius)
+
+    def sphere(self, node):
+        # World-space bounding sphere of node and everything below it
+        bounds = node.getBounds()
+        if bounds.isEmpty() or bounds.isInfinite():
+            return node.getPos(self.render), 0.0
+        sphere = BoundingSphere()
+        sphere.extendBy(bounds)
+        if not node.getParent().isEmpty():
+            sphere.xform(node.getParent().getMat(self.render))
+        return sphere.getCenter(), sphere.getRadius()
+
+    def touch(self, area):
+        self.dirty.update(self.object_index.query(area))
+
+    def touch_many(self, areas):
+        # With many lights moving, one overlap test of every area against
+        # every object beats a hash query per light
+        ids = list(self.object_index.bounds)
+        if not ids:
+            return
+        objects = np.array(list(self.object_index.bounds.values()))
+        areas = np.array(areas)
+        hit = ((objects[:, None, 0] <= areas[None, :, 2]) & (objects[:, None, 2] >= areas[None, :, 0])
+               & (objects[:, None, 1] <= areas[None, :, 3]) & (objects[:, None, 3] >= areas[None, :, 1])).any(axis=1)
+        self.dirty.update(ids[i] for i in np.flatnonzero(hit).tolist())
+
+    def update(self, task):
+        swept = []
+        for light_id, record in self.lights.items():
+            light, radius, old, _ = record
+            position = light.getPos(self.render)
+            if position == old:
+                continue
+            record[2] = position
+            self.light_index.move(light_id, self.reach(position, radius))
+            swept.append((min(old[0], position[0]) - radius, min(old[1], position[1]) - radius,
+                          max(old[0], position[0]) + radius, max(old[1], position[1]) + radius))
+        if len(swept) > TOUCH_QUERIES:
+            self.touch_many(swept)
+        else:
+            for area in swept:
+                self.touch(area)
+
+        for object_id, record in self.objects.items():
+            transform = record[0].getNetTransform()
+            if transform != record[1]:
+                record[1] = transform
+                record[2] = self.sphere(record[0])
+                self.object_index.move(object_id, self.reach(*record[2]))
+                self.dirty.add(object_id)
+
+        if self.dirty:
+            self.assign(list(self.dirty))
+            self.dirty.clear()
+        return task.cont
+
+    def assign(self, object_ids):
+        # Ranks the lights in reach of each object by how far into their
+        # radius it is and keeps the best max_lights; only the changes are
+        # applied. All the objects are ranked at once against the lights
+        # reaching their common area, in blocks to bound the matrix size.
+        records = [self.objects[object_id] for object_id in object_ids]
+        spheres = np.array([(*record[2][0], record[2][1]) for record in records], dtype=np.float32)
+        size = spheres[:, 3].max()
+        area = (spheres[:, 0].min() - size, spheres[:, 1].min() - size,
+                spheres[:, 0].max() + size, spheres[:, 1].max() + size)
+        light_ids = self.light_index.query(area)
+        # Columns x, y, z, 1 / radius
+        lights = np.array([(*self.lights[light_id][2], 1.0 / self.lights[light_id][1]) for light_id in light_ids],
+                          dtype=np.float32).reshape(-1, 4).T.copy()
+        block = max(1, RANK_BLOCK // max(len(light_ids), 1))
+        for first in range(0, len(records), block):
+            rows = spheres[first:first + block]
+            # How far into each light's radius each object reaches: below 0
+            # overlaps the light, 1 and up is out of reach
+            closeness = np.zeros((len(rows), len(light_ids)), dtype=np.float32)
+            for axis in range(3):
+                delta = rows[:, axis:axis + 1] - lights[axis]
+                delta *= delta
+                closeness += delta
+            np.sqrt(closeness, out=closeness)
+            closeness -= rows[:, 3:]
+            closeness *= lights[3]
+            closeness[closeness >= 1.0] = np.inf
+            keep = min(self.max_lights, len(light_ids))
+            if keep < len(light_ids):
+                nearest = np.argpartition(closeness, keep, axis=1)[:, :keep]
+            else:
+                nearest = np.broadcast_to(np.arange(keep), (len(rows), keep))
+            scores = np.take_along_axis(closeness, nearest, axis=1)
+            order = np.argsort(scores, axis=1)
+            nearest = np.take_along_axis(nearest, order, axis=1)
+            reached = np.isfinite(np.take_along_axis(scores, order, axis=1))
+            for object_id, record, picks, valid in zip(object_ids[first:first + block], records[first:first + block],
+                                                       nearest.tolist(), reached.tolist()):
+                self.apply(object_id, record, [light_ids[j] for j, ok in zip(picks, valid) if ok])
+
+    def apply(self, object_id, record, chosen):
+        node, assigned = record[0], record[3]
+        if chosen == assigned:
+            return
+        for light_id in assigned:
+            # A light removed since is already cleared from the node
+            if light_id not in chosen and light_id in self.lights:
+                node.clearLight(self.lights[light_id][0])
+                self.lights[light_id][3].discard(object_id)
+        for light_id in chosen:
+            if light_id not in assigned:
+                node.setLight(self.lights[light_id][0])
+                self.lights[light_id][3].add(object_id)
+        record[3] = chosen
+        self.reassigned += 1
+
+    def destroy(self):
+        taskMgr.remove(self.task)
+        for object_id in list(self.objects):
+            self.remove_object(object_id)
@@ -0,0 +1,436 @@
+from panda3d.core import GeomNode, GeomVertexReader, LODNode, NodePath
+from direct.task.TaskManagerGlobal import taskMgr
+from direct.task import Task
+from geometry import build_geom
+from instancing import INSTANCE_FLOATS, InstancedMesh
+import heapq
+import numpy as np
+
+
+# Fraction of the full triangle count kept by each level
+LOD_RATIOS = (1.0, 0.5, 0.25, 0.1)
+# Camera distance at which each level takes over
+LOD_DISTANCES = (0.0, 25.0, 50.0, 100.0)
+# Switch thresholds are widened by this fraction in the direction of travel,
+# so an object sitting on a threshold doesn't flicker between two levels
+HYSTERESIS = 0.1
+
+
+def mesh_arrays(model):
+    # Triangles of every Geom under model, in model space, as
+    # (positions, indices, colors, uvs, state); colors/uvs are None when no
+    # Geom has them. state is the render state of the first Geom.
+    root = NodePath("flatten")
+    model.copyTo(root)
+    root.flattenStrong()
+    positions, colors, uvs, indices = [], [], [], []
+    has_colors = has_uvs = False
+    state = None
+    base = 0
+    for node_path in root.findAllMatches("**/+GeomNode"):
+        node = node_path.node()
+        for i in range(node.getNumGeoms()):
+            geom = node.getGeom(i).decompose()
+            if state is None:
+                state = node.getGeomState(i)
+            vdata = geom.getVertexData()
+            rows = vdata.getNumRows()
+            reader = GeomVertexReader(vdata, "vertex")
+            positions.extend(tuple(reader.getData3()) for _ in range(rows))
+            if vdata.hasColumn("color"):
+                has_colors = True
+                reader = GeomVertexReader(vdata, "color")
+                colors.extend(tuple(reader.getData4()) for _ in range(rows))
+            else:
+                colors.extend([(1, 1, 1, 1)] * rows)
+            if vdata.hasColumn("texcoord"):
+                has_uvs = True
+                reader = GeomVertexReader(vdata, "texcoord")
+                uvs.extend(tuple(reader.getData2()) for _ in range(rows))
+            else:
+                uvs.extend([(0, 0)] * rows)
+            for prim in geom.getPrimitives():
+                for j in range(prim.getNumVertices()):
+                    indices.append(base + prim.getVertex(j))
+            base += rows
+    return (np.array(positions, dtype=np.float32).reshape(-1, 3),
+            np.array(indices, dtype=np.int64).reshape(-1, 3),
+            np.array(colors, dtype=np.float32) if has_colors else None,
+            np.array(uvs, dtype=np.float32) if has_uvs else None,
+            state)
+
+
+def weld(positions, indices, attributes):
+    # Merge vertices that share a position, so the surface is connected for
+    # edge collapses; the other attributes come from the first copy
+    keys = np.round(positions.astype(np.float64) * 1e5).astype(np.int64)
+    _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    attributes = [a[first] if a is not None else None for a in attributes]
+    return positions[first], inverse[indices], attributes
+
+
+def face_planes(pos, faces):
+    normal = np.cross(pos[faces[:, 1]] - pos[faces[:, 0]], pos[faces[:, 2]] - pos[faces[:, 0]])
+    area = np.linalg.norm(normal, axis=1)
+    normal = normal / np.maximum(area, 1e-12)[:, None]
+    d = -np.einsum("ij,ij->i", normal, pos[faces[:, 0]])
+    return np.hstack([normal, d[:, None]]), area
+
+
+def simplify(positions, indices, target, attributes=()):
+    # Quadric error metric edge collapse (Garland & Heckbert). Returns
+    # (positions, indices, attributes) with at most target triangles where
+    # the mesh allows it; attributes are per-vertex arrays carried along.
+    pos, faces, attributes = weld(positions, indices, list(attributes))
+    pos = pos.astype(np.float64)
+    faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+    faces = [list(f) for f in faces]
+    count = len(faces)
+
+    planes, area = face_planes(pos, np.array(faces).reshape(-1, 3))
+    quadrics = np.zeros((len(pos), 4, 4))
+    kp = planes[:, :, None] * planes[:, None, :] * area[:, None, None]
+    for k in range(3):
+        np.add.at(quadrics, [f[k] for f in faces], kp)
+
+    # Open edges get a steep plane through them so borders hold their shape
+    edge_faces = {}
+    for fi, f in enumerate(faces):
+        for k in range(3):
+            edge = tuple(sorted((f[k], f[(k + 1) % 3])))
+            edge_faces.setdefault(edge, []).append(fi)
+    for (a, b), owners in edge_faces.items():
+        if len(owners) == 1:
+            normal = np.cross(pos[b] - pos[a], planes[owners[0], :3])
+            length = np.linalg.norm(normal)
+            if length > 1e-12:
+                normal /= length
+                plane = np.append(normal, -normal.dot(pos[a]))
+                q = np.outer(plane, plane) * max(area[owners[0]], 1e-6) * 100
+                quadrics[a] += q
+                quadrics[b] += q
+
+    vertex_faces = [set() for _ in pos]
+    for fi, f in enumerate(faces):
+        for v in f:
+            vertex_faces[v].add(fi)
+    alive = [True] * len(faces)
+    version = [0] * len(pos)
+
+    def cost(a, b):
+        q = quadrics[a] + quadrics[b]
+        candidates = [pos[a], pos[b], (pos[a] + pos[b]) / 2]
+        if abs(np.linalg.det(q[:3, :3])) > 1e-9:
+            candidates.insert(0, np.linalg.solve(q[:3, :3], -q[:3, 3]))
+        best = None
+        for v in candidates:
+            h = np.append(v, 1.0)
+            error = h.dot(q).dot(h)
+            if best is None or error < best[0]:
+                best = (error, v)
+        return best
+
+    heap = []
+
+    def push(a, b):
+        error, v = cost(a, b)
+        heapq.heappush(heap, (error, a, b, version[a], version[b], tuple(v)))
+
+    for a, b in edge_faces:
+        push(a, b)
+
+    def flips(moved, other, target_pos):
+        # Would moving vertex moved to target_pos turn any of its faces over?
+        for fi in vertex_faces[moved]:
+            f = faces[fi]
+            if other in f:
+                continue
+            p = [pos[x] for x in f]
+            before = np.cross(p[1] - p[0], p[2] - p[0])
+            p[f.index(moved)] = target_pos
+            after = np.cross(p[1] - p[0], p[2] - p[0])
+            if before.dot(after) <= 0:
+                return True
+        return False
+
+    while count > target and heap:
+        error, a, b, va, vb, v = heapq.heappop(heap)
+        if version[a] != va or version[b] != vb:
+            continue
+        v = np.array(v)
+        if flips(a, b, v) or flips(b, a, v):
+            continue
+
+        pos[a] = v
+        quadrics[a] += quadrics[b]
+        version[a] += 1
+        version[b] = -1
+        for fi in vertex_faces[b]:
+            f = faces[fi]
+            if a in f:
+                alive[fi] = False
+                count -= 1
+                for x in f:
+                    if x != b:
+                        vertex_faces[x].discard(fi)
+            else:
+                f[f.index(b)] = a
+                vertex_faces[a].add(fi)
+        vertex_faces[b] = set()
+
+        neighbours = {x for fi in vertex_faces[a] for x in faces[fi]} - {a}
+        for n in neighbours:
+            push(a, n)
+
+    kept = np.array([f for f, live in zip(faces, alive) if live], dtype=np.int64).reshape(-1, 3)
+    used, remap = np.unique(kept, return_inverse=True)
+    attributes = [attr[used] if attr is not None else None for attr in attributes]
+    return pos[used].astype(np.float32), remap.reshape(-1, 3), attributes
+
+
+def vertex_normals(positions, indices):
+    normal = np.cross(positions[indices[:, 1]] - positions[indices[:, 0]],
+                      positions[indices[:, 2]] - positions[indices[:, 0]])
+    normals = np.zeros_like(positions)
+    for k in range(3):
+        np.add.at(normals, indices[:, k], normal)
+    length = np.linalg.norm(normals, axis=1, keepdims=True)
+    return normals / np.maximum(length, 1e-12)
+
+
+def build_levels(model, ratios=LOD_RATIOS, min_triangles=64):
+    # Level 0 is the model itself; every further level is a simplified
+    # single-Geom copy. Levels that barely save anything are left out, and
+    # so is simplifying models too small to lose anything but whole parts.
+    positions, indices, colors, uvs, state = mesh_arrays(model)
+    levels = [model.copyTo(NodePath("lod0"))]
+    triangles = [len(indices)]
+    if len(indices) < min_triangles:
+        return levels, triangles
+    for i, ratio in enumerate(ratios[1:], 1):
+        target = max(int(len(indices) * ratio), 1)
+        points, faces, (level_colors, level_uvs) = simplify(positions, indices, target, (colors, uvs))
+        if len(faces) == 0 or len(faces) > 0.9 * triangles[-1]:
+            break
+        node = GeomNode("lod%d" % i)
+        node.addGeom(build_geom(points, faces, vertex_normals(points, faces), level_uvs, level_colors,
+                                name="lod%d" % i), state)
+        levels.append(NodePath(node))
+        triangles.append(len(faces))
+    return levels, triangles
+
+
+def lod_model(levels, distances=LOD_DISTANCES, far=1e6):
+    # Wrap the levels in an LODNode; level i is drawn from distances[i] out
+    # to the next level's distance (or far)
+    lod = LODNode("lod")
+    root = NodePath(lod)
+    for i, level in enumerate(levels):
+        near = distances[i + 1] if i + 1 < len(levels) else far
+        lod.addSwitch(near, distances[i])
+        level.reparentTo(root)
+    return root
+
+
+def count_triangles(model):
+    total = 0
+    found = list(model.findAllMatches("**/+GeomNode"))
+    if model.node().isGeomNode():
+        found.insert(0, model)
+    for node_path in found:
+        node = node_path.node()
+        for i in range(node.getNumGeoms()):
+            total += sum(prim.getNumFaces() for prim in node.getGeom(i).getPrimitives())
+    return total
+
+
+def pick_levels(distance, current, starts, hysteresis=HYSTERESIS):
+    # Vectorized level choice: a coarser level is only taken once the
+    # distance is past its start by the hysteresis margin, and a finer one
+    # only once it is back inside by the same margin
+    starts = np.asarray(starts[1:], dtype=np.float32)
+    coarser = np.searchsorted(starts * (1 + hysteresis), distance, side="right")
+    finer = np.searchsorted(starts * (1 - hysteresis), distance, side="right")
+    return np.clip(current, coarser, finer)
+
+
+class LODManager:
+    # Picks the level of every registered LODNode from the camera distance
+    # once per frame, with hysteresis, and pins it with forceSwitch. Static
+    # nodes have their positions cached.
+
+    def __init__(self, camera, render, hysteresis=HYSTERESIS):
+        self.camera = camera
+        self.render = render
+        self.hysteresis = hysteresis
+        # Scales every switch distance; below 1 coarser levels take over
+        # sooner (see quality.py)
+        self.bias = 1.0
+        self.nodes = []
+        self.dynamic = []
+        self.positions = np.zeros((0, 3), dtype=np.float32)
+        self.levels = np.zeros(0, dtype=np.int64)
+        # Nodes sharing switch distances are picked in one vectorized call
+        self.switch_sets = []
+        self.switch_set = np.zeros(0, dtype=np.int64)
+        self.task = taskMgr.add(self.update, "lod-manager", sort=40)
+
+    def add(self, model, dynamic=False):
+        # Registers every LODNode under model (including model itself)
+        found = list(model.findAllMatches("**/+LODNode"))
+        if isinstance(model.node(), LODNode):
+            found.insert(0, model)
+        for node_path in found:
+            lod = node_path.node()
+            index = len(self.nodes)
+            self.nodes.append(node_path)
+            starts = tuple(lod.getOut(i) for i in range(lod.getNumSwitches()))
+            if starts not in self.switch_sets:
+                self.switch_sets.append(starts)
+            self.switch_set = np.append(self.switch_set, self.switch_sets.index(starts))
+            self.positions = np.vstack([self.positions, np.array(node_path.getPos(self.render), dtype=np.float32)])
+            self.levels = np.append(self.levels, 0)
+            lod.forceSwitch(0)
+            if dynamic:
+                self.dynamic.append(index)
+        return len(found)
+
+    def set_bias(self, bias):
+        self.bias = bias
+
+    def remove(self, model):
+        # Unregisters model and every LODNode under it
+        keep = [i for i, node_path in enumerate(self.nodes)
+                if not node_path.isEmpty() and node_path != model and not model.isAncestorOf(node_path)]
+        remap = {old: new for new, old in enumerate(keep)}
+        self.nodes = [self.nodes[i] for i in keep]
+        self.positions = self.positions[keep]
+        self.levels = self.levels[keep]
+        self.switch_set = self.switch_set[keep]
+        self.dynamic = [remap[i] for i in self.dynamic if i in remap]
+
+    def update(self, task):
+        eye = np.array(self.camera.getPos(self.render), dtype=np.float32)
+        for i in self.dynamic:
+            if not self.nodes[i].isEmpty():
+                self.positions[i] = self.nodes[i].getPos(self.render)
+        if not self.nodes:
+            return Task.cont
+        distance = np.linalg.norm(self.positions - eye, axis=1) / self.bias
+        levels = self.levels.copy()
+        for index, starts in enumerate(self.switch_sets):
+            mask = self.switch_set == index
+            levels[mask] = pick_levels(distance[mask], self.levels[mask], starts, self.hysteresis)
+        for i in np.nonzero(levels != self.levels)[0]:
+            if not self.nodes[i].isEmpty():
+                self.nodes[i].node().forceSwitch(int(levels[i]))
+        self.levels = levels
+        return Task.cont
+
+    def destroy(self):
+        taskMgr.remove(self.task)
+
+
+class LODInstances:
+    # Hardware-instanced objects with LOD: one InstancedMesh per level, and
+    # every instance lives in the mesh of its current level. Instances past
+    # far aren't drawn at all, which keeps the triangle count flat however
+    # many objects are spread over the world.
+
+    def __init__(self, parent, name="instances", camera=None, distances=LOD_DISTANCES, far=150.0,
+                 hysteresis=HYSTERESIS):
+        # Without a camera every instance is drawn at full detail
+        self.parent = parent
+        self.name = name
+        self.camera = camera
+        self.distances = list(distances)
+        self.far = far
+        self.hysteresis = hysteresis
+        # Scales the switch distances, but not far; none goes past far
+        self.bias = 1.0
+        self.meshes = []
+        self.records = np.zeros((0, INSTANCE_FLOATS), dtype=np.float32)
+        self.levels = np.zeros(0, dtype=np.int64)
+        self.handles = []
+        self.next_handle = 0
+        self.dirty = True
+        self.task = taskMgr.add(self.refresh, "lod-" + name, sort=40)
+
+    def set_levels(self, levels):
+        for mesh in self.meshes:
+            mesh.destroy()
+        self.meshes = [InstancedMesh(level, self.parent, "%s-lod%d" % (self.name, i))
+                       for i, level in enumerate(levels)]
+        self.dirty = True
+
+    def __len__(self):
+        return len(self.records)
+
+    def set_bias(self, bias):
+        self.bias = bias
+
+    def set_far(self, far):
+        self.far = far
+
+    def add(self, pos, scale=1.0, color=(1, 1, 1), heading=0.0):
+        return self.add_many([(pos[0], pos[1], pos[2], scale, color[0], color[1], color[2], heading)])[0]
+
+    def add_many(self, records):
+        records = np.asarray(records, dtype=np.float32).reshape(-1, INSTANCE_FLOATS)
+        self.records = np.vstack([self.records, records])
+        self.levels = np.append(self.levels, np.zeros(len(records), dtype=np.int64))
+        handles = list(range(self.next_handle, self.next_handle + len(records)))
+        self.handles.extend(handles)
+        self.next_handle += len(records)
+        self.dirty = True
+        return handles
+
+    def remove(self, handle):
+        index = self.handles.index(handle)
+        self.records = np.delete(self.records, index, axis=0)
+        self.levels = np.delete(self.levels, index)
+        del self.handles[index]
+        self.dirty = True
+
+    def update(self, handle, pos=None, scale=None, color=None, heading=None):
+        row = self.records[self.handles.index(handle)]
+        if pos is not None:
+            row[0:3] = pos
+        if scale is not None:
+            row[3] = scale
+        if color is not None:
+            row[4:7] = color[:3]
+        if heading is not None:
+            row[7] = heading
+        self.dirty = True
+
+    def refresh(self, task):
+        if not self.meshes:
+            return Task.cont
+        if self.camera is None:
+            levels = np.zeros(len(self.records), dtype=np.int64)
+        else:
+            eye = np.array(self.camera.getPos(self.parent), dtype=np.float32)
+            # Clamped to far, which pick_levels needs to stay the largest
+            starts = [min(d * self.bias, self.far) for d in self.distances[:len(self.meshes)]] + [self.far]
+            distance = np.linalg.norm(self.records[:, 0:3] - eye, axis=1)
+            # The level past the last mesh means "not drawn"
+            levels = pick_levels(distance, self.levels, starts, self.hysteresis)
+        if not self.dirty and np.array_equal(levels, self.levels):
+            return Task.cont
+        self.levels = levels
+        self.dirty = False
+        for i, mesh in enumerate(self.meshes):
+            mesh.set_all(self.records[levels == i])
+        return Task.cont
+
+    def triangles(self):
+        # Triangles drawn per frame across all levels
+        return sum(len(mesh) * count_triangles(mesh.root) for mesh in self.meshes)
+
+    def destroy(self):
+        taskMgr.remove(self.task)
+        for mesh in self.meshes:
+            mesh.destroy()
+        self.meshes = []
@@ -0,0 +1,366 @@
+from panda3d.core import (
+    Geom, GeomTriangles, GeomVertexArrayFormat, GeomVertexData, GeomVertexFormat, GeomVertexReader,
+    InternalName, ModelNode, NodePath, RenderEffects, RenderState, SceneGraphReducer, TextureAttrib,
+    TextureStage, TransformState
+)
+from bvh import primitive_indices
+from geometry import fill_triangles
+import numpy as np
+
+
+# Post-transform cache the triangle order is optimized for, and the FIFO
+# cache the transform cost is measured with (GPUs have 16-32 entries)
+CACHE_SIZE = 32
+FIFO_SIZE = 16
+
+# Forsyth's vertex scoring ("Linear-Speed Vertex Cache Optimisation")
+CACHE_DECAY_POWER = 1.5
+LAST_TRIANGLE_SCORE = 0.75
+VALENCE_BOOST_SCALE = 2.0
+VALENCE_BOOST_POWER = 0.5
+
+# Attributes closer than this are welded into one vertex
+WELD_PRECISION = 1e-5
+INT16_MAX = 32767
+
+ATTRIBUTES = ("vertex", "normal", "texcoord", "color")
+_WIDTHS = {"vertex": 3, "normal": 3, "texcoord": 2, "color": 4}
+_format_cache = {}
+
+
+def compact_format(has_normals, has_uvs, has_colors, packed_positions=True, packed_uvs=True):
+    # One interleaved array: positions and texcoords as int16 (or float32
+    # when not packed), normals as normalized int8 and colors as uint8.
+    # Int16 values are dequantized by the transforms optimize_model() puts
+    # above the Geoms; GL normalizes the normals and colors by itself.
+    key = (has_normals, has_uvs, has_colors, packed_positions, packed_uvs)
+    if key not in _format_cache:
+        array = GeomVertexArrayFormat()
+        array.addColumn(InternalName.getVertex(), 3, Geom.NT_int16 if packed_positions else Geom.NT_float32,
+                        Geom.C_point)
+        if has_normals:
+            array.addColumn(InternalName.getNormal(), 3, Geom.NT_int8, Geom.C_normal)
+        if has_uvs:
+            array.addColumn(InternalName.getTexcoord(), 2, Geom.NT_int16 if packed_uvs else Geom.NT_float32,
+                            Geom.C_texcoord)
+        if has_colors:
+            array.addColumn(InternalName.getColor(), 4, Geom.NT_uint8, Geom.C_color)
+        _format_cache[key] = GeomVertexFormat.registerFormat(GeomVertexFormat(array))
+    return _format_cache[key]
+
+
+def read_column(vdata, name, width):
+    # (rows, width) float32 values of a column, straight from the array
+    # when they are plain float32 and through a reader otherwise (which
+    # also unpacks colors)
+    fmt = vdata.getFormat()
+    column = fmt.getColumn(InternalName.make(name))
+    rows = vdata.getNumRows()
+    if column.getNumericType() == Geom.NT_float32 and column.getNumComponents() == width:
+        index = fmt.getArrayWith(InternalName.make(name))
+        stride = fmt.getArray(index).getStride()
+        data = np.frombuffer(vdata.getArray(index).getHandle().getData(), dtype=np.uint8)
+        return np.ndarray((rows, width), dtype=np.float32, buffer=data,
+                          offset=column.getStart(), strides=(stride, 4)).copy()
+    reader = GeomVertexReader(vdata, name)
+    get = getattr(reader, "getData%d" % width)
+    return np.array([tuple(get()) for _ in range(rows)], dtype=np.float32).reshape(-1, width)
+
+
+def geom_arrays(geom):
+    # ({attribute: (rows, width) float32}, (triangles, 3) indices) of a
+    # static triangle Geom; None for anything else: lines, points, skinned
+    # or morphing vertices, extra columns like tangents
+    geom = geom.decompose()
+    vdata = geom.getVertexData()
+    fmt = vdata.getFormat()
+    if fmt.getAnimation().getAnimationType() != Geom.AT_none:
+        return None
+    names = [fmt.getColumn(i).getName().getName() for i in range(fmt.getNumColumns())]
+    if "vertex" not in names or any(name not in ATTRIBUTES for name in names):
+        return None
+    indices = []
+    for prim in geom.getPrimitives():
+        if prim.getPrimitiveType() != Geom.PT_polygons:
+            return None
+        if prim.getNumVertices():
+            indices.append(primitive_indices(prim))
+    if not indices:
+        return None
+    columns = {name: read_column(vdata, name, _WIDTHS[name]) for name in ATTRIBUTES if name in names}
+    return columns, np.concatenate(indices).reshape(-1, 3)
+
+
+def weld_vertices(columns, indices, precision=WELD_PRECISION):
+    # Merge vertices whose every attribute matches, and drop the ones no
+    # triangle uses. Returns (columns, indices).
+    keys = np.hstack([np.round(columns[name].astype(np.float64) / precision) for name in columns])
+    _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    remap = np.full(len(first), -1, dtype=np.int64)
+    kept = np.unique(inverse[indices.reshape(-1)])
+    remap[kept] = np.arange(len(kept))
+    columns = {name: values[first[kept]] for name, values in columns.items()}
+    return columns, remap[inverse[indices]]
+
+
+def _score_tables(cache_size, max_valence=64):
+    position = np.zeros(cache_size + 3)
+    position[:3] = LAST_TRIANGLE_SCORE
+    position[3:cache_size] = (1 - np.arange(cache_size - 3) / (cache_size - 3)) ** CACHE_DECAY_POWER
+    valence = np.zeros(max_valence)
+    valence[1:] = VALENCE_BOOST_SCALE * np.arange(1, max_valence) ** -VALENCE_BOOST_POWER
+    return position.tolist(), valence.tolist()
+
+
+def optimize_vertex_cache(indices, vertex_count, cache_size=CACHE_SIZE):
+    # Reorders triangles so consecutive ones reuse recently transformed
+    # vertices (Forsyth). Every vertex is scored by its place in a
+    # simulated LRU cache and by how few triangles it has left, which
+    # finishes off vertices instead of leaving them behind; the next
+    # triangle is the best scored one touching the cache. Returns the
+    # reordered (triangles, 3) indices.
+    indices = np.asarray(indices, dtype=np.int64).reshape(-1, 3)
+    count = len(indices)
+    if count < 2:
+        return indices
+    flat = indices.reshape(-1)
+    valence = np.bincount(flat, minlength=vertex_count)
+    starts = np.concatenate([[0], np.cumsum(valence)]).tolist()
+    owners = (np.argsort(flat, kind="stable") // 3).tolist()
+    triangles = indices.tolist()
+    position_score, valence_score = _score_tables(cache_size)
+    boost_limit = len(valence_score)
+
+    remaining = valence.tolist()
+    slot = [-1] * vertex_count
+
+    def vertex_score(v):
+        left = remaining[v]
+        if not left:
+            return -1.0
+        boost = valence_score[left] if left < boost_limit else VALENCE_BOOST_SCALE * left ** -VALENCE_BOOST_POWER
+        return (position_score[slot[v]] if slot[v] >= 0 else 0.0) + boost
+
+    score = [vertex_score(v) for v in range(vertex_count)]
+    triangle_score = [score[a] + score[b] + score[c] for a, b, c in triangles]
+    emitted = [False] * count
+    order = []
+    cache = []
+    best = max(range(count), key=triangle_score.__getitem__)
+    cursor = 0
+    while len(order) < count:
+        if best < 0:
+            # Dead end: nothing in the cache has triangles left, so carry
+            # on with the next one in input order
+            while emitted[cursor]:
+                cursor += 1
+            best = cursor
+        emitted[best] = True
+        order.append(best)
+        corners = triangles[best]
+        for v in corners:
+            remaining[v] -= 1
+        cache = corners + [v for v in cache if v not in corners]
+        evicted = cache[cache_size:]
+        del cache[cache_size:]
+        for v in evicted:
+            slot[v] = -1
+        touched = set()
+        for i, v in enumerate(cache):
+            slot[v] = i
+            touched.add(v)
+        touched.update(evicted)
+        for v in touched:
+            score[v] = vertex_score(v)
+
+        best, best_score = -1, -1.0
+        for v in cache:
+            for k in range(starts[v], starts[v + 1]):
+                t = owners[k]
+                if emitted[t]:
+                    continue
+                a, b, c = triangles[t]
+                triangle_score[t] = score[a] + score[b] + score[c]
+                if triangle_score[t] > best_score:
+                    best, best_score = t, triangle_score[t]
+    return indices[order]
+
+
+def optimize_vertex_fetch(indices, vertex_count):
+    # Renumbers vertices in the order triangles first use them, so vertex
+    # fetches walk memory forward. Returns (old vertex of each new one,
+    # renumbered indices).
+    flat = np.asarray(indices, dtype=np.int64).reshape(-1)
+    _, first = np.unique(flat, return_index=True)
+    order = flat[np.sort(first)]
+    remap = np.full(vertex_count, -1, dtype=np.int64)
+    remap[order] = np.arange(len(order))
+    return order, remap[flat].reshape(-1, 3)
+
+
+def cache_misses(indices, cache_size=FIFO_SIZE):
+    # Vertices a FIFO post-transform cache of cache_size entries would have
+    # to transform to draw the triangles: the vertex shader runs per miss
+    cache = [-1] * cache_size
+    head = 0
+    cached = set()
+    misses = 0
+    for v in np.asarray(indices).reshape(-1).tolist():
+        if v in cached:
+            continue
+        misses += 1
+        cached.discard(cache[head])
+        cache[head] = v
+        cached.add(v)
+        head = (head + 1) % cache_size
+    return misses
+
+
+def quantize_values(values, center, step):
+    return np.clip(np.round((values - center) / step), -INT16_MAX, INT16_MAX).astype(np.int16)
+
+
+def quantization(values):
+    # (center, step) mapping values onto the int16 range: one step for all
+    # axes, so the dequantizing scale is uniform and leaves normals alone
+    lo, hi = values.min(axis=0), values.max(axis=0)
+    step = float((hi - lo).max()) / 2 / INT16_MAX
+    return (lo + hi) / 2, step if step > 0 else 1.0
+
+
+def compact_geom(columns, indices, positions=None, uvs=None, name="mesh", usage=Geom.UHStatic):
+    # Builds a Geom in compact_format(); positions and uvs are the (center,
+    # step) to quantize with, None to keep them float32
+    fmt = compact_format("normal" in columns, "texcoord" in columns, "color" in columns,
+                         positions is not None, uvs is not None)
+    array = fmt.getArray(0)
+    rows = len(columns["vertex"])
+    packed = np.zeros((rows, array.getStride()), dtype=np.uint8)
+
+    def put(name, values):
+        start = array.getColumn(InternalName.make(name)).getStart()
+        values = np.ascontiguousarray(values)
+        packed[:, start:start + values.itemsize * values.shape[1]] = values.view(np.uint8).reshape(rows, -1)
+
+    if positions is not None:
+        put("vertex", quantize_values(columns["vertex"], *positions))
+    else:
+        put("vertex", columns["vertex"].astype(np.float32))
+    if "normal" in columns:
+        normals = columns["normal"]
+        length = np.linalg.norm(normals, axis=1, keepdims=True)
+        put("normal", np.round(normals / np.where(length > 0, length, 1) * 127).astype(np.int8))
+    if "texcoord" in columns:
+        if uvs is not None:
+            put("texcoord", quantize_values(columns["texcoord"], *uvs))
+        else:
+            put("texcoord", columns["texcoord"].astype(np.float32))
+    if "color" in columns:
+        put("color", np.round(np.clip(columns["color"], 0, 1) * 255).astype(np.uint8))
+
+    vdata = GeomVertexData(name, fmt, usage)
+    vdata.uncleanSetNumRows(rows)
+    vdata.modifyArrayHandle(0).copyDataFrom(packed.tobytes())
+    geom = Geom(vdata)
+    geom.addPrimitive(fill_triangles(GeomTriangles(usage), indices, rows))
+    return geom
+
+
+def optimize_arrays(columns, indices, cache_size=CACHE_SIZE):
+    # Weld, then triangle order for the transform cache, then vertex order
+    # for fetches
+    columns, indices = weld_vertices(columns, indices)
+    rows = len(columns["vertex"])
+    indices = optimize_vertex_cache(indices, rows, cache_size)
+    order, indices = optimize_vertex_fetch(indices, rows)
+    return {name: values[order] for name, values in columns.items()}, indices
+
+
+def optimize_model(model, quantize=True, cache_size=CACHE_SIZE):
+    # A copy of model with every static triangle Geom welded, reordered for
+    # the vertex cache and fetch locality and packed into a compact format.
+    # With quantize, positions (and texcoords, when only the default
+    # texture stage uses them) are int16: the GeomNode is put under a
+    # ModelNode holding the node and texture transforms that scale them
+    # back, kept out of flattening so they are never baked into the
+    # integers. Pass quantize=False for models drawn by shaders that place
+    # vertices themselves (cube_field, instancing), which expect model-space
+    # floats. Geoms this can't handle are copied as they are.
+    root = NodePath(model.getName() or "optimized")
+    model.copyTo(root)
+    for path in root.findAllMatches("**/+GeomNode"):
+        node = path.node()
+        arrays = [geom_arrays(node.getGeom(i)) for i in range(node.getNumGeoms())]
+        optimized = [optimize_arrays(*a, cache_size) if a is not None else None for a in arrays]
+        # The Geoms of a node share its dequantizing transform, so a node is
+        # only quantized when all of them are handled, and not at all when
+        # it has children the transform would move
+        packed = quantize and not node.getNumChildren() and all(a is not None for a in optimized)
+        positions = uvs = None
+        if packed:
+            positions = quantization(np.concatenate([columns["vertex"] for columns, _ in optimized]))
+            with_uvs = [columns["texcoord"] for columns, _ in optimized if "texcoord" in columns]
+            if with_uvs and default_stage_only(path):
+                uvs = quantization(np.concatenate(with_uvs))
+        for i, a in enumerate(optimized):
+            if a is not None:
+                node.setGeom(i, compact_geom(*a, positions, uvs, name=node.getName()))
+        if packed:
+            # The ModelNode takes the GeomNode's place, so the order of
+            # siblings (e.g. the switches of an LODNode) is kept. It gets a
+            # copy of everything on the GeomNode, of which it only keeps the
+            # transform.
+            dequantize = ModelNode(node.getName() + "-dequantize")
+            dequantize.replaceNode(node)
+            dequantize.setState(RenderState.makeEmpty())
+            dequantize.setEffects(RenderEffects.makeEmpty())
+            dequantize.setPreserveTransform(ModelNode.PT_local)
+            dequantize.setPreserveAttributes(SceneGraphReducer.TT_tex_matrix)
+            center, step = positions
+            dequantize.setTransform(node.getTransform().compose(
+                TransformState.makePosHprScale(tuple(center.tolist()), (0, 0, 0), (step, step, step))))
+            node.setTransform(TransformState.makeIdentity())
+            holder = NodePath(dequantize)
+            holder.attachNewNode(node)
+            if uvs is not None:
+                center, step = uvs
+                holder.setTexTransform(TextureStage.getDefault(), TransformState.makePosRotateScale2d(
+                    tuple(center.tolist()), 0, (step, step)))
+    return root
+
+
+def default_stage_only(path):
+    # Whether the only texture stage on the node's Geoms is the default
+    # one, the stage whose texture transform dequantizes texcoords
+    node = path.node()
+    states = [path.getNetState()] + [node.getGeomState(i) for i in range(node.getNumGeoms())]
+    for state in states:
+        textures = state.getAttrib(TextureAttrib)
+        if textures is not None and any(textures.getOnStage(i) != TextureStage.getDefault()
+                                        for i in range(textures.getNumOnStages())):
+            return False
+    return True
+
+
+def mesh_report(model, cache_size=FIFO_SIZE):
+    # (vertices, vertex bytes, triangles, vertices transformed) of every
+    # Geom under model; the last is what a cache_size FIFO post-transform
+    # cache misses, i.e. how often the vertex shader runs per draw
+    vertices = size = triangles = transformed = 0
+    found = list(model.findAllMatches("**/+GeomNode"))
+    if model.node().isGeomNode():
+        found.insert(0, model)
+    for path in found:
+        node = path.node()
+        for i in range(node.getNumGeoms()):
+            geom = node.getGeom(i)
+            vdata = geom.getVertexData()
+            vertices += vdata.getNumRows()
+            size += sum(vdata.getArray(j).getDataSizeBytes() for j in range(vdata.getNumArrays()))
+            for prim in geom.decompose().getPrimitives():
+                if prim.getPrimitiveType() == Geom.PT_polygons and prim.getNumVertices():
+                    indices = primitive_indices(prim)
+                    triangles += len(indices) // 3
+                    transformed += cache_misses(indices, cache_size)
+    return vertices, size, triangles, transformed
@@ -0,0 +1,324 @@
+from collections import OrderedDict, deque
+from panda3d.core import ConfigVariableString
+from race_sim import CAR_HALF, WALLS, boxes, step_cars
+import atexit
+import math
+import numpy as np
+import os
+import socket
+import struct
+import time
+
+
+race_server = ConfigVariableString(
+    "race-server", os.environ.get("RACE_SERVER", ""),
+    "host:port of a race server (race_server.py) to join instead of racing alone.")
+
+# Wire format shared by race_server.py and its clients. Every datagram
+# starts with a type byte:
+#   HELLO     client -> server  join the race
+#   WELCOME   server -> client  your car id and the tick rate
+#   INPUT     client -> server  the newest inputs, a few redundant ones,
+#                               and the newest snapshot tick received
+#   SNAPSHOT  server -> client  entity state, delta-compressed against a
+#                               snapshot the client acknowledged
+#   BYE       client -> server  leaving
+HELLO, WELCOME, INPUT, SNAPSHOT, BYE = range(1, 6)
+
+WELCOME_PACKET = struct.Struct("<BIH")  # type, car id, tick rate
+INPUT_HEADER = struct.Struct("<BIIB")  # type, acked snapshot tick, newest seq, input count
+SNAPSHOT_HEADER = struct.Struct("<BIII")  # type, tick, baseline tick, last input seq applied
+
+NONE = 0xffffffff
+# Inputs repeated in every input packet, so a few lost packets cost nothing
+REDUNDANT_INPUTS = 8
+# Snapshots a side remembers as possible baselines
+HISTORY = 64
+
+# Quantization: positions in 1/64 units, heading in 1/65536 of a turn
+POSITION_SCALE = 64
+HEADING_SCALE = 65536 / 360.0
+
+# Entity field bits in a snapshot
+X, Z, HEADING, FLAGS = 1, 2, 4, 8
+REMOVED = 128
+BOOSTING, AI = 1, 2
+
+
+def write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, offset):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def unzigzag(value):
+    return value >> 1 if not value & 1 else -(value >> 1) - 1
+
+
+def quantize(x, z, heading, boosting, is_ai):
+    return (round(x * POSITION_SCALE), round(z * POSITION_SCALE),
+            round(heading % 360 * HEADING_SCALE) & 0xffff,
+            (BOOSTING if boosting else 0) | (AI if is_ai else 0))
+
+
+def dequantize(state):
+    qx, qz, qh, flags = state
+    return qx / POSITION_SCALE, qz / POSITION_SCALE, qh / HEADING_SCALE, bool(flags & BOOSTING), bool(flags & AI)
+
+
+def encode_entities(out, view, baseline):
+    # Only entities that changed since the baseline are written, and of
+    # those only the fields that changed, each as a zigzag varint of the
+    # difference; entities new to the client are sent against all zeros
+    changed = []
+    for eid, state in view.items():
+        old = baseline.get(eid)
+        if old != state:
+            changed.append((eid, state, old or (0, 0, 0, 0)))
+    removed = [eid for eid in baseline if eid not in view]
+    write_varint(out, len(changed) + len(removed))
+    for eid, state, old in changed:
+        fields = 0
+        for bit, (new, before) in zip((X, Z, HEADING, FLAGS), zip(state, old)):
+            if new != before:
+                fields |= bit
+        write_varint(out, eid)
+        out.append(fields)
+        if fields & X:
+            write_varint(out, zigzag(state[0] - old[0]))
+        if fields & Z:
+            write_varint(out, zigzag(state[1] - old[1]))
+        if fields & HEADING:
+            # Shortest way round the 16-bit circle
+            write_varint(out, zigzag((state[2] - old[2] + 0x8000) % 0x10000 - 0x8000))
+        if fields & FLAGS:
+            out.append(state[3])
+    for eid in removed:
+        write_varint(out, eid)
+        out.append(REMOVED)
+
+
+def decode_entities(data, offset, baseline):
+    view = dict(baseline)
+    count, offset = read_varint(data, offset)
+    for _ in range(count):
+        eid, offset = read_varint(data, offset)
+        fields = data[offset]
+        offset += 1
+        if fields & REMOVED:
+            view.pop(eid, None)
+            continue
+        qx, qz, qh, flags = view.get(eid, (0, 0, 0, 0))
+        if fields & X:
+            value, offset = read_varint(data, offset)
+            qx += unzigzag(value)
+        if fields & Z:
+            value, offset = read_varint(data, offset)
+            qz += unzigzag(value)
+        if fields & HEADING:
+            value, offset = read_varint(data, offset)
+            qh = (qh + unzigzag(value)) & 0xffff
+        if fields & FLAGS:
+            flags = data[offset]
+            offset += 1
+        view[eid] = (qx, qz, qh, flags)
+    return view, offset
+
+
+def encode_snapshot(tick, baseline_tick, input_seq, view, baseline):
+    out = bytearray(SNAPSHOT_HEADER.pack(SNAPSHOT, tick, baseline_tick, input_seq))
+    encode_entities(out, view, baseline)
+    return bytes(out)
+
+
+def encode_input(acked_tick, seq, masks):
+    # masks are newest first, masks[0] belonging to seq
+    return INPUT_HEADER.pack(INPUT, acked_tick, seq, len(masks)) + bytes(masks)
+
+
+def decode_input(data):
+    _, acked_tick, seq, count = INPUT_HEADER.unpack_from(data)
+    masks = data[INPUT_HEADER.size:INPUT_HEADER.size + count]
+    # Oldest first, paired with their sequence numbers
+    return acked_tick, [(seq - i, masks[i]) for i in reversed(range(len(masks)))]
+
+
+class ClientCore:
+    # The client side of the protocol, without any socket: feed it every
+    # datagram with receive() and call step() once per tick with the input,
+    # then send whatever step() returns. The local car is predicted from
+    # the inputs right away; each snapshot resets it to the server's state
+    # and replays the inputs the server hasn't applied yet. Other cars are
+    # drawn interpolated between the last two snapshots.
+
+    def __init__(self):
+        self.car_id = None
+        self.rate = None
+        self.seq = 0
+        self.pending = deque()
+        self.views = OrderedDict()
+        self.latest = None
+        self.previous = None
+        self.server_tick = 0.0
+        self.car = None
+        self.corrections = []
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def hello(self):
+        return bytes([HELLO])
+
+    def bye(self):
+        return bytes([BYE])
+
+    def receive(self, data):
+        self.bytes_in += len(data)
+        if data[0] == WELCOME:
+            _, self.car_id, self.rate = WELCOME_PACKET.unpack_from(data)
+        elif data[0] == SNAPSHOT and self.car_id is not None:
+            self.receive_snapshot(data)
+
+    def receive_snapshot(self, data):
+        _, tick, baseline_tick, input_seq = SNAPSHOT_HEADER.unpack_from(data)
+        if self.latest is not None and tick <= self.latest[0]:
+            return  # Late or duplicated
+        if baseline_tick == NONE:
+            baseline = {}
+        elif baseline_tick in self.views:
+            baseline = self.views[baseline_tick]
+        else:
+            return  # Its baseline already fell out of the history
+        view, _ = decode_entities(data, SNAPSHOT_HEADER.size, baseline)
+        self.views[tick] = view
+        while len(self.views) > HISTORY:
+            self.views.popitem(last=False)
+        self.previous, self.latest = self.latest, (tick, view)
+        self.server_tick = float(tick)
+        self.reconcile(view, input_seq)
+
+    def reconcile(self, view, input_seq):
+        if self.car_id not in view:
+            return
+        while self.pending and input_seq != NONE and self.pending[0][0] <= input_seq:
+            self.pending.popleft()
+        before = None if self.car is None else (self.car[0][0], self.car[1][0])
+        x, z, heading, boosting, _ = dequantize(view[self.car_id])
+        self.car = (np.array([x]), np.array([z]), np.array([heading]), np.array([boosting]))
+        blockers = self.blockers()
+        for _, mask in self.pending:
+            step_cars(*self.car, [mask], 1.0 / self.rate, blockers)
+        if before is not None:
+            self.corrections.append(math.hypot(self.car[0][0] - before[0], self.car[1][0] - before[1]))
+
+    def blockers(self):
+        others = [dequantize(state)[:2] for eid, state in self.latest[1].items() if eid != self.car_id]
+        if not others:
+            return WALLS
+        return np.vstack([WALLS, boxes(others, CAR_HALF, CAR_HALF)])
+
+    def step(self, mask):
+        # Returns the input packet to send, or None before joining
+        if self.car_id is None:
+            return None
+        self.seq += 1
+        self.pending.append((self.seq, mask))
+        self.server_tick += 1
+        if self.car is not None:
+            step_cars(*self.car, [mask], 1.0 / self.rate, self.blockers())
+        masks = [m for _, m in list(self.pending)[-REDUNDANT_INPUTS:]][::-1]
+        packet = encode_input(self.latest[0] if self.latest else NONE, self.seq, masks)
+        self.bytes_out += len(packet)
+        return packet
+
+    def predicted(self):
+        # (x, z, heading, boosting) of the local car, or None before the
+        # first snapshot
+        if self.car is None:
+            return None
+        x, z, heading, boosting = self.car
+        return float(x[0]), float(z[0]), float(heading[0]), bool(boosting[0])
+
+    def remote(self, delay=2):
+        # {id: (x, z, heading, boosting, is_ai)} of everything else, delay
+        # ticks in the past so there are two snapshots to blend between
+        if self.latest is None:
+            return {}
+        render_tick = self.server_tick - delay
+        latest_tick, latest = self.latest
+        states = {}
+        for eid, state in latest.items():
+            if eid == self.car_id:
+                continue
+            current = dequantize(state)
+            if self.previous is not None and eid in self.previous[1] and render_tick < latest_tick:
+                previous_tick, view = self.previous
+                old = dequantize(view[eid])
+                t = min(max((render_tick - previous_tick) / (latest_tick - previous_tick), 0.0), 1.0)
+                turn = (current[2] - old[2] + 180) % 360 - 180
+                current = (old[0] + (current[0] - old[0]) * t, old[1] + (current[1] - old[1]) * t,
+                           old[2] + turn * t, current[3], current[4])
+            states[eid] = current
+        return states
+
+
+class RaceConnection:
+    # A ClientCore on a non-blocking UDP socket, for games that poll it
+    # from their own frame loop instead of running asyncio
+
+    def __init__(self, address):
+        self.core = ClientCore()
+        self.address = address
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+        self.last_hello = 0.0
+        atexit.register(self.close)
+
+    @classmethod
+    def from_config(cls):
+        # None unless race-server is set
+        value = race_server.getValue()
+        if not value:
+            return None
+        host, port = value.rsplit(":", 1)
+        return cls((host, int(port)))
+
+    def poll(self):
+        while True:
+            try:
+                data = self.socket.recv(2048)
+            except (BlockingIOError, ConnectionRefusedError):
+                break
+            self.core.receive(data)
+        # Until the welcome arrives, say hello twice a second
+        if self.core.car_id is None and time.monotonic() - self.last_hello > 0.5:
+            self.last_hello = time.monotonic()
+            self.socket.sendto(self.core.hello(), self.address)
+
+    def step(self, mask):
+        self.poll()
+        packet = self.core.step(mask)
+        if packet is not None:
+            self.socket.sendto(packet, self.address)
+
+    def close(self):
+        if self.socket.fileno() < 0:
+            return
+        if self.core.car_id is not None:
+            self.socket.sendto(self.core.bye(), self.address)
+        self.socket.close()
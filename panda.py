@@ -2,9 +2,17 @@ from direct.showbase.ShowBase import ShowBase
 from direct.task import Task
 from direct.gui.OnscreenText import OnscreenText
 from panda3d.core import PointLight, AmbientLight, VBase4, NodePath, LPoint3
-from math import sin, cos
+from panda3d.core import CardMaker
+from math import sin
 import sys
 
+from cube_field import make_cubes
+from fixed_step import FixedStep
+from lights import LightManager
+from profiler import install
+from quality import Knob, QualityController
+from replay import InputSession
+
 class IllusionGame(ShowBase):
     def __init__(self):
         ShowBase.__init__(self)
@@ -27,12 +35,13 @@ class IllusionGame(ShowBase):
         
         # Create the main cube
         self.cube = self.loader.loadModel("models/box")
-        self.cube.reparentTo(self.render)
-        self.cube.setScale(2, 2, 2)
-        self.cube.setPos(0, 0, 1)
+        # The animated cubes are copies of it; see cube_field.py for the
+        # shader and per-node modes and for laying out more than one
+        self.cubes = make_cubes(self.cube, self.render)
         
-        # Create a reflective floor
-        self.floor = self.loader.loadModel("models/plane")
+        # Create a reflective floor; models/plane doesn't ship with
+        # Panda3D, so it is made with CardMaker as in egg.py
+        self.floor = self.create_plane()
         self.floor.reparentTo(self.render)
         self.floor.setScale(20, 20, 1)
         self.floor.setPos(0, 0, 0)
@@ -46,6 +55,8 @@ class IllusionGame(ShowBase):
         self.mouse_sensitivity = 0.2
         self.prev_x = 0
         self.prev_y = 0
+        # Mouse movement since the last simulation step
+        self.look = [0.0, 0.0]
         
         # Enable mouse and keyboard input
         self.accept("escape", sys.exit)
@@ -66,17 +77,47 @@ class IllusionGame(ShowBase):
             "right": False
         }
         
+        # Camera movement runs at a fixed 120 Hz, drawn interpolated
+        self.sim = FixedStep(self.step_camera, rate=120)
+        self.sim.track(self.camera)
+        self.session = InputSession.from_config()
+        if self.session:
+            self.session.attach(self.sim, self.key_map, ("forward", "backward", "left", "right"),
+                                [self.camera], look=self.look)
+
         # Start tasks
         self.taskMgr.add(self.update, "update")
         self.taskMgr.add(self.animate_cube, "animate_cube")
-        
+
+        # Per-task timing overlay and trace; off unless task-profiler is set
+        self.profiler = install(self)
+
+        # Quality stepped down under load to hold the frame budget; off
+        # unless adaptive-quality is set
+        self.quality = QualityController.from_config(self, [
+            Knob("lights", (self.lights.max_lights, 2, 1), self.lights.set_max_lights),
+        ])
+        
+    def create_plane(self):
+        # Create a simple plane using CardMaker
+        cm = CardMaker("plane")
+        cm.setFrame(-1, 1, -1, 1)  # 2x2 square
+        return self.render.attachNewNode(cm.generate())
+    
     def setup_lights(self):
-        # Point light for dynamic shadows and highlights
+        # Point lights are handed out per object by the light manager, so
+        # each object is only shaded by the few lights near it
+        self.lights = LightManager(self.render)
+        self.lights.add_object(self.cubes.root)
+        self.lights.add_object(self.floor)
+
+        # Point light for dynamic shadows and highlights; it follows the
+        # camera, so it reaches well past the floor
         plight = PointLight("plight")
         plight.setColor(VBase4(1, 1, 1, 1))
         self.plight_node = self.render.attachNewNode(plight)
         self.plight_node.setPos(5, -5, 5)
-        self.render.setLight(self.plight_node)
+        self.lights.add_light(self.plight_node, radius=100)
         
         # Ambient light for soft illumination
         alight = AmbientLight("alight")
@@ -88,8 +129,22 @@ class IllusionGame(ShowBase):
         self.key_map[key] = value
         
     def update(self, task):
-        dt = globalClock.getDt()
+        # Handle mouse look; the next step turns the camera
+        if self.mouseWatcherNode and self.mouseWatcherNode.hasMouse():
+            x, y = self.mouseWatcherNode.getMouseX(), self.mouseWatcherNode.getMouseY()
+            self.look[0] += (x - self.prev_x) * 100 * self.mouse_sensitivity
+            self.look[1] += (y - self.prev_y) * 100 * self.mouse_sensitivity
+            self.prev_x, self.prev_y = x, y
+
+        self.sim.advance(globalClock.getDt())
+            
+        # Update light position based on camera
+        cam_pos = self.camera.getPos()
+        self.plight_node.setPos(cam_pos + LPoint3(5 * sin(task.time), -5, 5))
         
+        return Task.cont
+
+    def step_camera(self, dt):
         # Handle keyboard movement
         if self.key_map["forward"]:
             self.camera.setY(self.camera, self.move_speed * dt)
@@ -100,33 +155,18 @@ class IllusionGame(ShowBase):
         if self.key_map["right"]:
             self.camera.setX(self.camera, self.move_speed * dt)
         
-        # Handle mouse look
-        if self.mouseWatcherNode.hasMouse():
-            x, y = self.mouseWatcherNode.getMouseX(), self.mouseWatcherNode.getMouseY()
-            delta_x = (x - self.prev_x) * 100 * self.mouse_sensitivity
-            delta_y = (y - self.prev_y) * 100 * self.mouse_sensitivity
-            h, p = self.camera.getH() - delta_x, self.camera.getP() - delta_y
+        # Apply the mouse look gathered since the last step
+        if self.look[0] or self.look[1]:
+            h, p = self.camera.getH() - self.look[0], self.camera.getP() - self.look[1]
             self.camera.setHpr(h, max(min(p, 90), -90), 0)
-            self.prev_x, self.prev_y = x, y
-            
-        # Update light position based on camera
-        cam_pos = self.camera.getPos()
-        self.plight_node.setPos(cam_pos + LPoint3(5 * sin(task.time), -5, 5))
-        
-        return Task.cont
+            self.look[:] = [0.0, 0.0]
     
     def animate_cube(self, task):
-        # Create illusion with rotation and scaling
-        t = task.time
-        self.cube.setHpr(t * 30, t * 20, t * 10)  # Rotate cube
-        scale = 2 + 0.5 * sin(t)  # Pulsating scale
-        self.cube.setScale(scale, scale, scale)
-        
-        # Adjust cube color for visual effect
-        self.cube.setColor(0.5 + 0.5 * sin(t), 0.5 + 0.5 * cos(t), 0.8, 1)
-        
+        # Create illusion with rotation, pulsing scale and cycling color
+        self.cubes.update(task.time)
         return Task.cont
 
 # Run the game
-game = IllusionGame()
-game.run()
\ No newline at end of file
+if __name__ == "__main__":
+    game = IllusionGame()
+    game.run()
@@ -0,0 +1,202 @@
+from panda3d.core import (
+    ColorBlendAttrib, Geom, GeomNode, GeomPoints, GeomVertexArrayFormat, GeomVertexData, GeomVertexFormat,
+    InternalName, LVector3, OmniBoundingVolume, Texture, TexGenAttrib, TextureStage
+)
+import numpy as np
+import random
+
+SPRITE_SIZE = 32
+
+_format = None
+_sprite = None
+
+
+def particle_format():
+    # Positions and colors in two separate float32 arrays rather than one
+    # interleaved one, so each is filled with a plain contiguous copy
+    global _format
+    if _format is None:
+        fmt = GeomVertexFormat()
+        for name, kind in ((InternalName.getVertex(), Geom.C_point), (InternalName.getColor(), Geom.C_color)):
+            array = GeomVertexArrayFormat()
+            array.addColumn(name, 3 if kind == Geom.C_point else 4, Geom.NT_float32, kind)
+            fmt.addArray(array)
+        _format = GeomVertexFormat.registerFormat(fmt)
+    return _format
+
+
+def get_sprite_texture():
+    # A soft white disc, brightest in the middle, shared by every emitter
+    global _sprite
+    if _sprite is None:
+        axis = (np.arange(SPRITE_SIZE) + 0.5) / SPRITE_SIZE * 2 - 1
+        falloff = np.clip(1 - np.hypot(*np.meshgrid(axis, axis)), 0, 1) ** 2
+        texels = np.empty((SPRITE_SIZE, SPRITE_SIZE, 4), dtype=np.uint8)
+        texels[..., :3] = 255
+        texels[..., 3] = falloff * 255
+        _sprite = Texture("particle")
+        _sprite.setup2dTexture(SPRITE_SIZE, SPRITE_SIZE, Texture.T_unsigned_byte, Texture.F_rgba8)
+        _sprite.setRamImage(texels.tobytes())
+        _sprite.setWrapU(Texture.WM_clamp)
+        _sprite.setWrapV(Texture.WM_clamp)
+    return _sprite
+
+
+class ParticleEmitter:
+    # Particles in preallocated NumPy arrays used as a ring buffer:
+    # position, velocity, birth time and color. New particles go in at head,
+    # the oldest live one is at tail; every particle of an emitter lives
+    # for the same time, so they die in the order they were born and the
+    # live ones are always the slots from tail to head. A full buffer
+    # recycles its oldest particles. Nothing is allocated per frame.
+    #
+    # update() integrates the live slots with a few in-place array
+    # operations per segment (two when the live range wraps around) and
+    # writes them, faded by age, straight into the vertex buffer of one
+    # point-sprite Geom. Particles are in the coordinates of parent;
+    # gravity pulls them down the up axis of the default coordinate system,
+    # so the same emitter works in the Z-up Panda3D scenes and the Y-up
+    # Ursina ones, like terrain.py.
+
+    def __init__(self, parent, capacity=4096, lifetime=1.0, size=0.3, gravity=2.0, drag=0.5,
+                 name="particles", seed=None):
+        # Seeded from random by default, so a replay session's seed covers
+        # the spray too
+        self.rng = np.random.default_rng(random.getrandbits(64) if seed is None else seed)
+        self.capacity = capacity
+        self.lifetime = lifetime
+        self.gravity = np.array(LVector3.up(), dtype=np.float32) * -gravity
+        self.drag = drag
+        self.position = np.zeros((capacity, 3), dtype=np.float32)
+        self.velocity = np.zeros((capacity, 3), dtype=np.float32)
+        # Birth time rather than age, so aging costs nothing and the
+        # expired particles at the tail are found by binary search
+        self.born = np.zeros(capacity, dtype=np.float64)
+        self.color = np.zeros((capacity, 4), dtype=np.float32)
+        self.scratch = np.zeros((capacity, 3), dtype=np.float32)
+        self.head = 0
+        self.tail = 0
+        self.count = 0
+        self.time = 0.0
+        # Fraction of a particle owed by stream()
+        self.carry = 0.0
+
+        self.vdata = GeomVertexData(name, particle_format(), Geom.UH_stream)
+        self.vdata.uncleanSetNumRows(capacity)
+        self.points = GeomPoints(Geom.UH_stream)
+        self.points.setNonindexedVertices(0, 0)
+        geom = Geom(self.vdata)
+        geom.addPrimitive(self.points)
+        node = GeomNode(name)
+        node.addGeom(geom)
+        # Particles spread wherever they like; computing bounds from a
+        # million vertices every frame would cost more than culling saves
+        node.setBounds(OmniBoundingVolume())
+        node.setFinal(True)
+
+        self.root = parent.attachNewNode(node)
+        self.root.setRenderModeThickness(size)
+        self.root.setRenderModePerspective(True)
+        self.root.setTexGen(TextureStage.getDefault(), TexGenAttrib.MPointSprite)
+        self.root.setTexture(get_sprite_texture())
+        # Glowing: added on top of whatever is behind, after the opaque
+        # geometry, without hiding each other
+        self.root.setAttrib(ColorBlendAttrib.make(ColorBlendAttrib.MAdd, ColorBlendAttrib.OIncomingAlpha,
+                                                  ColorBlendAttrib.OOne))
+        self.root.setDepthWrite(False)
+        self.root.setBin("fixed", 0)
+        self.root.setLightOff(1)
+        self.root.setShaderOff(1)
+        self.root.hide()
+
+    def __len__(self):
+        return self.count
+
+    def segments(self):
+        # The live slots as at most two slices, oldest first
+        if self.count == 0:
+            return []
+        if self.tail < self.head:
+            return [slice(self.tail, self.head)]
+        return [slice(self.tail, self.capacity), slice(0, self.head)]
+
+    def emit(self, count, origin, velocity=(0, 0, 0), spread=0.5, color=(1, 1, 1, 1), jitter=0.2):
+        # count particles at origin, moving at velocity plus up to spread
+        # in any direction, their brightness varied by jitter
+        count = min(int(count), self.capacity)
+        if count <= 0:
+            return
+        slots = (self.head + np.arange(count)) % self.capacity
+        self.position[slots] = origin
+        self.velocity[slots] = self.rng.uniform(-spread, spread, (count, 3)) + np.asarray(velocity, np.float32)
+        self.color[slots] = color
+        self.color[slots, :3] *= 1 - self.rng.uniform(0, jitter, (count, 1))
+        self.born[slots] = self.time
+        self.head = (self.head + count) % self.capacity
+        overwritten = max(self.count + count - self.capacity, 0)
+        self.tail = (self.tail + overwritten) % self.capacity
+        self.count += count - overwritten
+
+    def stream(self, rate, dt, origin, **kwargs):
+        # rate particles a second, however the frames fall
+        self.carry += rate * dt
+        whole = int(self.carry)
+        self.carry -= whole
+        self.emit(whole, origin, **kwargs)
+
+    def update(self, dt):
+        self.simulate(dt)
+        self.upload()
+
+    def simulate(self, dt):
+        self.time += dt
+        self.expire()
+        damping = max(1.0 - self.drag * dt, 0.0)
+        for live in self.segments():
+            velocity = self.velocity[live]
+            step = self.scratch[live]
+            velocity += self.gravity * dt
+            velocity *= damping
+            np.multiply(velocity, dt, out=step)
+            self.position[live] += step
+
+    def expire(self):
+        # Born in order, so the dead are a run at the tail
+        oldest = self.time - self.lifetime
+        for live in self.segments():
+            dead = int(np.searchsorted(self.born[live], oldest, side="right"))
+            self.tail = (self.tail + dead) % self.capacity
+            self.count -= dead
+            if dead < live.stop - live.start:
+                break
+        if self.count == 0:
+            self.head = self.tail = 0
+
+    def upload(self):
+        positions, colors = (
+            np.frombuffer(memoryview(self.vdata.modifyArray(i)).cast("B"), dtype=np.float32).reshape(self.capacity, -1)
+            for i in range(2))
+        start = 0
+        for live in self.segments():
+            end = start + live.stop - live.start
+            positions[start:end] = self.position[live]
+            colors[start:end] = self.color[live]
+            # Fade out with age: alpha * (1 - age / lifetime)
+            alpha = colors[start:end, 3]
+            np.subtract(self.born[live], self.time - self.lifetime, out=alpha, casting="unsafe")
+            alpha *= self.color[live, 3]
+            alpha /= self.lifetime
+            start = end
+        self.points.setNonindexedVertices(0, self.count)
+        if self.count:
+            self.root.show()
+        else:
+            self.root.hide()
+
+    def clear(self):
+        self.head = self.tail = self.count = 0
+        self.carry = 0.0
+        self.upload()
+
+    def destroy(self):
+        self.root.removeNode()
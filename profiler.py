@@ -0,0 +1,198 @@
+from panda3d.core import CardMaker, ConfigVariableBool, ConfigVariableString, LineSegs, TextNode, TransparencyAttrib
+from direct.gui.OnscreenText import OnscreenText
+from collections import defaultdict, deque
+import atexit
+import json
+import os
+import time
+
+
+task_profiler = ConfigVariableBool(
+    "task-profiler", os.environ.get("TASK_PROFILER") == "1",
+    "Time every task per frame, show the frame-time overlay and write a Chrome trace.")
+task_profiler_trace = ConfigVariableString(
+    "task-profiler-trace", os.environ.get("TASK_PROFILER_TRACE", "frame_trace.json"),
+    "Where the Chrome trace_event JSON is written on exit.")
+
+# Task ShowBase uses to cull and draw the frame; its time is the frame's
+# cull + draw cost
+RENDER_TASK = "igLoop"
+
+# Histogram buckets, in milliseconds
+BUCKET_MS = 2.0
+BUCKETS = 25
+BUDGET_MS = 1000.0 / 60
+
+_profiler = None
+
+
+def install(base, trace_path=None):
+    # Returns the profiler, or None when profiling is off; nothing is hooked
+    # into the frame at all in that case
+    global _profiler
+    if not task_profiler.getValue():
+        return None
+    if _profiler is None:
+        _profiler = FrameProfiler(base, trace_path or task_profiler_trace.getValue())
+    return _profiler
+
+
+def profiled(function=None, name=None):
+    # Decorator for hooks that aren't tasks of their own, such as the Ursina
+    # update() functions. With profiling off the function is returned as is.
+    if function is None:
+        return lambda f: profiled(f, name)
+    if not task_profiler.getValue():
+        return function
+    label = name or function.__name__
+
+    def timed(*args, **kwargs):
+        if _profiler is None:
+            return function(*args, **kwargs)
+        return _profiler.time_call(label, function, args, kwargs)
+
+    return timed
+
+
+class FrameProfiler:
+    # Wraps every Python task so each one is timed once per frame. Frame
+    # times feed an in-game histogram, and every frame and task call is kept
+    # as a Chrome trace_event, viewable in chrome://tracing or Perfetto.
+
+    def __init__(self, base, trace_path, history=600, max_events=200000):
+        self.base = base
+        self.trace_path = trace_path
+        self.origin = time.perf_counter()
+        self.frame_ms = deque(maxlen=history)
+        self.task_ms = defaultdict(lambda: deque(maxlen=history))
+        self.events = deque(maxlen=max_events)
+        self.wrapped = set()
+        self.frame_start = None
+        self.frame_count = 0
+
+        base.taskMgr.add(self.begin_frame, "profiler-begin", sort=-1000)
+        base.taskMgr.add(self.update_overlay, "profiler-overlay", sort=1000)
+        base.accept("f9", self.dump)
+        base.accept("f10", self.toggle_overlay)
+        atexit.register(self.dump)
+
+        self.overlay = base.a2dBottomLeft.attachNewNode("profiler-overlay")
+        self.overlay.setBin("fixed", 100)
+        self.overlay.setDepthTest(False)
+        self.overlay.setDepthWrite(False)
+        self.overlay.setLightOff(1)
+        backdrop = CardMaker("profiler-backdrop")
+        backdrop.setFrame(-0.03, 1.45, -0.03, 0.42)
+        backdrop.setColor(0, 0, 0, 0.6)
+        self.overlay.attachNewNode(backdrop.generate()).setTransparency(TransparencyAttrib.MAlpha)
+        self.graph = self.overlay.attachNewNode("histogram")
+        self.text = OnscreenText(parent=self.overlay, pos=(0, 0), scale=0.04,
+                                 fg=(1, 1, 1, 1), shadow=(0, 0, 0, 1), align=TextNode.ALeft,
+                                 mayChange=True)
+        self.overlay.setPos(0.05, 0, 0.1)
+        self.text.setPos(BUCKETS * 0.03 + 0.05, 0.35)
+
+    def time_call(self, name, function, args, kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            end = time.perf_counter()
+            self.task_ms[name].append((end - start) * 1000)
+            self.events.append({
+                "name": name, "cat": "render" if name == RENDER_TASK else "task", "ph": "X",
+                "ts": (start - self.origin) * 1e6, "dur": (end - start) * 1e6, "pid": 0, "tid": 0,
+            })
+
+    def wrap_tasks(self):
+        # New tasks can be added at any time, so look for unwrapped ones
+        # every frame
+        for task in self.base.taskMgr.mgr.getActiveTasks():
+            if task.getTaskId() in self.wrapped or not hasattr(task, "getFunction"):
+                continue
+            name = task.getName()
+            if name.startswith("profiler-"):
+                continue
+            function = task.getFunction()
+
+            def timed(*args, name=name, function=function):
+                return self.time_call(name, function, args, {})
+
+            task.setFunction(timed)
+            self.wrapped.add(task.getTaskId())
+
+    def begin_frame(self, task):
+        now = time.perf_counter()
+        if self.frame_start is not None:
+            self.frame_ms.append((now - self.frame_start) * 1000)
+            self.events.append({
+                "name": "frame %d" % self.frame_count, "cat": "frame", "ph": "X",
+                "ts": (self.frame_start - self.origin) * 1e6, "dur": (now - self.frame_start) * 1e6,
+                "pid": 0, "tid": 1,
+            })
+            self.frame_count += 1
+        self.frame_start = now
+        self.wrap_tasks()
+        return task.cont
+
+    def stats(self):
+        # (mean, p95) frame time and mean ms per task, slowest first
+        ordered = sorted(self.frame_ms)
+        mean = sum(ordered) / len(ordered) if ordered else 0.0
+        p95 = ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] if ordered else 0.0
+        tasks = sorted(((sum(ms) / len(ms), name) for name, ms in self.task_ms.items() if ms), reverse=True)
+        return mean, p95, tasks
+
+    def update_overlay(self, task):
+        # Redrawing every frame would show up in the numbers it displays
+        if self.overlay.isHidden() or self.frame_count % 10:
+            return task.cont
+
+        counts = [0] * BUCKETS
+        for ms in self.frame_ms:
+            counts[min(BUCKETS - 1, int(ms / BUCKET_MS))] += 1
+        tallest = max(counts) or 1
+
+        lines = LineSegs("histogram")
+        lines.setThickness(4)
+        width = 0.03
+        for i, count in enumerate(counts):
+            if count:
+                # Buckets past the 60 fps budget are drawn red
+                if (i + 1) * BUCKET_MS > BUDGET_MS:
+                    lines.setColor(1, 0.3, 0.2, 0.9)
+                else:
+                    lines.setColor(0.3, 1, 0.4, 0.9)
+                lines.moveTo(i * width, 0, 0)
+                lines.drawTo(i * width, 0, 0.35 * count / tallest)
+        # Frame budget marker
+        lines.setThickness(1)
+        lines.setColor(1, 1, 0, 1)
+        budget_x = BUDGET_MS / BUCKET_MS * width
+        lines.moveTo(budget_x, 0, 0)
+        lines.drawTo(budget_x, 0, 0.38)
+        self.graph.node().removeAllChildren()
+        self.graph.attachNewNode(lines.create())
+
+        mean, p95, tasks = self.stats()
+        rows = ["frame %.2f ms  p95 %.2f ms" % (mean, p95)]
+        rows += ["%-16s %6.2f ms" % (name[:16], ms) for ms, name in tasks[:6]]
+        self.text.setText("\n".join(rows))
+        return task.cont
+
+    def toggle_overlay(self):
+        if self.overlay.isHidden():
+            self.overlay.show()
+        else:
+            self.overlay.hide()
+
+    def trace(self):
+        return {"traceEvents": list(self.events), "displayTimeUnit": "ms",
+                "otherData": {"frames": self.frame_count}}
+
+    def dump(self, path=None):
+        path = path or self.trace_path
+        with open(path, "w") as f:
+            json.dump(self.trace(), f)
+        print("profiler: wrote %d events to %s" % (len(self.events), path))
+        return path
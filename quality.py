@@ -0,0 +1,276 @@
+from panda3d.core import (
+    Camera, ConfigVariableBool, ConfigVariableDouble, ConfigVariableString, NodePath,
+    OrthographicLens, SamplerState, TextureStage
+)
+from collections import deque
+import json
+import os
+import time
+
+
+adaptive_quality = ConfigVariableBool(
+    "adaptive-quality", os.environ.get("ADAPTIVE_QUALITY") == "1",
+    "Lower and raise quality settings at run time to hold frame-budget-ms.")
+frame_budget = ConfigVariableDouble(
+    "frame-budget-ms", float(os.environ.get("FRAME_BUDGET_MS", 1000.0 / 60)),
+    "Frame time the adaptive quality controller aims to stay under.")
+quality_log = ConfigVariableString(
+    "quality-log", os.environ.get("QUALITY_LOG", ""),
+    "JSON lines file every quality adjustment is appended to; empty keeps them in memory only.")
+
+# Frames in the rolling window; a decision is made each time it is full
+WINDOW = 60
+# The window percentile held under the budget
+PERCENTILE = 95
+# Quality only goes back up once the percentile is below this fraction of
+# the budget; between it and the budget nothing changes
+HEADROOM = 0.7
+# Frames to wait before raising quality again; doubled whenever a raise is
+# undone within that many frames, so a setting the budget can't hold
+# isn't tried over and over
+UPGRADE_WAIT = WINDOW * 2
+MAX_UPGRADE_WAIT = WINDOW * 64
+# A knob kept from going lower is let go again after MAX_UPGRADE_WAIT
+# frames, or sooner once the median frame time has moved this fraction
+# away from the one it was judged at, since the load has changed
+FLOOR_MARGIN = 0.25
+
+RESOLUTION_SCALES = (1.0, 0.85, 0.7, 0.5)
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+class Knob:
+    # One quality setting: its values from best to cheapest and a function
+    # applying one of them
+
+    def __init__(self, name, values, apply):
+        self.name = name
+        self.values = values
+        self.apply = apply
+        self.level = 0
+        # Lowest quality level the controller may pick
+        self.floor = len(values) - 1
+        # (frame, median) the floor was raised at, None while it is open
+        self.pinned = None
+
+    @property
+    def value(self):
+        return self.values[self.level]
+
+    def set_level(self, level):
+        self.level = level
+        self.apply(self.values[level])
+
+
+class ResolutionScale:
+    # Renders the 3D scene at a fraction of the window resolution: the main
+    # camera draws into a corner of an offscreen buffer, which is stretched
+    # over the window under the 2D layers. At full scale the camera draws
+    # straight into the window again. The buffer is made on first use.
+
+    def __init__(self, base):
+        self.base = base
+        self.region = base.camNode.getDisplayRegion(0)
+        self.buffer = None
+        self.scale = 1.0
+
+    def make_buffer(self):
+        win = self.base.win
+        self.buffer = win.makeTextureBuffer("scaled-scene", win.getXSize(), win.getYSize())
+        self.buffer.setClearColorActive(False)
+        self.buffer.setClearDepthActive(False)
+        self.scaled_region = self.buffer.makeDisplayRegion()
+        self.scaled_region.setCamera(self.base.cam)
+        self.scaled_region.setClearColor(self.region.getClearColor())
+        self.scaled_region.setClearColorActive(True)
+        self.scaled_region.setClearDepthActive(True)
+        texture = self.buffer.getTexture()
+        texture.setMinfilter(SamplerState.FT_linear)
+        texture.setMagfilter(SamplerState.FT_linear)
+
+        # A full-window card in its own layer just where the scene was
+        self.view = NodePath("scaled-view")
+        lens = OrthographicLens()
+        lens.setFilmSize(2, 2)
+        lens.setNearFar(-1, 1)
+        camera = self.view.attachNewNode(Camera("scaled-view", lens))
+        self.card = self.buffer.getTextureCard()
+        self.card.reparentTo(self.view)
+        self.card.setDepthTest(False)
+        self.card.setDepthWrite(False)
+        self.card_region = win.makeDisplayRegion()
+        self.card_region.setSort(self.region.getSort())
+        self.card_region.setCamera(camera)
+
+    def set(self, scale):
+        if scale < 1.0 and self.buffer is None:
+            self.make_buffer()
+        self.scale = scale
+        self.region.setActive(scale >= 1.0)
+        if self.buffer is None:
+            return
+        self.buffer.setActive(scale < 1.0)
+        self.card_region.setActive(scale < 1.0)
+        self.scaled_region.setDimensions(0, scale, 0, scale)
+        self.card.setTexScale(TextureStage.getDefault(), scale, scale)
+
+    def destroy(self):
+        self.set(1.0)
+        if self.buffer is not None:
+            self.base.win.removeDisplayRegion(self.card_region)
+            self.base.graphicsEngine.removeWindow(self.buffer)
+            self.buffer = None
+
+
+class QualityController:
+    # Holds the frame time under a budget by stepping quality knobs down
+    # when the rolling PERCENTILE frame time goes over it, and back up once
+    # there is HEADROOM to spare. Each step moves one knob one level: down,
+    # the knob with the most quality left (ties go to the first), up, the
+    # one with the least (ties go to the last). After every step the window
+    # starts over, so each decision only sees frames at the current
+    # settings. A knob stepped down keeps going down while the median frame
+    # time doesn't drop; if it never does, the knob goes back to where it
+    # was and no lower until the load changes or MAX_UPGRADE_WAIT frames
+    # have passed. Every change is logged with the percentiles that caused
+    # it.
+
+    def __init__(self, base, knobs, budget_ms=None, log_path=None, window=WINDOW):
+        self.base = base
+        self.knobs = knobs
+        self.budget_ms = frame_budget.getValue() if budget_ms is None else budget_ms
+        self.log_path = log_path
+        self.samples = deque(maxlen=window)
+        self.upgrade_wait = UPGRADE_WAIT
+        self.frame = 0
+        self.last_change = 0
+        self.last_direction = None
+        # (knob, level before, median before) of the last step down
+        # until the window after it has been seen
+        self.trial = None
+        self.log = []
+        self.last_time = None
+        self.resolution = None
+        # After the frame has been drawn (igLoop, 50)
+        self.task = base.taskMgr.add(self.update, "quality-controller", sort=55)
+
+    @classmethod
+    def from_config(cls, base, knobs=()):
+        # Render resolution is always a knob; None when adaptive-quality is
+        # off, in which case nothing is changed
+        if not adaptive_quality.getValue():
+            return None
+        resolution = ResolutionScale(base)
+        knobs = [Knob("resolution", RESOLUTION_SCALES, resolution.set), *knobs]
+        controller = cls(base, knobs, log_path=quality_log.getValue() or None)
+        controller.resolution = resolution
+        return controller
+
+    def update(self, task):
+        now = time.perf_counter()
+        if self.last_time is not None:
+            self.record((now - self.last_time) * 1000)
+        self.last_time = now
+        return task.cont
+
+    def record(self, frame_ms):
+        # One frame's wall time; also usable to drive the controller offline
+        self.frame += 1
+        self.samples.append(frame_ms)
+        if len(self.samples) < self.samples.maxlen:
+            return
+        p50 = percentile(self.samples, 50)
+        p95 = percentile(self.samples, PERCENTILE)
+        self.release_floors(p50)
+        if self.trial is not None:
+            # Judged on the median, which moves less with the odd slow frame
+            knob, level, before = self.trial
+            if p50 < before:
+                self.trial = None
+            elif knob.level < knob.floor:
+                # A lower level may still pay for the knob's own overhead,
+                # e.g. the extra render pass of a lower resolution
+                self.change(knob, knob.level + 1, "down", p95)
+                return
+            else:
+                # No level helped; this knob stays where it was
+                self.trial = None
+                knob.floor = level
+                knob.pinned = (self.frame, before)
+                self.change(knob, level, "revert", p95)
+                return
+        if p95 > self.budget_ms and p50 > self.budget_ms * HEADROOM:
+            # Only the tail over the budget is hitching (loads, garbage
+            # collection, a load change mid-window), which lower quality
+            # doesn't fix
+            self.step_down(p50, p95)
+        elif p95 < self.budget_ms * HEADROOM and self.frame - self.last_change >= self.upgrade_wait:
+            self.step_up(p95)
+
+    def release_floors(self, p50):
+        for knob in self.knobs:
+            if knob.pinned is None:
+                continue
+            frame, before = knob.pinned
+            if self.frame - frame >= MAX_UPGRADE_WAIT or abs(p50 - before) > before * FLOOR_MARGIN:
+                knob.floor = len(knob.values) - 1
+                knob.pinned = None
+
+    def step_down(self, p50, p95):
+        open_knobs = [knob for knob in self.knobs if knob.level < knob.floor]
+        if not open_knobs:
+            return
+        knob = min(open_knobs, key=lambda knob: knob.level)
+        if self.last_direction == "up" and self.frame - self.last_change < self.upgrade_wait:
+            # The last raise didn't hold
+            self.upgrade_wait = min(self.upgrade_wait * 2, MAX_UPGRADE_WAIT)
+        self.trial = (knob, knob.level, p50)
+        self.change(knob, knob.level + 1, "down", p95)
+
+    def step_up(self, p95):
+        open_knobs = [knob for knob in self.knobs if knob.level > 0]
+        if not open_knobs:
+            return
+        knob = max(reversed(open_knobs), key=lambda knob: knob.level)
+        if self.last_direction == "up":
+            # The last raise held, so raises can come sooner again
+            self.upgrade_wait = max(self.upgrade_wait // 2, UPGRADE_WAIT)
+        self.change(knob, knob.level - 1, "up", p95)
+
+    def change(self, knob, level, direction, p95):
+        old = knob.value
+        knob.set_level(level)
+        entry = {
+            "frame": self.frame,
+            "time": time.time(),
+            "knob": knob.name,
+            "from": old,
+            "to": knob.value,
+            "direction": direction,
+            "p50_ms": percentile(self.samples, 50),
+            "p95_ms": p95,
+            "budget_ms": self.budget_ms,
+            "upgrade_wait": self.upgrade_wait,
+        }
+        self.log.append(entry)
+        if self.log_path:
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+        self.samples.clear()
+        self.last_change = self.frame
+        self.last_direction = direction
+
+    def settings(self):
+        return {knob.name: knob.value for knob in self.knobs}
+
+    def destroy(self):
+        self.base.taskMgr.remove(self.task)
+        for knob in self.knobs:
+            if knob.level:
+                knob.set_level(0)
+        if self.resolution is not None:
+            self.resolution.destroy()
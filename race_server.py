@@ -0,0 +1,194 @@
+# Headless, authoritative race server. The race is simulated here at a
+# fixed tick (race_sim.py) and clients only send their inputs; they get
+# back quantized, delta-compressed snapshots (netcode.py), with far-away
+# cars updated less often than near ones. Run from the repository root:
+#   python race_server.py --port 7777
+# and point the racer at it with RACE_SERVER=127.0.0.1:7777.
+from collections import OrderedDict, deque
+from netcode import (BYE, HELLO, HISTORY, INPUT, NONE, WELCOME, WELCOME_PACKET,
+                     decode_input, encode_snapshot, quantize)
+from race_sim import TICK_RATE, RaceSim
+import argparse
+import asyncio
+import numpy as np
+import time
+
+# Inputs a client may run ahead of the server before old ones are dropped
+MAX_BUFFERED_INPUTS = 4
+# Clients not heard from for this long are dropped
+TIMEOUT = 5.0
+
+# Interest management: (distance, snapshot interval) bands. A car further
+# than the last distance is sent every INTEREST_FAR snapshots.
+INTEREST = ((25.0, 1), (60.0, 2))
+INTEREST_FAR = 4
+
+
+class Client:
+
+    def __init__(self, address, car_id):
+        self.address = address
+        self.car_id = car_id
+        self.inputs = deque()
+        self.queued_seq = 0
+        self.applied_seq = NONE
+        self.mask = 0
+        self.acked = NONE
+        self.views = OrderedDict()
+        self.last_view = {}
+        self.last_heard = time.monotonic()
+        self.bytes_out = 0
+        self.bytes_in = 0
+
+    def queue_inputs(self, inputs):
+        for seq, mask in inputs:
+            if seq > self.queued_seq:
+                self.inputs.append((seq, mask))
+                self.queued_seq = seq
+        while len(self.inputs) > MAX_BUFFERED_INPUTS:
+            self.inputs.popleft()
+
+    def next_mask(self):
+        # One input per tick; with none waiting the last one is held, which
+        # is the best guess during packet loss
+        if self.inputs:
+            self.applied_seq, self.mask = self.inputs.popleft()
+        return self.mask
+
+
+class RaceServer(asyncio.DatagramProtocol):
+
+    def __init__(self, rate=TICK_RATE, snapshot_every=2, ai_count=3, seed=None):
+        self.sim = RaceSim(ai_count, seed=seed, rate=rate)
+        self.rate = rate
+        self.snapshot_every = snapshot_every
+        self.snapshots = 0
+        self.clients = {}
+        self.transport = None
+        self.tick_ms = []
+        # CPU time per tick, which unlike tick_ms leaves out time the
+        # process spent waiting for a core
+        self.tick_cpu_ms = []
+        self.running = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        if not data:
+            return
+        client = self.clients.get(address)
+        if data[0] == HELLO:
+            if client is None:
+                client = self.clients[address] = Client(address, self.sim.add_car())
+            # Resent on a repeated hello, in case the first welcome got lost
+            self.transport.sendto(WELCOME_PACKET.pack(WELCOME, client.car_id, self.rate), address)
+        elif client is None:
+            return
+        elif data[0] == INPUT:
+            acked, inputs = decode_input(data)
+            client.queue_inputs(inputs)
+            if acked != NONE and (client.acked == NONE or acked > client.acked):
+                client.acked = acked
+        elif data[0] == BYE:
+            self.drop(client)
+            return
+        client.last_heard = time.monotonic()
+        client.bytes_in += len(data)
+
+    def drop(self, client):
+        self.sim.remove_car(client.car_id)
+        del self.clients[client.address]
+
+    def tick(self):
+        now = time.monotonic()
+        for client in [c for c in self.clients.values() if now - c.last_heard > TIMEOUT]:
+            self.drop(client)
+
+        by_car = {client.car_id: client for client in self.clients.values()}
+        self.sim.step([by_car[car_id].next_mask() for car_id in self.sim.ids])
+        if self.sim.tick % self.snapshot_every == 0:
+            self.send_snapshots()
+
+    def send_snapshots(self):
+        self.snapshots += 1
+        entities = list(self.sim.entities())
+        ids = [entity[0] for entity in entities]
+        world = {entity[0]: quantize(*entity[1:]) for entity in entities}
+        clients = list(self.clients.values())
+        due = self.interest(clients, entities)
+        for client, row in zip(clients, due.tolist()):
+            # Cars not due keep the value last sent to this client
+            last = client.last_view
+            view = {eid: world[eid] if send or eid not in last else last[eid] for eid, send in zip(ids, row)}
+            baseline_tick = client.acked if client.acked in client.views else NONE
+            baseline = client.views[baseline_tick] if baseline_tick != NONE else {}
+            packet = encode_snapshot(self.sim.tick, baseline_tick, client.applied_seq, view, baseline)
+            client.views[self.sim.tick] = view
+            while len(client.views) > HISTORY:
+                client.views.popitem(last=False)
+            client.last_view = view
+            client.bytes_out += len(packet)
+            self.transport.sendto(packet, client.address)
+
+    def interest(self, clients, entities):
+        # (clients, entities) matrix of which cars each client gets this
+        # snapshot: near ones always, farther ones every few snapshots,
+        # with each car's turn staggered by its id
+        if not clients or not entities:
+            return np.zeros((len(clients), len(entities)), dtype=bool)
+        ids = np.array([entity[0] for entity in entities])
+        positions = np.array([entity[1:3] for entity in entities])
+        index = {eid: i for i, eid in enumerate(ids.tolist())}
+        own_ids = np.array([client.car_id for client in clients])
+        own = positions[[index[car_id] for car_id in own_ids.tolist()]]
+        distance = np.hypot(positions[None, :, 0] - own[:, None, 0], positions[None, :, 1] - own[:, None, 1])
+        interval = np.full(distance.shape, INTEREST_FAR)
+        for reach, every in reversed(INTEREST):
+            interval[distance < reach] = every
+        return ((self.snapshots + ids)[None, :] % interval == 0) | (ids[None, :] == own_ids[:, None])
+
+    async def run(self, duration=None):
+        # Ticks on a fixed timeline; a slow tick is caught up on right away
+        loop = asyncio.get_running_loop()
+        dt = 1.0 / self.rate
+        start = next_tick = loop.time()
+        self.running = True
+        while self.running and (duration is None or loop.time() - start < duration):
+            began, began_cpu = time.perf_counter(), time.thread_time()
+            self.tick()
+            self.tick_ms.append((time.perf_counter() - began) * 1000)
+            self.tick_cpu_ms.append((time.thread_time() - began_cpu) * 1000)
+            next_tick += dt
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+
+
+async def serve(host, port, rate=TICK_RATE, snapshot_every=2, duration=None, seed=None, ready=None):
+    loop = asyncio.get_running_loop()
+    transport, server = await loop.create_datagram_endpoint(
+        lambda: RaceServer(rate, snapshot_every, seed=seed), local_addr=(host, port))
+    if ready is not None:
+        ready(transport.get_extra_info("sockname"))
+    try:
+        await server.run(duration)
+    finally:
+        transport.close()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the headless race server.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=7777)
+    parser.add_argument("--rate", type=int, default=TICK_RATE, help="simulation ticks per second")
+    parser.add_argument("--snapshot-every", type=int, default=2, help="ticks between snapshots")
+    args = parser.parse_args(argv)
+    print("race server on %s:%d, %d Hz" % (args.host, args.port, args.rate))
+    try:
+        asyncio.run(serve(args.host, args.port, args.rate, args.snapshot_every))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
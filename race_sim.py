@@ -0,0 +1,210 @@
+from fleet import AIFleet
+import numpy as np
+
+# The racer's rules (Car Model/player.py) without any rendering, so they
+# can run on a headless server, in a client's prediction and in batch
+# experiments alike. Cars live in the ground plane: x across the track, z
+# along it, heading is Ursina's rotation_y in degrees.
+
+TICK_RATE = 60
+
+SPEED = 5.0
+TURN_SPEED = 80.0
+BOOST = 2.0
+AI_FACTOR = 0.8
+AI_SPEED = SPEED * AI_FACTOR
+
+# Inputs are a bitmask over these keys, in the order replay.py logs them
+KEYS = ("w", "a", "s", "d")
+FORWARD, LEFT, BACK, RIGHT = (1 << bit for bit in range(len(KEYS)))
+
+# Grid slots behind the start line; later cars queue up further back
+START = (0.0, -40.0)
+GRID_COLUMNS = (0.0, -1.5, 1.5, -3.0, 3.0)
+GRID_SPACING = 1.5
+# Half the ground-plane extent of a car's box, a bit over the 0.25 of the
+# 0.5 scale cube so it holds while turning
+CAR_HALF = 0.3
+
+# The racer's track: 11 wall segments 10 long down each side, pads along
+# the centre line, and the end of the walls as the finish
+TRACK_WIDTH = 10.0
+PAD_POSITIONS = (-20.0, 0.0, 20.0, 40.0)
+FINISH = 55.0
+
+
+def input_mask(state):
+    # state is the key dict the game reads, e.g. held_keys
+    mask = 0
+    for bit, key in enumerate(KEYS):
+        if state[key]:
+            mask |= 1 << bit
+    return mask
+
+
+def boxes(centers, half_x, half_z):
+    centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+    return np.column_stack([centers[:, 0] - half_x, centers[:, 1] - half_z,
+                            centers[:, 0] + half_x, centers[:, 1] + half_z])
+
+
+def overlaps(a, b):
+    # (len(a), len(b)) matrix of which bounds overlap
+    return ((a[:, None, 0] <= b[None, :, 2]) & (a[:, None, 2] >= b[None, :, 0])
+            & (a[:, None, 1] <= b[None, :, 3]) & (a[:, None, 3] >= b[None, :, 1]))
+
+
+class RaceRules:
+    # The tunable parts of a race; the defaults are the racer's
+
+    def __init__(self, speed=SPEED, turn_speed=TURN_SPEED, boost=BOOST, ai_factor=AI_FACTOR,
+                 pads=PAD_POSITIONS, track_width=TRACK_WIDTH, ai_count=3):
+        self.speed = speed
+        self.turn_speed = turn_speed
+        self.boost = boost
+        self.ai_factor = ai_factor
+        self.ai_speed = speed * ai_factor
+        self.pad_positions = tuple(pads)
+        self.track_width = track_width
+        self.ai_count = ai_count
+        # (min_x, min_z, max_x, max_z) bounds of the walls and pads
+        side = track_width / 2
+        self.walls = np.vstack([boxes([(x, z * 10) for z in range(-5, 6)], 0.5, 5.0) for x in (side, -side)])
+        self.pads = boxes([(0, z) for z in self.pad_positions], 1.5, 1.5)
+        # AI lanes at +-3 on the racer's 10 wide track
+        self.lanes = (-0.3 * track_width, 0.0, 0.3 * track_width)
+
+
+RULES = RaceRules()
+WALLS = RULES.walls
+BOOST_PADS = RULES.pads
+
+
+def step_cars(x, z, heading, boosting, masks, dt, blockers, rules=RULES, per_car=None, each_other=True):
+    # One tick for any number of cars, in place. Same order as the racer:
+    # move with last tick's boost, turn, then a car that ends up inside a
+    # wall or another car goes back to where it was; touching a pad boosts.
+    # blockers holds the bounds of everything but these cars themselves;
+    # per_car optionally adds (len(x), k, 4) bounds that only block their
+    # own car, and each_other=False skips car-against-car checks (e.g. for
+    # cars that are each in a race of their own). Returns which were blocked.
+    masks = np.asarray(masks)
+    speed = rules.speed * np.where(boosting, rules.boost, 1.0)
+    direction = (masks & FORWARD != 0).astype(np.float64) - (masks & BACK != 0)
+    radians = np.radians(heading)
+    new_x = x + np.sin(radians) * direction * speed * dt
+    new_z = z + np.cos(radians) * direction * speed * dt
+    heading += ((masks & LEFT != 0).astype(np.float64) - (masks & RIGHT != 0)) * rules.turn_speed * dt
+
+    moved = boxes(np.column_stack([new_x, new_z]), CAR_HALF, CAR_HALF)
+    blocked = overlaps(moved, blockers).any(axis=1) if len(blockers) else np.zeros(len(x), dtype=bool)
+    if per_car is not None and per_car.shape[1]:
+        blocked |= ((moved[:, None, 0] <= per_car[..., 2]) & (moved[:, None, 2] >= per_car[..., 0])
+                    & (moved[:, None, 1] <= per_car[..., 3]) & (moved[:, None, 3] >= per_car[..., 1])).any(axis=1)
+    if each_other and len(x) > 1:
+        between = overlaps(moved, moved)
+        np.fill_diagonal(between, False)
+        blocked |= between.any(axis=1)
+    x[:] = np.where(blocked, x, new_x)
+    z[:] = np.where(blocked, z, new_z)
+    boosting[:] = overlaps(moved, rules.pads).any(axis=1)
+    return blocked
+
+
+class RaceSim:
+    # Any number of player cars plus the AI fleet. Entity ids are stable:
+    # AI cars take the first ids, players get theirs from add_car().
+
+    def __init__(self, ai_count=3, seed=None, rate=TICK_RATE):
+        self.dt = 1.0 / rate
+        self.tick = 0
+        self.fleet = AIFleet(ai_count, speed=AI_SPEED, seed=seed)
+        self.ids = []
+        self.x = np.zeros(0)
+        self.z = np.zeros(0)
+        self.heading = np.zeros(0)
+        self.boosting = np.zeros(0, dtype=bool)
+        self.next_id = ai_count
+
+    def grid_slot(self, slot):
+        row, column = divmod(slot, len(GRID_COLUMNS))
+        return GRID_COLUMNS[column], START[1] - row * GRID_SPACING
+
+    def add_car(self, position=None, heading=0.0):
+        car_id = self.next_id
+        if position is None:
+            # The first grid slot nobody is sitting on
+            taken = set(zip(self.x.tolist(), self.z.tolist()))
+            slot = 0
+            while self.grid_slot(slot) in taken:
+                slot += 1
+            position = self.grid_slot(slot)
+        self.next_id += 1
+        self.ids.append(car_id)
+        self.x = np.append(self.x, position[0])
+        self.z = np.append(self.z, position[1])
+        self.heading = np.append(self.heading, heading)
+        self.boosting = np.append(self.boosting, False)
+        return car_id
+
+    def remove_car(self, car_id):
+        index = self.ids.index(car_id)
+        del self.ids[index]
+        self.x = np.delete(self.x, index)
+        self.z = np.delete(self.z, index)
+        self.heading = np.delete(self.heading, index)
+        self.boosting = np.delete(self.boosting, index)
+
+    def ai_bounds(self):
+        return boxes(np.column_stack([self.fleet.x, self.fleet.y]), CAR_HALF, CAR_HALF)
+
+    def step(self, masks):
+        # masks is a key bitmask per player car, in self.ids order
+        self.fleet.step(self.dt)
+        if self.ids:
+            blockers = np.vstack([WALLS, self.ai_bounds()])
+            step_cars(self.x, self.z, self.heading, self.boosting, masks, self.dt, blockers)
+        self.tick += 1
+
+    def entities(self):
+        # (id, x, z, heading, boosting, is_ai) for everything on the track.
+        # The fleet's heading is Panda's H, the opposite way round.
+        fleet = self.fleet
+        for i in range(len(fleet)):
+            yield i, float(fleet.x[i]), float(fleet.y[i]), -float(fleet.heading[i]), False, True
+        for i, car_id in enumerate(self.ids):
+            yield car_id, float(self.x[i]), float(self.z[i]), float(self.heading[i]), bool(self.boosting[i]), False
+
+
+class BatchRace:
+    # Many independent single-player races under the same rules, stepped in
+    # lockstep as arrays: one player car per race, and one AI fleet whose
+    # groups keep each race's AI cars to themselves. Nothing is drawn, so a
+    # batch runs far faster than real time.
+
+    def __init__(self, races, rules=RULES, seed=0, rate=TICK_RATE):
+        self.races = races
+        self.rules = rules
+        self.dt = 1.0 / rate
+        self.tick = 0
+        ai = rules.ai_count
+        self.fleet = AIFleet(races * ai, lanes=rules.lanes, speed=rules.ai_speed, seed=seed,
+                             groups=np.repeat(np.arange(races), ai))
+        self.x = np.full(races, START[0])
+        self.z = np.full(races, START[1])
+        self.heading = np.zeros(races)
+        self.boosting = np.zeros(races, dtype=bool)
+        self.blocked = np.zeros(races, dtype=bool)
+
+    def ai_positions(self):
+        # (races, ai_count) lateral and along-track positions
+        shape = (self.races, self.rules.ai_count)
+        return self.fleet.x.reshape(shape), self.fleet.y.reshape(shape)
+
+    def step(self, masks):
+        self.fleet.step(self.dt)
+        ai_x, ai_z = self.ai_positions()
+        per_car = np.stack([ai_x - CAR_HALF, ai_z - CAR_HALF, ai_x + CAR_HALF, ai_z + CAR_HALF], axis=-1)
+        self.blocked = step_cars(self.x, self.z, self.heading, self.boosting, masks, self.dt,
+                                 self.rules.walls, self.rules, per_car=per_car, each_other=False)
+        self.tick += 1
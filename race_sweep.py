@@ -0,0 +1,180 @@
+# Parameter sweeps over the racer's tuning (speeds, AI speed factor, boost
+# pad layout, track width), run headless on race_sim.BatchRace and fanned
+# out over a process pool. A scripted driver races every configuration
+# many times; the results are aggregated into one table. Run from the
+# repository root:
+#   python race_sweep.py --races 500
+#   python race_sweep.py --speed 4 5 6 --ai-factor 0.6 0.8 1.0 --output sweep.json
+#   python race_sweep.py --scaling
+from concurrent.futures import ProcessPoolExecutor
+from race_sim import FINISH, FORWARD, LEFT, PAD_POSITIONS, RIGHT, TICK_RATE, BatchRace, RaceRules
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+PAD_LAYOUTS = {
+    "racer": PAD_POSITIONS,
+    "none": (),
+    "early": (-30.0, -20.0, -10.0, 0.0),
+    "late": (10.0, 20.0, 30.0, 40.0),
+    "dense": tuple(float(z) for z in range(-30, 45, 10)),
+}
+
+# Races that haven't finished after this long count as did-not-finish
+TIME_LIMIT = 60.0
+# Races per pool task; big enough that the arrays amortize Python overhead
+CHUNK = 250
+
+
+def driver_inputs(batch, lookahead=6.0, horizon=8.0):
+    # A scripted driver for every race at once: full throttle, steering for
+    # the lane with the most room ahead, preferring the centre lane's pads
+    rules = batch.rules
+    lanes = np.array(rules.lanes)
+    ai_x, ai_z = batch.ai_positions()
+    ahead = ai_z - batch.z[:, None]
+    near = (ahead > 0) & (ahead < horizon)
+    in_lane = np.abs(ai_x[:, :, None] - lanes[None, None, :]) < 1.0
+    room = np.where(near[:, :, None] & in_lane, ahead[:, :, None], horizon).min(axis=1)
+    score = room + 0.5 * (lanes == 0) - 0.1 * np.abs(lanes[None, :] - batch.x[:, None])
+    target = lanes[np.argmax(score, axis=1)]
+
+    # Left turns raise the heading, i.e. steer toward +x
+    desired = np.degrees(np.arctan2(target - batch.x, lookahead))
+    turn = desired - batch.heading
+    return FORWARD | np.where(turn > 2, LEFT, 0) | np.where(turn < -2, RIGHT, 0)
+
+
+def run_races(params, races, seed):
+    # One pool task: `races` races of one configuration
+    rules = RaceRules(speed=params["speed"], turn_speed=params["turn_speed"],
+                      ai_factor=params["ai_factor"], pads=PAD_LAYOUTS[params["pads"]],
+                      track_width=params["track_width"])
+    batch = BatchRace(races, rules, seed=seed)
+    finish = np.full(races, np.nan)
+    boosted = np.zeros(races)
+    blocked = np.zeros(races)
+    running = np.ones(races, dtype=bool)
+    raced = 0
+    limit = int(TIME_LIMIT * TICK_RATE)
+    while batch.tick < limit and running.any():
+        # Finished cars just stop
+        batch.step(np.where(running, driver_inputs(batch), 0))
+        raced += int(running.sum())
+        boosted += running & batch.boosting
+        blocked += running & batch.blocked
+        done = running & (batch.z >= FINISH)
+        finish[done] = batch.tick * batch.dt
+        running &= ~done
+    ticks = np.where(np.isnan(finish), limit, finish * TICK_RATE)
+    return {
+        "finish": finish[~np.isnan(finish)].tolist(),
+        "dnf": int(np.isnan(finish).sum()),
+        "boosted": float((boosted / ticks).sum()),
+        "blocked": float((blocked / ticks).sum()),
+        "races": races,
+        "ticks": raced,
+    }
+
+
+def aggregate(params, parts):
+    finish = sorted(t for part in parts for t in part["finish"])
+    races = sum(part["races"] for part in parts)
+    row = dict(params)
+    row.update({
+        "races": races,
+        "finish_mean": sum(finish) / len(finish) if finish else None,
+        "finish_p90": finish[min(len(finish) - 1, int(len(finish) * 0.9))] if finish else None,
+        "dnf": sum(part["dnf"] for part in parts) / races,
+        "boosted": sum(part["boosted"] for part in parts) / races,
+        "blocked": sum(part["blocked"] for part in parts) / races,
+    })
+    return row
+
+
+def sweep(configs, races, workers, seed=0):
+    # Every configuration is cut into chunks of races; chunks of all
+    # configurations share the pool, so the workers stay busy to the end
+    tasks = []
+    for index, params in enumerate(configs):
+        for start in range(0, races, CHUNK):
+            tasks.append((index, params, min(CHUNK, races - start), seed + index * 100003 + start))
+    parts = [[] for _ in configs]
+    ticks = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [(index, pool.submit(run_races, params, count, task_seed))
+                   for index, params, count, task_seed in tasks]
+        for index, future in futures:
+            result = future.result()
+            parts[index].append(result)
+            ticks += result["ticks"]
+    return [aggregate(params, part) for params, part in zip(configs, parts)], ticks
+
+
+def print_table(rows):
+    print(f"{'speed':>5} {'turn':>5} {'ai':>4} {'pads':>6} {'width':>5} {'races':>6} "
+          f"{'finish s':>8} {'p90':>6} {'dnf':>5} {'boost':>6} {'blocked':>7}")
+    for row in sorted(rows, key=lambda r: (r["finish_mean"] is None, r["finish_mean"] or 0)):
+        finish = "-" if row["finish_mean"] is None else f"{row['finish_mean']:.2f}"
+        p90 = "-" if row["finish_p90"] is None else f"{row['finish_p90']:.2f}"
+        print(f"{row['speed']:>5g} {row['turn_speed']:>5g} {row['ai_factor']:>4g} {row['pads']:>6} "
+              f"{row['track_width']:>5g} {row['races']:>6} {finish:>8} {p90:>6} {row['dnf']:>5.0%} "
+              f"{row['boosted']:>6.1%} {row['blocked']:>7.1%}")
+
+
+def scaling(races, max_workers):
+    # Same workload at 1, 2, 4, ... workers
+    configs = [dict(speed=5.0, turn_speed=80.0, ai_factor=0.8, pads="racer", track_width=10.0)] * 4
+    print(f"{'workers':>7} {'seconds':>8} {'races/s':>8} {'sim s/s':>9} {'speedup':>8}")
+    base = None
+    workers = 1
+    while workers <= max_workers:
+        start = time.perf_counter()
+        _, ticks = sweep(configs, races, workers)
+        elapsed = time.perf_counter() - start
+        rate = len(configs) * races / elapsed
+        base = base or rate
+        print(f"{workers:>7} {elapsed:>8.2f} {rate:>8.0f} {ticks / TICK_RATE / elapsed:>9.0f} {rate / base:>7.2f}x")
+        workers *= 2
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sweep race parameters over a process pool.")
+    parser.add_argument("--races", type=int, default=500, help="races per configuration")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--speed", type=float, nargs="+", default=[5.0])
+    parser.add_argument("--turn-speed", type=float, nargs="+", default=[60.0, 80.0, 100.0])
+    parser.add_argument("--ai-factor", type=float, nargs="+", default=[0.6, 0.8, 1.0])
+    parser.add_argument("--pads", nargs="+", default=["racer", "none", "dense"], choices=sorted(PAD_LAYOUTS))
+    parser.add_argument("--track-width", type=float, nargs="+", default=[10.0])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results table as JSON here")
+    parser.add_argument("--scaling", action="store_true", help="measure throughput against worker count")
+    args = parser.parse_args(argv)
+
+    if args.scaling:
+        scaling(args.races, args.workers)
+        return 0
+
+    configs = [dict(speed=speed, turn_speed=turn, ai_factor=factor, pads=pads, track_width=width)
+               for speed, turn, factor, pads, width in itertools.product(
+                   args.speed, args.turn_speed, args.ai_factor, args.pads, args.track_width)]
+    start = time.perf_counter()
+    rows, ticks = sweep(configs, args.races, args.workers, args.seed)
+    elapsed = time.perf_counter() - start
+    print_table(rows)
+    print(f"\n{len(configs) * args.races} races in {elapsed:.1f} s on {args.workers} workers, "
+          f"{ticks / TICK_RATE / elapsed:.0f}x real time")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(rows, f, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,213 @@
+from direct.showbase.MessengerGlobal import messenger
+from panda3d.core import ConfigVariableString
+import atexit
+import os
+import random
+import struct
+import zlib
+
+
+input_record = ConfigVariableString(
+    "input-record", os.environ.get("INPUT_RECORD", ""),
+    "Record the player's input to this file.")
+input_replay = ConfigVariableString(
+    "input-replay", os.environ.get("INPUT_REPLAY", ""),
+    "Replay input from this file instead of the keyboard and mouse.")
+
+REPLAY_DONE_EVENT = "input-replay-done"
+
+# Log layout: header, key names, then tagged records until the end record.
+# Input records are only written on ticks where the keys change or the
+# mouse moves, so a held key costs nothing.
+MAGIC = b"INRP"
+VERSION = 1
+HEADER = struct.Struct("<4sHHdQ")  # magic, version, key count, step dt, seed
+INPUT = struct.Struct("<IIff")  # tick, key bitmask, mouse dx, mouse dy
+CHECKSUM = struct.Struct("<II")  # tick, crc32 of the tracked transforms
+END = struct.Struct("<I")  # ticks in the session
+
+# Ticks between transform checksums
+CHECK_EVERY = 60
+
+
+class ReplayError(Exception):
+    pass
+
+
+class InputLog:
+
+    def __init__(self, keys, dt, seed):
+        self.keys = list(keys)
+        self.dt = dt
+        self.seed = seed
+        self.inputs = []
+        self.checksums = {}
+        self.ticks = 0
+
+    def write(self, path):
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(self.keys), self.dt, self.seed))
+            for key in self.keys:
+                name = key.encode()
+                f.write(struct.pack("<B", len(name)) + name)
+            # Checksums go right after the inputs of their tick
+            checks = sorted(self.checksums.items())
+            for record in self.inputs:
+                while checks and checks[0][0] < record[0]:
+                    f.write(b"C" + CHECKSUM.pack(*checks.pop(0)))
+                f.write(b"I" + INPUT.pack(*record))
+            for check in checks:
+                f.write(b"C" + CHECKSUM.pack(*check))
+            f.write(b"E" + END.pack(self.ticks))
+
+    @classmethod
+    def read(cls, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < HEADER.size:
+            raise ReplayError("%s: truncated header" % path)
+        magic, version, key_count, dt, seed = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ReplayError("%s: not a version %d input log" % (path, VERSION))
+        offset = HEADER.size
+        keys = []
+        for _ in range(key_count):
+            length = data[offset]
+            keys.append(data[offset + 1:offset + 1 + length].decode())
+            offset += 1 + length
+
+        log = cls(keys, dt, seed)
+        records = {b"I": INPUT, b"C": CHECKSUM, b"E": END}
+        while offset < len(data):
+            tag = data[offset:offset + 1]
+            if tag not in records or offset + 1 + records[tag].size > len(data):
+                raise ReplayError("%s: corrupt record at byte %d" % (path, offset))
+            values = records[tag].unpack_from(data, offset + 1)
+            offset += 1 + records[tag].size
+            if tag == b"I":
+                log.inputs.append(values)
+            elif tag == b"C":
+                log.checksums[values[0]] = values[1]
+            else:
+                log.ticks = values[0]
+                return log
+        raise ReplayError("%s: missing end record" % path)
+
+
+def transform_checksum(nodes):
+    # Rounded to 1e-4 so the checksum tracks the simulation, not float noise
+    values = []
+    for node in nodes:
+        values.extend(node.getPos())
+        values.extend(node.getQuat())
+    return zlib.crc32(struct.pack("<%di" % len(values), *(round(v * 10000) for v in values)))
+
+
+class InputSession:
+    # Records or replays the input a FixedStep simulation sees. Input is
+    # sampled once per step, so a replay reproduces the same path at any
+    # frame rate. Create it before the scene uses random, since the session
+    # seeds it.
+
+    def __init__(self, mode, path):
+        self.mode = mode
+        self.path = path
+        self.tick = 0
+        self.mismatches = []
+        self.finished = False
+        if mode == "replay":
+            self.log = InputLog.read(path)
+            seed = self.log.seed
+        else:
+            seed = int.from_bytes(os.urandom(8), "little")
+            self.log = None
+        random.seed(seed)
+        self.seed = seed
+
+    @classmethod
+    def from_config(cls):
+        # None unless input-record or input-replay is set
+        if input_replay.getValue():
+            return cls("replay", input_replay.getValue())
+        if input_record.getValue():
+            return cls("record", input_record.getValue())
+        return None
+
+    def attach(self, sim, state, keys, nodes, look=None):
+        # state is the key dict the game reads (key_map or held_keys) and
+        # look an optional [dx, dy] mouse delta the step consumes
+        self.state = state
+        self.keys = list(keys)
+        self.nodes = list(nodes)
+        self.look = look
+        self.last = None
+        if self.mode == "record":
+            self.log = InputLog(self.keys, sim.dt, self.seed)
+            atexit.register(self.save)
+        elif self.log.keys != self.keys:
+            raise ReplayError("%s: recorded keys %s, scene has %s" % (self.path, self.log.keys, self.keys))
+        self.pending = iter(self.log.inputs)
+        self.next_input = next(self.pending, None)
+
+        step = sim.step
+
+        def session_step(dt):
+            if self.mode == "record":
+                self.record()
+            elif not self.finished:
+                self.replay()
+            step(dt)
+            self.tick += 1
+            if self.tick % CHECK_EVERY == 0:
+                self.check()
+
+        sim.step = session_step
+
+    def record(self):
+        mask = 0
+        for bit, key in enumerate(self.keys):
+            if self.state[key]:
+                mask |= 1 << bit
+        dx, dy = 0.0, 0.0
+        if self.look is not None:
+            # Step with the float32 values the log stores, or the replay
+            # drifts from the recording
+            dx, dy = struct.unpack("<ff", struct.pack("<ff", *self.look))
+            self.look[:] = [dx, dy]
+        if (mask, dx, dy) != self.last or dx or dy:
+            self.log.inputs.append((self.tick, mask, dx, dy))
+            self.last = (mask, dx, dy)
+
+    def replay(self):
+        dx = dy = 0.0
+        if self.next_input is not None and self.next_input[0] == self.tick:
+            _, mask, dx, dy = self.next_input
+            for bit, key in enumerate(self.keys):
+                self.state[key] = bool(mask & (1 << bit))
+            self.next_input = next(self.pending, None)
+        if self.look is not None:
+            self.look[:] = [dx, dy]
+        if self.tick >= self.log.ticks:
+            self.finish()
+
+    def check(self):
+        checksum = transform_checksum(self.nodes)
+        if self.mode == "record":
+            self.log.checksums[self.tick] = checksum
+        elif self.tick in self.log.checksums and self.log.checksums[self.tick] != checksum:
+            self.mismatches.append(self.tick)
+
+    def finish(self):
+        self.finished = True
+        for key in self.keys:
+            self.state[key] = False
+        if self.mismatches:
+            print("replay: %d ticks, transforms diverged at tick %d" % (self.tick, self.mismatches[0]))
+        else:
+            print("replay: %d ticks, all %d checksums match" % (self.tick, len(self.log.checksums)))
+        messenger.send(REPLAY_DONE_EVENT, [not self.mismatches])
+
+    def save(self):
+        self.log.ticks = self.tick
+        self.log.write(self.path)
+        print("input: recorded %d ticks to %s" % (self.tick, self.path))
@@ -0,0 +1,71 @@
+from panda3d.core import loadPrcFileData
+from pathlib import Path
+import importlib
+import importlib.util
+import sys
+
+
+REPO_DIR = Path(__file__).resolve().parent
+
+
+class Scene:
+    # One entry point of the repo. Panda3D scenes are "module:ShowBase
+    # subclass"; Ursina scenes are script paths whose module body builds
+    # the world. keys are held down when the scene is driven unattended.
+
+    def __init__(self, name, target, kind="panda", keys=()):
+        self.name = name
+        self.target = target
+        self.kind = kind
+        self.keys = keys
+
+    def load(self, window_type="onscreen"):
+        # Build the scene without running it; returns (base, module)
+        if self.kind == "ursina":
+            return self.load_ursina(window_type)
+
+        loadPrcFileData("scene", "window-type %s" % window_type)
+        module_name, class_name = self.target.split(":")
+        module = importlib.import_module(module_name)
+        return getattr(module, class_name)(), module
+
+    def load_ursina(self, window_type):
+        from ursina import Ursina, application
+
+        # Ursina is a singleton, so the script's own Ursina() call gets
+        # this instance and its window settings
+        app = Ursina(window_type=window_type)
+        path = REPO_DIR / self.target
+        application.asset_folder = path.parent
+
+        module_name = "scene_" + self.name.replace("-", "_")
+        spec = importlib.util.spec_from_file_location(module_name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+
+        # Ursina only calls update() on __main__, which the script isn't here
+        if hasattr(module, "update"):
+            def update(task):
+                module.update()
+                return task.cont
+            app.taskMgr.add(update, "update")
+        return app, module
+
+    def hold_keys(self, base, module):
+        if self.kind == "ursina":
+            from ursina import held_keys
+            for key in self.keys:
+                held_keys[key] = 1
+        else:
+            for key in self.keys:
+                base.key_map[key] = True
+
+
+SCENES = {
+    "model": Scene("model", "Model:MyGame", keys=("forward", "left")),
+    "egg": Scene("egg", "egg:IllusionGame", keys=("forward",)),
+    "panda": Scene("panda", "panda:IllusionGame", keys=("forward",)),
+    "car-model": Scene("car-model", "Car Model/model.py", "ursina", keys=("w",)),
+    "racer": Scene("racer", "Car Model/player.py", "ursina", keys=("w",)),
+}
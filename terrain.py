@@ -0,0 +1,234 @@
+from panda3d.core import GeomNode, LVector3
+from concurrent.futures import ThreadPoolExecutor
+from geometry import build_geom
+import numpy as np
+
+
+def lattice(ix, iy, seed):
+    # Hash integer lattice coordinates to [0, 1); the products are meant
+    # to wrap around
+    with np.errstate(over="ignore"):
+        h = (ix.astype(np.uint64) * np.uint64(374761393) + iy.astype(np.uint64) * np.uint64(668265263)
+             + np.uint64(seed) * np.uint64(1442695041)) & np.uint64(0xffffffff)
+        h = ((h ^ (h >> np.uint64(13))) * np.uint64(1274126177)) & np.uint64(0xffffffff)
+    return ((h ^ (h >> np.uint64(16))) & np.uint64(0xffffff)).astype(np.float32) / np.float32(0x1000000)
+
+
+def value_noise(x, y, seed):
+    ix, iy = np.floor(x), np.floor(y)
+    fx, fy = x - ix, y - iy
+    # Smoothstep between the four lattice values
+    fx, fy = fx * fx * (3 - 2 * fx), fy * fy * (3 - 2 * fy)
+    ix, iy = ix.astype(np.int64), iy.astype(np.int64)
+    a, b = lattice(ix, iy, seed), lattice(ix + 1, iy, seed)
+    c, d = lattice(ix, iy + 1, seed), lattice(ix + 1, iy + 1, seed)
+    return (a + (b - a) * fx) * (1 - fy) + (c + (d - c) * fx) * fy
+
+
+def heights(x, y, seed=0, amplitude=6.0, wavelength=60.0, octaves=4, valley=None):
+    # Fractal value noise over world coordinates, so neighbouring chunks
+    # always agree along their shared edge
+    total = np.zeros(np.broadcast(x, y).shape, dtype=np.float32)
+    scale, weight = 1.0 / wavelength, 1.0
+    for octave in range(octaves):
+        total += weight * (value_noise(x * scale, y * scale, seed + octave) - 0.5)
+        scale, weight = scale * 2, weight * 0.5
+    total *= amplitude
+    if valley is not None:
+        # Flatten a strip of this half-width along the y axis, e.g. for a track
+        t = np.clip(np.abs(x) / valley - 1, 0, 1)
+        total *= t * t * (3 - 2 * t)
+    return total
+
+
+class ChunkMesh:
+    # Arrays for one chunk, built off the main thread
+
+    def __init__(self, key, heights, positions, normals, uvs, colors):
+        self.key = key
+        self.heights = heights
+        self.positions = positions
+        self.normals = normals
+        self.uvs = uvs
+        self.colors = colors
+
+
+class ChunkedTerrain:
+    # Height-field terrain cut into square chunks that are generated on a
+    # worker thread and kept resident only within radius chunks of the
+    # player, so memory and per-frame cost don't grow with distance driven.
+    # Works in the ground plane of the default coordinate system, so it
+    # serves both the Z-up Panda3D scenes and the Y-up Ursina ones.
+
+    def __init__(self, parent, chunk_size=32.0, resolution=16, radius=3, seed=0,
+                 amplitude=6.0, valley=None, uv_scale=0.25, builds_per_frame=2):
+        self.root = parent.attachNewNode("terrain")
+        self.chunk_size = chunk_size
+        self.resolution = resolution
+        self.radius = radius
+        self.seed = seed
+        self.amplitude = amplitude
+        self.valley = valley
+        self.uv_scale = uv_scale
+        self.builds_per_frame = builds_per_frame
+
+        self.chunks = {}
+        self.pending = {}
+        self.ready = []
+        self.center = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="terrain")
+
+        # Every chunk shares one grid topology
+        n = resolution + 1
+        rows = np.arange(resolution)[:, None] * n
+        cols = np.arange(resolution)[None, :]
+        corner = (rows + cols).reshape(-1)
+        self.indices = np.stack([corner, corner + 1, corner + n + 1,
+                                 corner + n + 1, corner + n, corner], axis=1).reshape(-1, 3)
+        self.indices = self.indices.astype(np.int32)
+
+        # Panda3D flips the winding for left-handed systems by itself
+        self.right = np.array(LVector3.right(), dtype=np.float32)
+        self.forward = np.array(LVector3.forward(), dtype=np.float32)
+        self.up = np.array(LVector3.up(), dtype=np.float32)
+
+    def chunk_of(self, x, y):
+        return int(np.floor(x / self.chunk_size)), int(np.floor(y / self.chunk_size))
+
+    def wanted(self, center, radius):
+        cx, cy = center
+        keys = [(cx + dx, cy + dy) for dx in range(-radius, radius + 1) for dy in range(-radius, radius + 1)
+                if dx * dx + dy * dy <= radius * radius]
+        # Nearest first, so the ground under the player comes in first
+        return sorted(keys, key=lambda k: (k[0] - cx) ** 2 + (k[1] - cy) ** 2)
+
+    def generate(self, key):
+        # Runs on the worker thread: numpy only, no scene graph access
+        n = self.resolution + 1
+        step = self.chunk_size / self.resolution
+        # One extra sample on every side for seamless normals
+        coords = (np.arange(-1, n + 1, dtype=np.float32)) * step
+        gx = key[0] * self.chunk_size + coords[None, :]
+        gy = key[1] * self.chunk_size + coords[:, None]
+        h = heights(gx, gy, self.seed, self.amplitude, valley=self.valley)
+
+        dhdy, dhdx = np.gradient(h, step)
+        inner = (slice(1, -1), slice(1, -1))
+        h, dhdx, dhdy = h[inner], dhdx[inner], dhdy[inner]
+        # Vertices are relative to the chunk origin to keep float32
+        # precision however far out the chunk is
+        local = coords[1:-1]
+        x = np.broadcast_to(local[None, :], h.shape)
+        y = np.broadcast_to(local[:, None], h.shape)
+
+        positions = (x[..., None] * self.right + y[..., None] * self.forward + h[..., None] * self.up)
+        normals = -dhdx[..., None] * self.right - dhdy[..., None] * self.forward + self.up
+        normals /= np.linalg.norm(normals, axis=-1, keepdims=True)
+        # Seamless across chunks as long as chunk_size * uv_scale is whole
+        uvs = np.stack([x, y], axis=-1) * self.uv_scale
+
+        # Grass in the valleys, drier on the hills
+        t = np.clip(h / max(self.amplitude, 1e-6) + 0.5, 0, 1)[..., None]
+        colors = np.concatenate([(0.25 + 0.3 * t), (0.6 - 0.15 * t), (0.2 + 0.1 * t), np.ones_like(t)], axis=-1)
+
+        return ChunkMesh(key, np.ascontiguousarray(h, dtype=np.float32),
+                         positions.reshape(-1, 3), normals.reshape(-1, 3),
+                         uvs.reshape(-1, 2), colors.reshape(-1, 4))
+
+    def set_radius(self, radius):
+        # Chunks are loaded or dropped to match on the next update
+        self.radius = radius
+        self.center = None
+
+    def update(self, x, y):
+        # Call every frame with the player's ground-plane position
+        center = self.chunk_of(x, y)
+        if center != self.center:
+            self.center = center
+            keep = set(self.wanted(center, self.radius + 1))
+            for key in list(self.chunks):
+                # One chunk of slack so driving along a border doesn't
+                # reload the same chunks back and forth
+                if key not in keep:
+                    self.chunks.pop(key)[0].removeNode()
+            for key in list(self.pending):
+                if key not in keep:
+                    self.pending.pop(key).cancel()
+            queued = {mesh.key for mesh in self.ready}
+            for key in self.wanted(center, self.radius):
+                if key not in self.chunks and key not in self.pending and key not in queued:
+                    self.pending[key] = self.executor.submit(self.generate, key)
+
+        for key, future in list(self.pending.items()):
+            if future.done():
+                del self.pending[key]
+                if not future.cancelled():
+                    self.ready.append(future.result())
+
+        # Geom creation happens here on the main thread, a few per frame
+        self.ready.sort(key=lambda m: (m.key[0] - center[0]) ** 2 + (m.key[1] - center[1]) ** 2)
+        reach = (self.radius + 1) ** 2
+        self.ready = [m for m in self.ready
+                      if (m.key[0] - center[0]) ** 2 + (m.key[1] - center[1]) ** 2 <= reach]
+        for mesh in self.ready[:self.builds_per_frame]:
+            self.attach(mesh)
+        del self.ready[:self.builds_per_frame]
+
+    def attach(self, mesh):
+        node = GeomNode("chunk %d,%d" % mesh.key)
+        node.addGeom(build_geom(mesh.positions, self.indices, mesh.normals, mesh.uvs, mesh.colors,
+                                name="terrain"))
+        chunk = self.root.attachNewNode(node)
+        origin = (mesh.key[0] * self.right + mesh.key[1] * self.forward) * self.chunk_size
+        chunk.setPos(*origin.tolist())
+        self.chunks[mesh.key] = (chunk, mesh.heights)
+
+    def grid(self, key):
+        # Height samples of a chunk. One that isn't built yet is finished
+        # (or generated) right here, so the answer never depends on how far
+        # the worker has got.
+        if key in self.chunks:
+            return self.chunks[key][1]
+        for mesh in self.ready:
+            if mesh.key == key:
+                return mesh.heights
+        future = self.pending.pop(key, None)
+        mesh = future.result() if future is not None and not future.cancelled() else self.generate(key)
+        self.ready.append(mesh)
+        return mesh.heights
+
+    def height_at(self, x, y):
+        # Bilinear lookup in the chunk's height samples
+        key = self.chunk_of(x, y)
+        grid = self.grid(key)
+        step = self.chunk_size / self.resolution
+        u = (x - key[0] * self.chunk_size) / step
+        v = (y - key[1] * self.chunk_size) / step
+        i, j = min(int(u), self.resolution - 1), min(int(v), self.resolution - 1)
+        fu, fv = u - i, v - j
+        return float((grid[j, i] * (1 - fu) + grid[j, i + 1] * fu) * (1 - fv)
+                     + (grid[j + 1, i] * (1 - fu) + grid[j + 1, i + 1] * fu) * fv)
+
+    def triangles(self, min_x, min_y, max_x, max_y):
+        # (N, 3, 3) triangles of every chunk overlapping the ground-plane
+        # area, in the space of root (e.g. for bvh.BVH). Chunks are
+        # generated from scratch, so this is safe on a worker thread.
+        lo, hi = self.chunk_of(min_x, min_y), self.chunk_of(max_x, max_y)
+        triangles = []
+        for i in range(lo[0], hi[0] + 1):
+            for j in range(lo[1], hi[1] + 1):
+                mesh = self.generate((i, j))
+                origin = (i * self.right + j * self.forward) * self.chunk_size
+                triangles.append((mesh.positions + origin)[self.indices])
+        return np.concatenate(triangles)
+
+    def resident_bytes(self):
+        return sum(np_node.node().getGeom(0).getVertexData().getArray(0).getDataSizeBytes() + grid.nbytes
+                   for np_node, grid in self.chunks.values())
+
+    def destroy(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.root.removeNode()
+        self.chunks.clear()
+        self.pending.clear()
+        self.ready.clear()
@@ -0,0 +1,196 @@
+from panda3d.core import (
+    ConfigVariableString, Filename, PNMImage, SamplerState, Texture, TexturePool
+)
+from asset_cache import CACHE_DIR, REPO_DIR
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+
+# Bump whenever the processing changes so stale cache entries are rebuilt
+PIPELINE_VERSION = 2
+
+TEXTURE_CACHE_DIR = os.path.join(CACHE_DIR, "textures")
+TEXTURE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tga", ".bmp")
+
+# Largest edge allowed per quality tier
+TIERS = {"low": 256, "medium": 1024, "high": 2048}
+
+texture_quality = ConfigVariableString(
+    "texture-quality", "auto",
+    "Texture tier to load: low, medium, high, or auto to pick from the GSG.")
+
+
+class TextureBuildError(Exception):
+    pass
+
+
+def pick_tier(gsg=None):
+    tier = texture_quality.getValue()
+    if tier != "auto":
+        if tier not in TIERS:
+            raise TextureBuildError("unknown texture-quality %r" % tier)
+        return tier
+    if gsg is None:
+        return "medium"
+    # Software renderers pay for every texel on the CPU
+    renderer = gsg.getDriverRenderer().lower()
+    if "llvmpipe" in renderer or "softpipe" in renderer:
+        return "low"
+    max_size = gsg.getMaxTextureDimension()
+    for tier in ("high", "medium"):
+        if max_size < 0 or max_size >= TIERS[tier]:
+            return tier
+    return "low"
+
+
+def floor_power_of_two(value):
+    return 1 << (max(int(value), 1).bit_length() - 1)
+
+
+def target_size(width, height, cap):
+    # Fit within the tier's cap, then round each edge down to a power of two
+    scale = min(1.0, cap / max(width, height))
+    return floor_power_of_two(width * scale), floor_power_of_two(height * scale)
+
+
+def supports_dxt(gsg=None):
+    # Without a GSG to ask, build for the common case of DXT support
+    if gsg is None:
+        return True
+    return all(gsg.getSupportsCompressedTextureFormat(mode) for mode in (Texture.CM_dxt1, Texture.CM_dxt5))
+
+
+def cache_key(path, tier, compress=True):
+    # Compressed and raw builds of a texture are separate entries, so a GSG
+    # without DXT support never loads a compressed one
+    digest = hashlib.sha256()
+    digest.update(("%s:%s:%d:" % (tier, "dxt" if compress else "raw", PIPELINE_VERSION)).encode())
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def process_texture(path, tier, compress=True):
+    # Downscale to the tier, pre-generate the full mip chain and compress
+    # it, so the GPU-ready texture can be loaded without any decoding. When
+    # compression isn't wanted or fails (Panda3D built without squish) the
+    # mips are kept raw; the texture's ram image compression says which.
+    source = PNMImage()
+    if not source.read(Filename.fromOsSpecific(path)):
+        raise TextureBuildError("%s: could not be decoded" % path)
+
+    width, height = target_size(source.getXSize(), source.getYSize(), TIERS[tier])
+    image = PNMImage(width, height, source.getNumChannels(), source.getMaxval())
+    image.gaussianFilterFrom(1.0, source)
+
+    tex = Texture(os.path.basename(path))
+    tex.load(image)
+    tex.setMinfilter(SamplerState.FT_linear_mipmap_linear)
+    tex.setMagfilter(SamplerState.FT_linear)
+    tex.setAnisotropicDegree(4)
+    tex.generateRamMipmapImages()
+    if compress and not tex.compressRamImage(Texture.CM_dxt5 if image.hasAlpha() else Texture.CM_dxt1):
+        tex.setCompression(Texture.CM_off)
+    return tex
+
+
+def compile_texture(path, tier, cache_dir=TEXTURE_CACHE_DIR, compress=True):
+    if not os.path.isfile(path):
+        raise TextureBuildError("%s: file not found" % path)
+    target = os.path.join(cache_dir, "%s.txo" % cache_key(path, tier, compress))
+    if os.path.exists(target):
+        return target, False
+
+    tex = process_texture(path, tier, compress)
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, staging = tempfile.mkstemp(suffix=".txo", dir=cache_dir)
+    os.close(fd)
+    if not tex.write(Filename.fromOsSpecific(staging)):
+        os.remove(staging)
+        raise TextureBuildError("%s: could not write %s" % (path, target))
+    os.replace(staging, target)
+    return target, True
+
+
+def load_texture(path, tier=None, gsg=None, cache_dir=TEXTURE_CACHE_DIR):
+    # Load a texture through the processed cache, building the entry the
+    # first time; the tier defaults to the texture-quality setting, and
+    # the mips are only compressed if the GSG can sample DXT
+    if tier is None:
+        tier = pick_tier(gsg)
+    target, _ = compile_texture(os.path.abspath(str(path)), tier, cache_dir, supports_dxt(gsg))
+    return TexturePool.loadTexture(Filename.fromOsSpecific(target))
+
+
+def stored_format(tex):
+    compression = tex.getRamImageCompression()
+    return "raw" if compression == Texture.CM_off else Texture.formatCompressionMode(compression)
+
+
+def resident_size(tex):
+    return sum(tex.getRamMipmapImageSize(n) for n in range(tex.getNumRamMipmapImages()))
+
+
+def find_textures(root=REPO_DIR):
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith(".") and d != "__pycache__"]
+        for name in filenames:
+            if name.lower().endswith(TEXTURE_EXTENSIONS):
+                found.append(os.path.join(dirpath, name))
+    return sorted(found)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build mipmapped, compressed texture cache entries.")
+    parser.add_argument("paths", nargs="*", help="textures to build (default: every texture in the repo)")
+    parser.add_argument("--tier", choices=sorted(TIERS), action="append",
+                        help="tier to build; may be repeated (default: all)")
+    parser.add_argument("--cache-dir", default=TEXTURE_CACHE_DIR)
+    args = parser.parse_args(argv)
+
+    paths = [os.path.abspath(p) for p in args.paths] or find_textures()
+    tiers = args.tier or sorted(TIERS, key=TIERS.get)
+    errors = []
+
+    print(f"{'texture':<40} {'tier':>6} {'decode ms':>10} {'load ms':>8} {'before KB':>10} {'after KB':>9} {'format':>7}")
+    for path in paths:
+        # What the scenes paid before: a full decode of the source image
+        start = time.perf_counter()
+        original = TexturePool.loadTexture(Filename.fromOsSpecific(path), 0, False)
+        decode = time.perf_counter() - start
+        if original is None:
+            errors.append("%s: could not be decoded" % path)
+            continue
+        before = resident_size(original)
+        TexturePool.releaseTexture(original)
+
+        for tier in tiers:
+            try:
+                target, _ = compile_texture(path, tier, args.cache_dir)
+            except TextureBuildError as e:
+                errors.append(str(e))
+                break
+            start = time.perf_counter()
+            tex = TexturePool.loadTexture(Filename.fromOsSpecific(target))
+            load = time.perf_counter() - start
+            after = resident_size(tex)
+            stored = stored_format(tex)
+            TexturePool.releaseTexture(tex)
+
+            name = os.path.relpath(path, REPO_DIR)
+            print(f"{name:<40} {tier:>6} {decode * 1000:>10.2f} {load * 1000:>8.2f} "
+                  f"{before / 1024:>10.0f} {after / 1024:>9.0f} {stored:>7}")
+
+    for error in errors:
+        print("error: %s" % error, file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+from panda3d.core import LODNode, NodePath
+from asset_cache import resolve
+from async_loader import placeholder_box
+from bvh import instance_triangles
+from lod import LODInstances, count_triangles
+
+
+def tree_source(path):
+    # A part's LOD bundle, cached BAM or source file, whichever is built.
+    # Not the optimized copies: their quantized vertices are decoded by a
+    # node transform, which the instanced tree can't keep.
+    return resolve(path, lod=True, optimized=False)
+
+
+def part_levels(model):
+    # The detail levels of a model loaded from an LOD bundle (see
+    # asset_cache.compile_lods), finest first; just the model otherwise
+    lod = model if model.node().isOfType(LODNode.getClassType()) else model.find("**/+LODNode")
+    if lod.isEmpty():
+        return [model]
+    return list(lod.getChildren())
+
+
+class Forest:
+    # All trees share one trunk+canopy mesh that is drawn with hardware
+    # instancing, so the whole forest costs one node and one draw call per
+    # material and detail level no matter how many trees it holds. Given a
+    # camera, distant trees use simplified levels and the farthest aren't
+    # drawn at all. The levels come from the parts' LOD bundles, built
+    # ahead of time by asset_cache.py (python asset_cache.py); nothing is
+    # simplified at run time, and a part without a bundle has one level.
+
+    def __init__(self, loader, parent, trunk_model="models/box", canopy_model="models/sphere",
+                 async_loader=None, camera=None):
+        self.mesh = LODInstances(parent, "forest", camera=camera)
+
+        # Trees can be added straight away; with an async loader they are
+        # drawn with placeholder boxes for parts until both have loaded
+        sources = {"trunk": tree_source(trunk_model), "canopy": tree_source(canopy_model)}
+        if async_loader is None:
+            self.build(loader.loadModel(sources["trunk"] or trunk_model),
+                       loader.loadModel(sources["canopy"] or canopy_model))
+        else:
+            self.build(placeholder_box(), placeholder_box())
+            parts = {}
+
+            def part_loaded(name, model):
+                # A part that fails to load keeps its placeholder box
+                parts[name] = model if model is not None else placeholder_box()
+                if len(parts) == 2:
+                    self.build(parts["trunk"], parts["canopy"])
+
+            for name, source in sources.items():
+                if source is None:
+                    part_loaded(name, None)
+                else:
+                    async_loader.load(source, lambda model, name=name: part_loaded(name, model))
+
+    def build(self, trunk, leaves):
+        # Level i of the tree is level i of each part, or its last level
+        # when it has fewer
+        trunks, canopies = part_levels(trunk), part_levels(leaves)
+        self.levels = [self.tree(trunks[min(i, len(trunks) - 1)], canopies[min(i, len(canopies) - 1)])
+                       for i in range(max(len(trunks), len(canopies)))]
+        self.triangles = [count_triangles(level) for level in self.levels]
+        self.mesh.set_levels(self.levels)
+
+    def tree(self, trunk, leaves):
+        tree = NodePath("tree")
+
+        # Tree trunk
+        trunk = trunk.copyTo(tree)
+        trunk.setScale(0.5, 0.5, 2)
+        trunk.setColor(0.55, 0.27, 0.07, 1)
+        trunk.setPos(0, 0, 1)
+
+        # Tree leaves
+        leaves = leaves.copyTo(tree)
+        leaves.setScale(2)
+        leaves.setColor(0.0, 0.6, 0.0, 1)
+        leaves.setPos(0, 0, 4)
+
+        # Bake the part transforms and colors into the vertices so the two
+        # parts collapse into as few Geoms as possible
+        tree.flattenStrong()
+        return tree
+
+    def __len__(self):
+        return len(self.mesh)
+
+    def add_tree(self, x, y, z=0, scale=1.0, tint=(1, 1, 1), heading=0.0):
+        return self.mesh.add((x, y, z), scale, tint, heading)
+
+    def add_trees(self, records):
+        return self.mesh.add_many(records)
+
+    def remove_tree(self, handle):
+        self.mesh.remove(handle)
+
+    def move_tree(self, handle, x, y, z=0):
+        self.mesh.update(handle, pos=(x, y, z))
+
+    def set_draw_distance(self, distance):
+        # Trees further from the camera aren't drawn
+        self.mesh.set_far(distance)
+
+    def set_lod_bias(self, bias):
+        self.mesh.set_bias(bias)
+
+    def tree_triangles(self):
+        # Triangles of every tree at full detail, in the parent's space (e.g.
+        # for bvh.BVH); none until the mesh has loaded
+        if not self.mesh.meshes:
+            return instance_triangles(None, [])
+        return instance_triangles(self.levels[0], self.mesh.records)
+
+    def destroy(self):
+        self.mesh.destroy()